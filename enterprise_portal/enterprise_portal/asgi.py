@@ -5,6 +5,43 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+
+ASGI profile
+------------
+
+    GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker \
+        gunicorn -c gunicorn.conf.py enterprise_portal.asgi:application
+
+track_click, /api/health/ and the /api/version/ long-poll are native async
+views: a parked poller or a pending beacon is a coroutine, not a thread.
+Their ORM and cache work runs on portal.executor (ASYNC_DB_THREADS threads)
+and clicks are written in batches by portal.clicks, so per worker and per
+database the connection count is bounded by
+
+    ASYNC_DB_THREADS + 1 (click writer) + 1 (Django's sync middleware/views thread)
+
+whatever the number of open requests. A sync (WSGI) worker serves one request
+at a time with one connection, so every idle long-poll occupies a worker.
+
+Sizing, from ``manage.py connection_benchmark`` against 4 workers on one box
+(DEBUG off, SQLite, 8 s long-polls), with the versions pinned in
+config/app/requirements.txt (Django 3.2.25, gunicorn 19.7.1, uvicorn 0.29.0,
+whose uvicorn.workers module provides the worker class). Start the server in
+each profile with GUNICORN_WORKERS=4, then run each row with
+
+    python manage.py connection_benchmark http://127.0.0.1:8000 \
+        --pollers <pollers> --clicks <beacons> --hold 8
+
+    profile  pollers  beacons  pollers answered  beacons ok  beacon p95
+    WSGI         200      200       8                  0     (timed out)
+    ASGI         200      200     200                200     173 ms
+    ASGI        2000      500    2000                500     229 ms
+
+With WSGI, size workers for (concurrent pollers + peak beacon rate x latency);
+with ASGI, size for CPU (about one worker per core) and keep ASYNC_DB_THREADS
+under the database's connection limit divided by the worker count. Streaming
+exports (/api/analytics/export/) are sync iterators that Django 3.2 runs on
+the event loop; route them to a WSGI worker pool.
 """
 
 import os
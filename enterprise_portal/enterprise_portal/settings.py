@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
 import os
+from importlib.util import find_spec
 from pathlib import Path
 from django.utils.translation import gettext_lazy as _
 
@@ -52,11 +53,12 @@ LOGIN_REDIRECT_URL = '/'
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'portal.middleware.PortalSessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'portal.maintenance.MaintenanceMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -75,11 +77,39 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'portal.icons.icon_stylesheet',
             ],
         },
     },
 ]
 
+# Keep compiled templates when gunicorn.conf.py asks for it, DEBUG or not, so
+# what the pre-fork warm-up compiles (portal.warmup) is shared by every worker;
+# Django itself only caches them when DEBUG is off
+if os.environ.get('PORTAL_CACHED_TEMPLATES'):
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [('django.template.loaders.cached.Loader', [
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    ])]
+
+# Optional Jinja2 engine for the public portal templates (base/jinja2,
+# portal/jinja2), only configured when Jinja2 is installed
+if find_spec('jinja2') is not None:
+    TEMPLATES.append({
+        'NAME': 'jinja2',
+        'BACKEND': 'django.template.backends.jinja2.Jinja2',
+        'DIRS': [],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'environment': 'portal.jinja2env.environment',
+            'context_processors': [
+                'django.contrib.auth.context_processors.auth',
+                'portal.icons.icon_stylesheet',
+            ],
+        },
+    })
+
 WSGI_APPLICATION = 'enterprise_portal.wsgi.application'
 
 
@@ -90,9 +120,43 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    # Click analytics get their own file so ingestion never holds the content
+    # database's write lock. Run `migrate --database=analytics` after `migrate`.
+    'analytics': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'analytics.sqlite3',
+    },
+}
+
+DATABASE_ROUTERS = ['portal.routers.AnalyticsRouter']
+
+
+# Cache
+# Sessions and the authenticated user are served from a cache shared by all
+# workers on the host; the database only sees session writes (write-through).
+# Each cache is a memory-mapped hash table (see portal.mmapcache): MAX_ENTRIES
+# slots of SLOT_SIZE bytes, so the files take MAX_ENTRIES * SLOT_SIZE at most.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'portal.mmapcache.MmapCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'default.mmap'),
+        'OPTIONS': {'MAX_ENTRIES': 5000, 'SLOT_SIZE': 2048},
+    },
+    'sessions': {
+        'BACKEND': 'portal.mmapcache.MmapCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'sessions.mmap'),
+        'OPTIONS': {'MAX_ENTRIES': 20000, 'SLOT_SIZE': 2048},
+    },
 }
 
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'sessions'
+
+AUTHENTICATION_BACKENDS = ['portal.backends.CachedModelBackend']
+AUTH_USER_CACHE_TIMEOUT = 60  # seconds
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -157,3 +221,86 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, "static"), ]
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Portal
+
+# "Frequently used" strip on the home page (see portal.frequency)
+FREQUENT_CARDS_LIMIT = 5
+FREQUENT_CARDS_HALF_LIFE_DAYS = 7
+
+# Live "most used right now" summaries (see portal.trending)
+TRENDING_CHECKPOINT_SECONDS = 60
+
+# Static pre-rendered pages for anonymous visitors (see portal.prerender)
+PRERENDER_ROOT = os.path.join(BASE_DIR, 'prerendered')
+
+# Views rendered with the Jinja2 engine ('home', 'factory'); startup fails when
+# any is listed but Jinja2 is not installed
+PORTAL_JINJA2_VIEWS = []
+
+# Async endpoints (see enterprise_portal/asgi.py): database threads per worker,
+# click batching and the longest a version long-poll is held open
+ASYNC_DB_THREADS = 4
+CLICK_BATCH_SIZE = 200
+CLICK_FLUSH_SECONDS = 0.5
+LONG_POLL_SECONDS = 25
+
+# Click ingestion filter (see portal.ingest): dedup window, per-IP token
+# bucket, and the load (clicks/s per process, or clicks waiting to be
+# written) above which clicks are sampled 1-in-N with weight N
+CLICK_DEDUP_SECONDS = 5
+CLICK_DEDUP_ENTRIES = 50000
+CLICK_IP_RATE = 2
+CLICK_IP_BURST = 20
+CLICK_IP_BUCKETS = 10000
+CLICK_SAMPLE_ABOVE = 200
+CLICK_MAX_PENDING = 5000
+
+# Reverse proxies (addresses or networks) whose X-Forwarded-For is believed
+# when finding a visitor's IP (see portal.ingest.client_ip)
+TRUSTED_PROXIES = ('127.0.0.1', '::1')
+
+# Change feed for incremental sync (see portal.journal): entries per page, days
+# delete entries are kept before compaction drops them, and how long fresh
+# entries are held back (raise it on databases with concurrent writers)
+CHANGE_FEED_PAGE_SIZE = 500
+CHANGE_JOURNAL_RETENTION_DAYS = 30
+CHANGE_FEED_SETTLE_SECONDS = 0
+
+# Maintenance mode (see portal.maintenance): seconds clients are told to wait
+# (Retry-After) and paths that stay reachable for everyone
+MAINTENANCE_RETRY_AFTER = 600
+MAINTENANCE_EXEMPT_PATHS = ('/admin/', '/login/', '/logout/', '/i18n/', '/api/health/', '/favicon.ico')
+
+# Self-hosted icon subset (see portal.icons, manage.py build_icons): an
+# unpacked Font Awesome Free download to take the SVGs from, and where the
+# generated stylesheet is written and served
+ICON_SOURCE_DIR = os.path.join(BASE_DIR, 'assets', 'fontawesome')
+ICON_SPRITE_ROOT = os.path.join(MEDIA_ROOT, 'icons')
+ICON_SPRITE_URL = MEDIA_URL + 'icons/'
+
+# Rendered section fragments each worker keeps (see portal.fragments)
+SECTION_FRAGMENT_CACHE_ENTRIES = 2000
+
+# Uploads are named after their content, so each file is stored once and can
+# be cached forever (see portal.storage; unreferenced ones: manage.py gc_media)
+DEFAULT_FILE_STORAGE = 'portal.storage.ContentAddressedStorage'
+
+# Background jobs (see portal.jobs, manage.py run_jobs): jobs a worker runs at
+# once, seconds between polls for due jobs (and heartbeats of running jobs),
+# seconds without a heartbeat before a running job's worker counts as gone and
+# the job is queued again, first retry delay (doubled per attempt), days
+# finished jobs are kept, and running jobs in-process on commit instead
+# (development without a worker)
+JOB_WORKER_CONCURRENCY = 2
+JOB_POLL_SECONDS = 2
+JOB_TIMEOUT_SECONDS = 120
+JOB_RETRY_SECONDS = 30
+JOB_RETENTION_DAYS = 7
+JOB_RUN_INLINE = False
+
+# Re-render the static pages (see portal.prerender) this many seconds after
+# the last catalogue or settings change, through the job queue
+PRERENDER_ON_CHANGE = True
+PRERENDER_DELAY_SECONDS = 10
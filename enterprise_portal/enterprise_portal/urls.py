@@ -23,7 +23,7 @@ from rest_framework.routers import DefaultRouter
 from base.views import index
 from django.conf.urls.static import static
 from django.conf import settings
-from portal.views import portal_home
+from portal.views import portal_home, serve_media
 
 router = DefaultRouter()
 
@@ -34,7 +34,7 @@ urlpatterns = [
     url(r'^favicon\.ico$', RedirectView.as_view(url='/static/favicon.ico')),
 
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT) \
-  + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+  + static(settings.MEDIA_URL, view=serve_media, document_root=settings.MEDIA_ROOT)
 
 urlpatterns += i18n_patterns(
     url(r'^$', index, name='index'),
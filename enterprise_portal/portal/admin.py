@@ -1,6 +1,19 @@
-from django.contrib import admin
+import json
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.auth.models import User
+from django.db.models import Q, Sum
+from django.http import HttpResponse
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
 from django.utils.html import format_html
-from .models import PortalSection, SystemCard, FactoryButton, PortalSettings, PortalAnalytics
+from . import jobs
+from .agents import pack_ip
+from .catalogue import export_catalogue, import_catalogue
+from .models import PortalSection, SystemCard, FactoryButton, PortalSettings, PortalAnalytics, Job
 
 
 @admin.register(PortalSettings)
@@ -32,6 +45,20 @@ class PortalSettingsAdmin(admin.ModelAdmin):
         super().save_model(request, obj, form, change)
 
 
+class GroupRestrictionMixin:
+    """Flags items whose group restriction differs from what the form showed (see RESTRICTED_HELP)"""
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        obj = form.instance
+        has_groups = obj.groups.exists()
+        if has_groups and not obj.restricted:
+            type(obj).objects.filter(pk=obj.pk).update(restricted=True)
+            messages.warning(request, f'"{obj}" still has groups, so it stays restricted to them')
+        elif obj.restricted and not has_groups:
+            messages.warning(request, f'"{obj}" is restricted to no group: only staff see it')
+
+
 class SystemCardInline(admin.TabularInline):
     model = SystemCard
     extra = 0
@@ -40,13 +67,14 @@ class SystemCardInline(admin.TabularInline):
 
 
 @admin.register(PortalSection)
-class PortalSectionAdmin(admin.ModelAdmin):
+class PortalSectionAdmin(GroupRestrictionMixin, admin.ModelAdmin):
     list_display = ('name', 'name_en', 'color_display', 'card_count', 'order', 'is_active', 'updated_at')
-    list_filter = ('is_active', 'created_at', 'updated_at')
+    list_filter = ('is_active', 'restricted', 'created_at', 'updated_at')
     search_fields = ('name', 'name_en', 'description')
     ordering = ('order', 'name')
     inlines = [SystemCardInline]
     readonly_fields = ('created_at', 'updated_at', 'updated_by')
+    filter_horizontal = ('groups',)
 
     fieldsets = (
         ('Basic Information', {
@@ -56,7 +84,7 @@ class PortalSectionAdmin(admin.ModelAdmin):
             'fields': ('icon', 'color', 'order')
         }),
         ('Status', {
-            'fields': ('is_active',)
+            'fields': ('is_active', 'restricted', 'groups')
         }),
         ('Meta', {
             'fields': ('created_at', 'updated_at', 'updated_by'),
@@ -83,12 +111,13 @@ class PortalSectionAdmin(admin.ModelAdmin):
 
 
 @admin.register(SystemCard)
-class SystemCardAdmin(admin.ModelAdmin):
+class SystemCardAdmin(GroupRestrictionMixin, admin.ModelAdmin):
     list_display = ('name', 'section', 'url_display', 'status_display', 'access_level', 'order', 'is_active')
-    list_filter = ('section', 'status', 'access_level', 'is_active', 'is_external', 'created_at')
+    list_filter = ('section', 'status', 'access_level', 'restricted', 'is_active', 'is_external', 'created_at')
     search_fields = ('name', 'name_en', 'description', 'url')
     ordering = ('section__order', 'order', 'name')
     readonly_fields = ('created_at', 'updated_at', 'updated_by', 'click_count')
+    filter_horizontal = ('groups',)
 
     fieldsets = (
         ('Basic Information', {
@@ -98,7 +127,7 @@ class SystemCardAdmin(admin.ModelAdmin):
             'fields': ('icon', 'icon_color')
         }),
         ('Settings', {
-            'fields': ('status', 'access_level', 'is_external', 'order')
+            'fields': ('status', 'access_level', 'restricted', 'groups', 'is_external', 'order')
         }),
         ('Status', {
             'fields': ('is_active',)
@@ -134,7 +163,8 @@ class SystemCardAdmin(admin.ModelAdmin):
     status_display.short_description = 'Status'
 
     def click_count(self, obj):
-        return obj.analytics.count()
+        # Sampled rows stand for `weight` clicks each
+        return obj.analytics.aggregate(clicks=Sum('weight'))['clicks'] or 0
 
     click_count.short_description = 'Total Clicks'
 
@@ -143,13 +173,23 @@ class SystemCardAdmin(admin.ModelAdmin):
         super().save_model(request, obj, form, change)
 
 
+class CatalogueImportForm(forms.Form):
+    file = forms.FileField(help_text='JSON file written by export_portal or the export action')
+    prune = forms.BooleanField(required=False, help_text='Delete sections and cards missing from the file within the '
+                                                         'factories it has, and factories for a full export')
+    dry_run = forms.BooleanField(required=False, help_text='Only report the changes')
+
+
 @admin.register(FactoryButton)
-class FactoryButtonAdmin(admin.ModelAdmin):
+class FactoryButtonAdmin(GroupRestrictionMixin, admin.ModelAdmin):
     list_display = ('name', 'url_display', 'color_display', 'access_level', 'order', 'is_active')
-    list_filter = ('access_level', 'is_active', 'created_at')
+    list_filter = ('access_level', 'restricted', 'is_active', 'created_at')
     search_fields = ('name', 'name_en', 'description', 'url')
     ordering = ('order', 'name')
     readonly_fields = ('created_at', 'updated_at', 'updated_by')
+    filter_horizontal = ('groups',)
+    actions = ['export_selected', 'export_selected_with_home']
+    change_list_template = 'admin/portal/factorybutton/change_list.html'
 
     fieldsets = (
         ('Basic Information', {
@@ -159,7 +199,7 @@ class FactoryButtonAdmin(admin.ModelAdmin):
             'fields': ('icon', 'background_color', 'text_color', 'order')
         }),
         ('Settings', {
-            'fields': ('access_level', 'is_active')
+            'fields': ('access_level', 'restricted', 'groups', 'is_active')
         }),
         ('Meta', {
             'fields': ('created_at', 'updated_at', 'updated_by'),
@@ -185,17 +225,107 @@ class FactoryButtonAdmin(admin.ModelAdmin):
         obj.updated_by = request.user
         super().save_model(request, obj, form, change)
 
+    def _export(self, queryset, include_home):
+        data = export_catalogue(factory_ids=list(queryset.values_list('id', flat=True)), include_home=include_home)
+        response = HttpResponse(json.dumps(data, ensure_ascii=False, indent=2),
+                                content_type='application/json; charset=utf-8')
+        filename = 'portal-{}.json'.format(timezone.localtime().strftime('%Y%m%d-%H%M'))
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    def export_selected(self, request, queryset):
+        return self._export(queryset, include_home=False)
+
+    export_selected.short_description = 'Export selected factories with sections and cards'
+
+    def export_selected_with_home(self, request, queryset):
+        return self._export(queryset, include_home=True)
+
+    export_selected_with_home.short_description = 'Export selected factories and the home page'
+
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_view), name='portal_factorybutton_import'),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        if not self.has_add_permission(request) or not self.has_change_permission(request):
+            return redirect('admin:portal_factorybutton_changelist')
+
+        form = CatalogueImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            try:
+                data = json.load(form.cleaned_data['file'])
+                stats = import_catalogue(data, user=request.user, prune=form.cleaned_data['prune'],
+                                         dry_run=form.cleaned_data['dry_run'])
+            except (ValueError, KeyError) as e:
+                messages.error(request, f'Import failed: {e}')
+            else:
+                summary = '; '.join(
+                    '{}: {}'.format(model, ', '.join(f'{count} {action}' for action, count in counts.items()))
+                    for model, counts in stats.items()
+                )
+                prefix = 'Dry run' if form.cleaned_data['dry_run'] else 'Imported'
+                messages.success(request, f'{prefix} - {summary}')
+                if not form.cleaned_data['dry_run']:
+                    return redirect('admin:portal_factorybutton_changelist')
+
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            form=form,
+            title='Import portal catalogue',
+        )
+        return TemplateResponse(request, 'admin/portal/factorybutton/import.html', context)
+
 
 @admin.register(PortalAnalytics)
 class PortalAnalyticsAdmin(admin.ModelAdmin):
-    list_display = ('card', 'user', 'ip_address', 'clicked_at')
-    list_filter = ('clicked_at', 'card__section', 'card')
-    search_fields = ('card__name', 'user__username', 'ip_address')
-    readonly_fields = ('card', 'user', 'ip_address', 'user_agent', 'clicked_at')
+    # Analytics live in their own database, so no joins to cards/users here
+    list_display = ('card', 'user', 'ip_address', 'agent', 'clicked_at', 'weight')
+    list_filter = ('clicked_at', 'agent__device', 'agent__browser', 'card')
+    list_select_related = ('agent',)  # same database
+    search_fields = ('agent__string',)
+    readonly_fields = ('card', 'user', 'ip_address', 'agent', 'clicked_at', 'weight')
+    exclude = ('ip',)
     ordering = ('-clicked_at',)
 
+    def get_search_results(self, request, queryset, search_term):
+        queryset, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            ip = pack_ip(search_term)
+            if ip:
+                queryset |= self.model.objects.filter(ip=ip)
+            card_ids = list(SystemCard.objects.filter(name__icontains=search_term).values_list('id', flat=True))
+            user_ids = list(User.objects.filter(username__icontains=search_term).values_list('id', flat=True))
+            queryset |= self.model.objects.filter(Q(card_id__in=card_ids) | Q(user_id__in=user_ids))
+        return queryset, may_have_duplicates
+
     def has_add_permission(self, request):
         return False  # Prevent manual creation
 
     def has_change_permission(self, request, obj=None):
-        return False  # Prevent editing
\ No newline at end of file
+        return False  # Prevent editing
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    # Rows are written by portal.jobs and manage.py run_jobs; the admin only inspects and retries
+    list_display = ('name', 'status', 'run_at', 'attempts', 'max_attempts', 'claimed_by', 'finished_at')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'key', 'last_error')
+    readonly_fields = [field.name for field in Job._meta.fields]
+    ordering = ('-run_at',)
+    actions = ['retry_selected']
+
+    def retry_selected(self, request, queryset):
+        queued = jobs.retry(queryset.values_list('id', flat=True))
+        messages.success(request, f'Queued {queued} failed jobs again')
+
+    retry_selected.short_description = 'Retry selected failed jobs'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,138 @@
+"""
+Dimension storage for click analytics.
+
+Nearly every click repeats a user agent already seen, so PortalAnalytics
+rows reference an interned UserAgent row instead of carrying the string;
+the browser, OS and device are parsed once per distinct string, when it is
+interned. IPs are stored packed (4 bytes for IPv4, 16 for IPv6) rather than
+as text.
+
+Interning happens in the click writer thread (portal.clicks) a batch at a
+time: ids of recently seen strings are remembered per process, the rest
+take one lookup and at most one insert per batch.
+"""
+import hashlib
+import ipaddress
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from .ingest import BOT_AGENTS
+from .models import UserAgent
+
+
+KNOWN_IDS = 10000
+
+# (browser, version pattern), first match wins: Edge and Opera also claim Chrome, Chrome claims Safari
+BROWSERS = (
+    ('Edge', re.compile(r'Edg(?:e|A|iOS)?/([\d.]+)')),
+    ('Opera', re.compile(r'(?:OPR|Opera)/([\d.]+)')),
+    ('Samsung Internet', re.compile(r'SamsungBrowser/([\d.]+)')),
+    ('Chrome', re.compile(r'(?:Chrome|CriOS)/([\d.]+)')),
+    ('Firefox', re.compile(r'(?:Firefox|FxiOS)/([\d.]+)')),
+    ('Safari', re.compile(r'Version/([\d.]+).*Safari/')),
+    ('Internet Explorer', re.compile(r'(?:MSIE |Trident/.*rv:)([\d.]+)')),
+)
+
+WINDOWS_VERSIONS = {'10.0': '10', '6.3': '8.1', '6.2': '8', '6.1': '7', '6.0': 'Vista', '5.1': 'XP'}
+
+SYSTEMS = (
+    ('Windows', re.compile(r'Windows NT ([\d.]+)'), lambda version: WINDOWS_VERSIONS.get(version, version)),
+    ('Android', re.compile(r'Android ([\d.]+)'), None),
+    ('iOS', re.compile(r'(?:iPhone|CPU) OS (\d+(?:_\d+)?)'), lambda version: version.replace('_', '.')),
+    ('macOS', re.compile(r'Mac OS X (\d+(?:[_.]\d+)?)'), lambda version: version.replace('_', '.')),
+    ('Chrome OS', re.compile(r'CrOS \S+ ([\d.]+)'), None),
+    ('Linux', re.compile(r'Linux()'), None),
+)
+
+TABLET = re.compile(r'iPad|Tablet|Android(?!.*Mobile)', re.IGNORECASE)
+MOBILE = re.compile(r'Mobi|iPhone|iPod|Windows Phone', re.IGNORECASE)
+
+
+@lru_cache(maxsize=4096)
+def parse(user_agent):
+    """(browser, browser version, os, device) of a user agent string"""
+    browser = version = os = ''
+    for name, pattern in BROWSERS:
+        match = pattern.search(user_agent)
+        if match:
+            browser, version = name, match.group(1).split('.')[0]
+            break
+    for name, pattern, label in SYSTEMS:
+        match = pattern.search(user_agent)
+        if match:
+            os = f'{name} {label(match.group(1)) if label else match.group(1)}'.strip()
+            break
+
+    if not user_agent or BOT_AGENTS.search(user_agent):
+        device = 'bot'
+    elif TABLET.search(user_agent):
+        device = 'tablet'
+    elif MOBILE.search(user_agent):
+        device = 'mobile'
+    elif browser or os:
+        device = 'desktop'
+    else:
+        device = 'other'
+    return browser, version, os, device
+
+
+def digest(user_agent):
+    return hashlib.sha1(user_agent.encode('utf-8', 'replace')).hexdigest()
+
+
+def pack_ip(ip_address):
+    """Packed bytes of an IP address, b'' when it is missing or malformed"""
+    try:
+        return ipaddress.ip_address((ip_address or '').strip()).packed
+    except ValueError:
+        return b''
+
+
+def unpack_ip(packed):
+    return str(ipaddress.ip_address(bytes(packed))) if packed else ''
+
+
+def agent_row(model, user_agent):
+    """Unsaved `model` (UserAgent, or its historical version in a migration) row for a string"""
+    browser, version, os, device = parse(user_agent)
+    return model(digest=digest(user_agent), string=user_agent, browser=browser,
+                 browser_version=version, os=os, device=device)
+
+
+def intern_with(model, user_agents, using=None):
+    """{string: id} of UserAgent rows for the strings, inserting the missing ones"""
+    manager = model.objects.db_manager(using)
+    wanted = {digest(user_agent): user_agent for user_agent in set(user_agents)}
+    ids = dict(manager.filter(digest__in=list(wanted)).values_list('digest', 'id'))
+    missing = [agent_row(model, user_agent) for key, user_agent in wanted.items() if key not in ids]
+    if missing:
+        # Another process may intern the same string meanwhile
+        manager.bulk_create(missing, ignore_conflicts=True)
+        ids.update(manager.filter(digest__in=[row.digest for row in missing]).values_list('digest', 'id'))
+    return {user_agent: ids[key] for key, user_agent in wanted.items()}
+
+
+_known = OrderedDict()  # string -> id, most recently used last
+_lock = threading.Lock()
+
+
+def intern_agents(user_agents):
+    """{string: UserAgent id} for the strings, from memory when seen recently"""
+    with _lock:
+        ids, unknown = {}, set()
+        for user_agent in set(user_agents):
+            if user_agent in _known:
+                _known.move_to_end(user_agent)
+                ids[user_agent] = _known[user_agent]
+            else:
+                unknown.add(user_agent)
+    if unknown:
+        found = intern_with(UserAgent, unknown)
+        ids.update(found)
+        with _lock:
+            _known.update(found)
+            while len(_known) > KNOWN_IDS:
+                _known.popitem(last=False)
+    return ids
@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 
 
 class PortalConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'portal'
+
+    def ready(self):
+        from . import signals, tasks  # noqa: F401
+        from django.template import engines
+        # Without the engine those views would quietly fall back to the Django templates
+        if getattr(settings, 'PORTAL_JINJA2_VIEWS', ()) and 'jinja2' not in engines:
+            raise ImproperlyConfigured('PORTAL_JINJA2_VIEWS is set but the Jinja2 template engine is not '
+                                       'configured: install Jinja2 (see requirements.txt)')
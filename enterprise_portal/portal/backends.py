@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+
+USER_CACHE_KEY = 'portal:auth-fields:{}'
+
+
+def user_cache_key(user_id):
+    return USER_CACHE_KEY.format(user_id)
+
+
+def _cached_fields(model):
+    # Everything but the password hash, in the order Model.from_db expects
+    return [field.attname for field in model._meta.concrete_fields if field.attname != 'password']
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend that serves the session's user (including its staff flag)
+    from the shared cache for a short time instead of querying auth_user on
+    every request. Entries are dropped by portal.signals when a user changes.
+
+    The cache is a file every worker maps, so entries hold the user's fields
+    without the password hash, plus the session auth hash (an HMAC of it,
+    which every session stores anyway). The user comes back with password
+    deferred: reading it queries the database, and save() leaves it alone.
+    """
+
+    def get_user(self, user_id):
+        model = get_user_model()
+        key = user_cache_key(user_id)
+        entry = cache.get(key)
+        if entry is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            entry = ([getattr(user, name) for name in _cached_fields(model)], user.get_session_auth_hash())
+            cache.set(key, entry, getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 60))
+        else:
+            values, session_hash = entry
+            user = model.from_db(model.objects.db, _cached_fields(model), values)
+            # What django.contrib.auth.get_user checks the session against, without loading the password
+            user.get_session_auth_hash = lambda: session_hash
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,254 @@
+"""
+Export and import of the whole portal catalogue (factories, sections, cards).
+
+Rows are matched by natural key rather than id so a catalogue can be copied
+between plants:
+
+    factory  name
+    section  (factory name or None for the home page, section name)
+    card     (factory name or None, section name, card name)
+
+Names must be unique per level (no two cards of a section with the same
+name), in the file and in the portal; import refuses duplicates rather than
+merging them into one row.
+
+Import loads every existing row once, diffs it against the payload and
+applies only the differences with bulk_create/bulk_update inside a single
+transaction, so the number of queries does not grow with the catalogue size.
+
+An export records its scope: ``all_factories`` when no factory filter was
+given and ``includes_home`` when the home page sections are in it. Prune
+only deletes within that scope: sections and cards of the factories in the
+file (and of the home page if included), and factories only when the file
+has all of them, so importing one plant's export never deletes the others.
+"""
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import fragments, icons, jobs, journal, tasks
+from .models import FactoryButton, PortalSection, SystemCard
+from .navigation import bump_version
+
+
+FORMAT_VERSION = 1
+BATCH_SIZE = 500
+
+TRANSLATED_FIELDS = [
+    'name', 'name_en', 'name_vi', 'name_zh_hant', 'name_zh_hans',
+    'description', 'description_vi', 'description_zh_hant', 'description_zh_hans',
+]
+FACTORY_FIELDS = TRANSLATED_FIELDS + [
+    'url', 'icon', 'background_color', 'text_color', 'order', 'is_active', 'access_level',
+]
+SECTION_FIELDS = TRANSLATED_FIELDS + ['icon', 'color', 'order', 'is_active']
+CARD_FIELDS = TRANSLATED_FIELDS + [
+    'url', 'icon', 'icon_color', 'status', 'order', 'is_active', 'is_external', 'access_level',
+]
+
+
+def _values(obj, fields):
+    return {field: getattr(obj, field) for field in fields}
+
+
+def export_catalogue(factory_ids=None, include_home=True):
+    """Serialise the catalogue (or the given factories) into a JSON-ready dict"""
+    factories = FactoryButton.objects.all()
+    if factory_ids is not None:
+        factories = factories.filter(id__in=factory_ids)
+    factories = list(factories)
+
+    sections = PortalSection.objects.filter(factory__in=factories)
+    if include_home:
+        sections = sections | PortalSection.objects.filter(factory=None)
+    sections = list(sections.order_by('order', 'name'))
+    cards = SystemCard.objects.filter(section__in=sections).order_by('order', 'name')
+
+    cards_by_section = {}
+    for card in cards:
+        cards_by_section.setdefault(card.section_id, []).append(_values(card, CARD_FIELDS))
+
+    sections_by_factory = {}
+    for section in sections:
+        data = _values(section, SECTION_FIELDS)
+        data['cards'] = cards_by_section.get(section.id, [])
+        sections_by_factory.setdefault(section.factory_id, []).append(data)
+
+    return {
+        'version': FORMAT_VERSION,
+        'exported_at': timezone.now().isoformat(),
+        'factories': [
+            dict(_values(factory, FACTORY_FIELDS), sections=sections_by_factory.get(factory.id, []))
+            for factory in factories
+        ],
+        'home_sections': sections_by_factory.get(None, []) if include_home else [],
+        'all_factories': factory_ids is None,
+        'includes_home': include_home,
+    }
+
+
+class _Plan:
+    """Diff of one model: rows to create, rows to update and the fields that changed"""
+
+    def __init__(self):
+        self.create, self.update, self.fields = [], [], set()
+
+    def apply(self, model, obj, data, fields, existing):
+        if existing is None:
+            self.create.append(model(**{field: data[field] for field in fields if field in data}, **obj))
+            return
+        changed = [field for field in fields
+                   if field in data and getattr(existing, field) != data[field]]
+        changed += [field for field, value in obj.items() if getattr(existing, field) != value]
+        if changed:
+            for field in changed:
+                setattr(existing, field, data[field] if field in data else obj[field])
+            self.update.append(existing)
+            self.fields.update(changed)
+
+    def save(self, model, user, now):
+        for obj in self.create:
+            obj.updated_by = user
+        # Backends that cannot return ids from bulk_create still number new rows upwards
+        last_id = model.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        model.objects.bulk_create(self.create, batch_size=BATCH_SIZE)
+        if self.create:
+            created = [obj.pk for obj in self.create if obj.pk is not None]
+            if len(created) < len(self.create):
+                created = model.objects.filter(id__gt=last_id).values_list('id', flat=True)
+            journal.record(model, created, 'create')
+        if self.update:
+            for obj in self.update:
+                obj.updated_at, obj.updated_by = now, user
+            model.objects.bulk_update(self.update, sorted(self.fields | {'updated_at', 'updated_by'}),
+                                      batch_size=BATCH_SIZE)
+            journal.record(model, [obj.pk for obj in self.update], 'update')
+        return {'created': len(self.create), 'updated': len(self.update)}
+
+
+def _describe(key):
+    if isinstance(key, str):
+        return key
+    return ' / '.join('home page' if part is None else part for part in key)
+
+
+def _index(items, what, where):
+    """{natural key: item}, refusing a key that appears twice"""
+    index = {}
+    for key, item in items:
+        if key in index:
+            raise ValueError(f'Duplicate {what} {_describe(key)!r} in {where}: names must be unique')
+        index[key] = item
+    return index
+
+
+def _check_payload(data):
+    _index(((item['name'], item) for item in data.get('factories', [])), 'factory', 'the file')
+    sections = [(None, item) for item in data.get('home_sections', [])]
+    sections += [(factory['name'], item) for factory in data.get('factories', [])
+                 for item in factory.get('sections', [])]
+    _index((((factory_name, item['name']), item) for factory_name, item in sections), 'section', 'the file')
+    _index((((factory_name, section['name'], item['name']), item)
+            for factory_name, section in sections for item in section.get('cards', [])), 'card', 'the file')
+
+
+def _factory_map():
+    return _index(((factory.name, factory) for factory in FactoryButton.objects.all()), 'factory', 'the portal')
+
+
+def _section_map(factory_names):
+    return _index((((factory_names.get(section.factory_id), section.name), section)
+                   for section in PortalSection.objects.all()), 'section', 'the portal')
+
+
+def import_catalogue(data, user=None, prune=False, dry_run=False):
+    """
+    Upsert an exported catalogue. With ``prune`` rows missing from the payload
+    are deleted, within the payload's scope; with ``dry_run`` everything is
+    rolled back. Returns counts per model.
+    """
+    if data.get('version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported catalogue version: {data.get('version')}")
+    _check_payload(data)
+
+    now = timezone.now()
+    stats = {}
+    with transaction.atomic():
+        # Factories
+        factories = _factory_map()
+        plan = _Plan()
+        for item in data.get('factories', []):
+            plan.apply(FactoryButton, {}, item, FACTORY_FIELDS, factories.get(item['name']))
+        stats['factories'] = plan.save(FactoryButton, user, now)
+
+        # Sections, now that every factory has an id
+        factories = _factory_map()
+        factory_names = {factory.id: name for name, factory in factories.items()}
+        sections = _section_map(factory_names)
+        wanted_sections = [(None, item) for item in data.get('home_sections', [])]
+        wanted_sections += [(factory['name'], item)
+                            for factory in data.get('factories', []) for item in factory.get('sections', [])]
+        plan = _Plan()
+        for factory_name, item in wanted_sections:
+            factory = factories.get(factory_name) if factory_name else None
+            plan.apply(PortalSection, {'factory_id': factory.id if factory else None}, item, SECTION_FIELDS,
+                       sections.get((factory_name, item['name'])))
+        stats['sections'] = plan.save(PortalSection, user, now)
+        changed_sections = {section.pk for section in plan.update}
+
+        # Cards
+        sections = _section_map(factory_names)
+        section_keys = {section.id: key for key, section in sections.items()}
+        cards = _index(((section_keys[card.section_id] + (card.name,), card)
+                        for card in SystemCard.objects.all() if card.section_id in section_keys), 'card', 'the portal')
+        wanted_cards = {}
+        plan = _Plan()
+        for factory_name, section_item in wanted_sections:
+            section = sections[(factory_name, section_item['name'])]
+            for item in section_item.get('cards', []):
+                key = (factory_name, section_item['name'], item['name'])
+                wanted_cards[key] = item
+                plan.apply(SystemCard, {'section_id': section.id}, item, CARD_FIELDS, cards.get(key))
+        stats['cards'] = plan.save(SystemCard, user, now)
+        # Created cards change the card ids in a section's fragment key by themselves
+        changed_sections.update(card.section_id for card in plan.update)
+
+        if prune:
+            wanted_factories = {item['name'] for item in data.get('factories', [])}
+            # Files written before exports recorded their scope: home only if they carry home sections
+            in_scope = set(wanted_factories)
+            if data.get('includes_home', bool(data.get('home_sections'))):
+                in_scope.add(None)
+            if data.get('all_factories'):
+                # Factories missing from a full export go, their sections first (the foreign key does not cascade)
+                in_scope.update(factories)
+
+            stale_cards = [card.id for key, card in cards.items() if key[0] in in_scope and key not in wanted_cards]
+            wanted_section_keys = {(factory_name, item['name']) for factory_name, item in wanted_sections}
+            stale_sections = [section.id for key, section in sections.items()
+                              if key[0] in in_scope and key not in wanted_section_keys]
+            stale_factories = [factory.id for name, factory in factories.items()
+                               if name in in_scope and name not in wanted_factories]
+
+            stats['cards']['deleted'] = SystemCard.objects.filter(id__in=stale_cards).delete()[1].get(
+                SystemCard._meta.label, 0)
+            stats['sections']['deleted'] = PortalSection.objects.filter(id__in=stale_sections).delete()[1].get(
+                PortalSection._meta.label, 0)
+            stats['factories']['deleted'] = FactoryButton.objects.filter(id__in=stale_factories).delete()[1].get(
+                FactoryButton._meta.label, 0)
+
+        if dry_run:
+            transaction.set_rollback(True)
+        else:
+            # bulk_create/bulk_update send no signals (prune deletes do, see portal.signals)
+            transaction.on_commit(lambda: fragments.bump_sections(changed_sections))
+            transaction.on_commit(bump_version)
+            tasks.prerender_soon()
+            # Nor does icon_changed run: new icons need the subset rebuilt
+            used = {item.get('icon') for item in data.get('factories', [])}
+            used.update(item.get('icon') for _, item in wanted_sections)
+            used.update(item.get('icon') for item in wanted_cards.values())
+            if not all(icons.is_covered(name) for name in used):
+                jobs.enqueue('rebuild_icons', key='rebuild_icons')
+
+    return stats
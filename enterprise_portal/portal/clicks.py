@@ -0,0 +1,129 @@
+"""
+Batched click ingestion.
+
+track_click only validates the click and queues it. One background thread per
+process drains the queue every CLICK_FLUSH_SECONDS (or as soon as
+CLICK_BATCH_SIZE clicks are waiting) and writes the whole batch: one
+bulk_create into PortalAnalytics (user agents interned and IPs packed, see
+portal.agents), the trending summaries, one sketch update
+per (card, day) and the per-user frequency weights. Beacons therefore never wait on the analytics
+database and clicks use a single connection per process. What reaches the
+queue has passed the ingestion filter (portal.ingest) and carries its
+sampling weight.
+
+Queued clicks are written on interpreter exit; a worker killed outright loses
+at most one flush interval of clicks. clicked_at is set when the batch is
+written (auto_now_add), i.e. at most one flush interval late.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .agents import intern_agents, pack_ip, unpack_ip
+from .frequency import record_click
+from .models import PortalAnalytics
+from .sketches import record_visits, visitor_key
+from .trending import tracker
+
+
+logger = logging.getLogger(__name__)
+
+Click = namedtuple('Click', 'card_id factory_id user_id ip_address user_agent timestamp day weight')
+
+
+def write_clicks(clicks):
+    """Persist a batch of clicks and update the per-card and per-user aggregates"""
+    agents = intern_agents(click.user_agent for click in clicks)
+    ips = {click.ip_address: pack_ip(click.ip_address) for click in clicks}
+    PortalAnalytics.objects.bulk_create([
+        PortalAnalytics(card_id=click.card_id, user_id=click.user_id, ip=ips[click.ip_address],
+                        agent_id=agents[click.user_agent], weight=click.weight)
+        for click in clicks
+    ])
+
+    visitors = {}
+    for click in clicks:
+        tracker.record(click.card_id, click.factory_id, weight=click.weight, now=click.timestamp)
+        # Keyed on the stored form of the IP, as build_visitor_sketches reads it back
+        ip_address = unpack_ip(ips[click.ip_address])
+        visitors.setdefault((click.card_id, click.day), []).append(visitor_key(click.user_id, ip_address))
+    for (card_id, day), keys in visitors.items():
+        record_visits(card_id, keys, day)
+
+    for click in clicks:
+        if click.user_id:
+            record_click(click.user_id, click.card_id, weight=click.weight, now=click.timestamp)
+
+
+class ClickBatcher:
+    def __init__(self, batch_size=None, interval=None):
+        self.batch_size = batch_size or getattr(settings, 'CLICK_BATCH_SIZE', 200)
+        self.interval = interval or getattr(settings, 'CLICK_FLUSH_SECONDS', 0.5)
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        # Started lazily, and again after a fork (threads do not survive it)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.SimpleQueue()
+                threading.Thread(target=self._run, name='portal-clicks', daemon=True).start()
+                self._pid = os.getpid()
+
+    def submit(self, card_id, factory_id, user_id, ip_address, user_agent, weight=1):
+        self._ensure_thread()
+        self._queue.put(Click(card_id, factory_id, user_id, ip_address, user_agent,
+                              time.time(), timezone.localdate(), weight))
+
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0
+
+    def _drain(self, first=None, deadline=None):
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                if deadline is None:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        try:
+            write_clicks(batch)
+        except Exception:
+            logger.exception('Dropped a batch of %d clicks', len(batch))
+        finally:
+            close_old_connections()
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            self._write(self._drain(first, time.monotonic() + self.interval))
+
+    def flush(self):
+        """Write everything queued so far from the calling thread"""
+        if self._queue is None or self._pid != os.getpid():
+            return
+        while True:
+            batch = self._drain()
+            if not batch:
+                return
+            self._write(batch)
+
+
+batcher = ClickBatcher()
+atexit.register(batcher.flush)
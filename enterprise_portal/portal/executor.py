@@ -0,0 +1,44 @@
+"""
+Dedicated thread pool for the database work of async views.
+
+Django 3.2 has no async ORM, so native async views (track_click, health,
+version polling) hand their ORM and cache calls to this pool with
+``await run_sync(func, ...)``. The pool size (ASYNC_DB_THREADS) bounds the
+number of database connections an ASGI worker opens, however many requests
+are parked on the event loop.
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+_executor = None
+_pid = None
+
+
+def get_executor():
+    global _executor, _pid
+    # Threads do not survive a fork: a preloaded master must not hand its pool to workers
+    if _executor is None or _pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'ASYNC_DB_THREADS', 4),
+                                       thread_name_prefix='portal-db')
+        _pid = os.getpid()
+    return _executor
+
+
+def _call(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        # Same connection housekeeping as the end of a sync request (CONN_MAX_AGE, broken connections)
+        close_old_connections()
+
+
+async def run_sync(func, *args, **kwargs):
+    """Run a blocking callable on the database pool and await its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(_call, func, args, kwargs))
@@ -0,0 +1,175 @@
+"""
+Streaming exports of raw click analytics.
+
+Clicks are read with values_list(...).iterator(chunk_size=...) and written out
+row by row, so memory stays flat and the first bytes leave immediately however
+many rows match. Clicks live in the analytics database, so card, section,
+factory and user names are resolved from lookup tables loaded once from the
+default database (bounded by the catalogue, not by the number of clicks).
+"""
+import csv
+import re
+import zipfile
+from datetime import date, datetime, time, timedelta
+from xml.etree.ElementTree import Element, SubElement
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+from et_xmlfile import xmlfile
+
+from .agents import unpack_ip
+from .models import PortalAnalytics, SystemCard, UserAgent
+
+
+CHUNK_SIZE = 2000
+
+HEADER = ('clicked_at', 'factory', 'section', 'card_id', 'card', 'user', 'ip_address', 'user_agent', 'weight')
+
+_ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def parse_quarter(value):
+    """'2025Q3' -> (date(2025, 7, 1), date(2025, 9, 30))"""
+    match = re.fullmatch(r'(\d{4})-?[Qq]([1-4])', value.strip())
+    if not match:
+        raise ValueError(f'Invalid quarter: {value}')
+    year, quarter = int(match.group(1)), int(match.group(2))
+    start = date(year, 3 * quarter - 2, 1)
+    end = date(year + 1, 1, 1) if quarter == 4 else date(year, 3 * quarter + 1, 1)
+    return start, end - timedelta(days=1)
+
+
+def export_rows(factory_id=None, start=None, end=None, chunk_size=CHUNK_SIZE):
+    """Yield HEADER, then one tuple per click in time order"""
+    cards = SystemCard.objects.all()
+    if factory_id:
+        cards = cards.filter(section__factory_id=factory_id)
+    card_names = {
+        card_id: (factory or '', section or '', name)
+        for card_id, factory, section, name in cards.values_list(
+            'id', 'section__factory__name', 'section__name', 'name')
+    }
+    usernames = dict(User.objects.values_list('id', 'username'))
+    agents = dict(UserAgent.objects.values_list('id', 'string'))
+
+    clicks = PortalAnalytics.objects.order_by('clicked_at', 'id')
+    if factory_id:
+        clicks = clicks.filter(card_id__in=list(card_names))
+    tz = timezone.get_current_timezone()
+    if start:
+        clicks = clicks.filter(clicked_at__gte=timezone.make_aware(datetime.combine(start, time.min), tz))
+    if end:
+        end = end + timedelta(days=1)
+        clicks = clicks.filter(clicked_at__lt=timezone.make_aware(datetime.combine(end, time.min), tz))
+
+    yield HEADER
+    rows = clicks.values_list('clicked_at', 'card_id', 'user_id', 'ip', 'agent_id', 'weight')
+    for clicked_at, card_id, user_id, ip, agent_id, weight in rows.iterator(chunk_size=chunk_size):
+        factory, section, card = card_names.get(card_id, ('', '', ''))
+        yield (
+            timezone.localtime(clicked_at, tz).isoformat(timespec='seconds'),
+            factory, section, card_id, card,
+            usernames.get(user_id, ''), unpack_ip(ip), agents.get(agent_id, ''), weight,
+        )
+
+
+class _Echo:
+    """File-like object handing back what csv.writer writes"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    writer = csv.writer(_Echo())
+    yield '\ufeff'.encode()  # BOM so Excel picks UTF-8 for the Chinese/Vietnamese names
+    for row in rows:
+        yield writer.writerow(row).encode()
+
+
+class _Sink:
+    """Unseekable output for ZipFile that buffers bytes until drained"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+_XLSX_PARTS = (
+    ('[Content_Types].xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+     '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+     '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+     '<Default Extension="xml" ContentType="application/xml"/>'
+     '<Override PartName="/xl/workbook.xml" '
+     'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+     '<Override PartName="/xl/worksheets/sheet1.xml" '
+     'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+     '</Types>'),
+    ('_rels/.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     '<Relationship Id="rId1" Target="xl/workbook.xml" '
+     'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+     '</Relationships>'),
+    ('xl/workbook.xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+     '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+     'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+     '<sheets><sheet name="Clicks" sheetId="1" r:id="rId1"/></sheets>'
+     '</workbook>'),
+    ('xl/_rels/workbook.xml.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+     'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+     '</Relationships>'),
+)
+
+
+def _xlsx_row(number, values):
+    row = Element('row', r=str(number))
+    for value in values:
+        if isinstance(value, int):
+            cell = SubElement(row, 'c', t='n')
+            SubElement(cell, 'v').text = str(value)
+        else:
+            cell = SubElement(row, 'c', t='inlineStr')
+            text = SubElement(SubElement(cell, 'is'), 't')
+            text.text = _ILLEGAL_XML_CHARS.sub('', str(value))
+    return row
+
+
+def stream_xlsx(rows, flush_every=500):
+    """
+    Write-only XLSX: the workbook parts are fixed and the single sheet is
+    written incrementally with et_xmlfile into a zip stream, yielding the
+    compressed bytes as they are produced.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, body in _XLSX_PARTS:
+            archive.writestr(name, body)
+        yield sink.drain()
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>')
+            with xmlfile(sheet) as xf:
+                with xf.element('worksheet', xmlns='http://schemas.openxmlformats.org/spreadsheetml/2006/main'):
+                    with xf.element('sheetData'):
+                        for number, values in enumerate(rows, 1):
+                            xf.write(_xlsx_row(number, values))
+                            if number % flush_every == 0:
+                                yield sink.drain()
+    yield sink.drain()
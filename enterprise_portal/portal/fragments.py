@@ -0,0 +1,102 @@
+"""
+Per-section fragment cache for the home and factory pages.
+
+Pages for signed-in users cannot be cached whole (frequently used cards,
+edit controls, per-user filtering), but most of their markup is the card
+grid of each section, which rarely changes. The templates render each
+section through section_fragment() (``{% section_fragment %}`` in Django
+templates, see portal.templatetags.section_cache), which keeps the rendered
+HTML in a per-worker LRU keyed by
+
+    template and engine, section id, section version, language, access tier,
+    the ids of the cards shown, show_status_indicators and edit mode.
+
+Each section has a version stamp in the shared cache. Saving or deleting a
+card bumps only its section's stamp once the change commits (see
+portal.signals), so editing one card re-renders that one section in every
+worker while the others stay cached. The navigation snapshot reads the
+stamps before it loads the catalogue and hands them to its SectionViews;
+as stamps only move after the data they cover is committed, a fragment is
+never stored under a newer stamp than the data it was rendered from. The shown card ids
+in the key cover group filtering and cards moving between sections.
+
+stats() reports hits, misses and invalidations of this worker (see the
+health endpoint).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings as django_settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
+
+from .utils import access_tier
+
+
+VERSION_KEY = 'portal:section-version:{}'
+
+_fragments = OrderedDict()
+_lock = threading.Lock()
+_counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+
+def section_versions(section_ids):
+    """{section id: version stamp}, stamping sections that have none yet"""
+    keys = {VERSION_KEY.format(section_id): section_id for section_id in section_ids}
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        # A fresh stamp rather than 0, so fragments cached before the stamp was lost never match again
+        stamp = time.time_ns()
+        for key in missing:
+            cache.add(key, stamp, None)
+        found.update(cache.get_many(missing))
+    return {section_id: found.get(key, 0) for key, section_id in keys.items()}
+
+
+def bump_sections(section_ids):
+    """Mark the sections as changed so every worker re-renders their fragments"""
+    section_ids = {section_id for section_id in section_ids if section_id is not None}
+    if section_ids:
+        stamp = time.time_ns()
+        cache.set_many({VERSION_KEY.format(section_id): stamp for section_id in section_ids}, None)
+        _counters['invalidations'] += len(section_ids)
+
+
+def section_fragment(section, template_name, using, request, settings, is_edit_mode=False):
+    """Rendered HTML of one section, from this worker's cache when its inputs did not change"""
+    key = (using, template_name, section.id, section.version, get_language(), access_tier(request.user),
+           tuple(card.id for card in section.filtered_cards), settings.show_status_indicators, bool(is_edit_mode))
+    html = _fragments.get(key)
+    if html is not None:
+        _counters['hits'] += 1
+        with _lock:
+            if key in _fragments:
+                _fragments.move_to_end(key)
+        return html
+
+    _counters['misses'] += 1
+    html = mark_safe(render_to_string(template_name, {
+        'section': section,
+        'settings': settings,
+        'is_edit_mode': is_edit_mode,
+    }, using=using))
+    with _lock:
+        _fragments[key] = html
+        while len(_fragments) > django_settings.SECTION_FRAGMENT_CACHE_ENTRIES:
+            _fragments.popitem(last=False)
+            _counters['evictions'] += 1
+    return html
+
+
+def stats():
+    """Counters of this worker since it started"""
+    lookups = _counters['hits'] + _counters['misses']
+    return {
+        **_counters,
+        'entries': len(_fragments),
+        'hit_ratio': round(_counters['hits'] / lookups, 3) if lookups else None,
+    }
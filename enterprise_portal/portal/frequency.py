@@ -0,0 +1,85 @@
+"""
+Per-user "frequently used" cards.
+
+Each user keeps one UserCardFrequency row holding exponentially decayed click
+counts per card. Decay uses forward weights: a click at time t adds
+2 ** ((t - epoch) / half_life), so older clicks never need rewriting and the
+ranking is simply the order of the stored weights. The ranked card ids are kept
+in the cache so rendering the strip is a single cache lookup.
+
+Each worker process has its own click writer (portal.clicks), so a row is
+written with a compare-and-swap on its version and re-read on a conflict.
+"""
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import UserCardFrequency
+
+
+CACHE_KEY = 'portal:frequent-cards:{}'
+MAX_TRACKED = 24      # cards kept per user, the rest is dropped as noise
+REBASE_EXPONENT = 64  # rebase weights before they grow past 2 ** 64
+
+
+def _half_life():
+    return getattr(settings, 'FREQUENT_CARDS_HALF_LIFE_DAYS', 7) * 86400
+
+
+def _ranked(weights):
+    return [int(card_id) for card_id, _ in sorted(weights.items(), key=lambda kv: kv[1], reverse=True)]
+
+
+def record_click(user_id, card_id, weight=1, now=None):
+    """Add a click (counting `weight` times) to the user's decayed counts and refresh the cached ranking"""
+    now = now or time.time()
+    half_life = _half_life()
+
+    # Written only if no other writer changed the row since it was read
+    while True:
+        row, created = UserCardFrequency.objects.get_or_create(user_id=user_id, defaults={'epoch': now})
+        weights = json.loads(row.weights)
+
+        epoch = row.epoch
+        exponent = (now - epoch) / half_life
+        if exponent > REBASE_EXPONENT:
+            scale = 2 ** -exponent
+            weights = {k: v * scale for k, v in weights.items()}
+            epoch, exponent = now, 0
+
+        key = str(card_id)
+        weights[key] = weights.get(key, 0.0) + weight * 2 ** exponent
+        if len(weights) > MAX_TRACKED:
+            weights = {str(k): weights[str(k)] for k in _ranked(weights)[:MAX_TRACKED]}
+
+        if UserCardFrequency.objects.filter(pk=row.pk, version=row.version).update(
+                epoch=epoch, weights=json.dumps(weights, separators=(',', ':')), version=row.version + 1,
+                updated_at=timezone.now()):
+            break
+
+    ranking = _ranked(weights)
+    cache.set(CACHE_KEY.format(user_id), ranking, None)
+    return ranking
+
+
+def frequent_card_ids(user_id):
+    """Card ids ordered by decayed click count, most used first"""
+    key = CACHE_KEY.format(user_id)
+    ranking = cache.get(key)
+    if ranking is None:
+        row = UserCardFrequency.objects.filter(user_id=user_id).first()
+        ranking = _ranked(json.loads(row.weights)) if row else []
+        cache.set(key, ranking, None)
+    return ranking
+
+
+def frequent_cards(user, view, limit=None):
+    """Cards of the navigation view (see portal.navigation) for the "Frequently used" strip"""
+    if not user.is_authenticated:
+        return []
+    limit = limit or getattr(settings, 'FREQUENT_CARDS_LIMIT', 5)
+    cards = (view.cards_by_id.get(card_id) for card_id in frequent_card_ids(user.pk))
+    return [card for card in cards if card is not None][:limit]
@@ -0,0 +1,217 @@
+"""
+Self-hosted icon subset.
+
+Factories, sections and cards name a Font Awesome icon (``fa-<icon>``) and
+the templates use a few dozen more, yet the pages used to pull the whole
+Font Awesome CSS and webfonts from a CDN. build() collects the icon names
+actually in use, from the icon columns and from every project template, and
+writes
+
+    <ICON_SPRITE_ROOT>/icons.css    one rule per icon, the SVG inlined as a CSS mask
+    <ICON_SPRITE_ROOT>/icons.json   manifest: version, icons, missing names
+
+from the SVGs of a Font Awesome Free download (ICON_SOURCE_DIR, with its
+svgs/ and metadata/ folders). The stylesheet keeps the ``fas fa-<icon>``
+markup working and paints icons with currentColor, so inline colours still
+apply. Names are resolved through the download's alias metadata, so
+Font Awesome 5 names such as ``cog`` keep working.
+
+Templates link stylesheet_url(), which points at the subset once it is built
+and at the CDN bundle until then. Saving an icon that is not in the subset
+rebuilds it (see portal.signals).
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.template import engines
+
+from .models import FactoryButton, PortalSection, SystemCard
+
+
+logger = logging.getLogger(__name__)
+
+CDN_STYLESHEET = 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css'
+
+# Icon styles searched, in order, for a name
+STYLES = ('solid', 'regular', 'brands')
+
+ICON_CLASS = re.compile(r'\bfa-([a-z0-9]+(?:-[a-z0-9]+)*)\b')
+
+# fa-* classes that are modifiers rather than icons
+MODIFIERS = re.compile(r'^(solid|regular|brands|light|thin|duotone|fw|spin|pulse|beat|fade|bounce|shake|flip'
+                       r'|flip-(horizontal|vertical|both)|rotate-\d+|rotate-by|inverse|border|pull-(left|right)'
+                       r'|stack|stack-[12]x|li|ul|xs|sm|lg|xl|2xs|2xl|\d+x)$')
+
+BASE_CSS = '''\
+.fa, .fas, .far, .fab, .fa-solid, .fa-regular, .fa-brands {
+  display: inline-block;
+  width: var(--fa-width, 1em);
+  height: 1em;
+  vertical-align: -0.125em;
+  -webkit-mask: var(--fa-icon) no-repeat center / contain;
+  mask: var(--fa-icon) no-repeat center / contain;
+}
+.fa-fw { width: 1.25em; }
+.fa-spin { animation: fa-spin 2s linear infinite; }
+@keyframes fa-spin { to { transform: rotate(360deg); } }
+'''
+
+
+def sprite_path(name):
+    return os.path.join(settings.ICON_SPRITE_ROOT, name)
+
+
+def template_icons():
+    """Icon names used in the project's own templates"""
+    base_dir = os.path.abspath(settings.BASE_DIR)
+    names = set()
+    for engine in engines.all():
+        for directory in engine.template_dirs:
+            directory = os.path.abspath(directory)
+            if not directory.startswith(base_dir) or not os.path.isdir(directory):
+                continue
+            for root, _, files in os.walk(directory):
+                for filename in files:
+                    if filename.endswith('.html'):
+                        with open(os.path.join(root, filename), encoding='utf-8') as f:
+                            names.update(ICON_CLASS.findall(f.read()))
+    return names
+
+
+def database_icons():
+    """Icon names of every factory, section and card"""
+    names = set()
+    for model in (FactoryButton, PortalSection, SystemCard):
+        names.update(model.objects.exclude(icon='').values_list('icon', flat=True).distinct())
+    return {name.strip().removeprefix('fa-') for name in names}
+
+
+def used_icons():
+    return sorted(name for name in template_icons() | database_icons() if not MODIFIERS.match(name))
+
+
+def load_aliases(source_dir):
+    """{alias: icon name} from the download's metadata/icons.json, if present"""
+    path = os.path.join(source_dir, 'metadata', 'icons.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        metadata = json.load(f)
+    aliases = {}
+    for name, icon in metadata.items():
+        for alias in (icon.get('aliases') or {}).get('names', ()):
+            aliases[alias] = name
+    return aliases
+
+
+def find_svg(source_dir, name, aliases):
+    for candidate in (name, aliases.get(name)):
+        if not candidate:
+            continue
+        for style in STYLES:
+            path = os.path.join(source_dir, 'svgs', style, f'{candidate}.svg')
+            if os.path.exists(path):
+                return path
+    return None
+
+
+def icon_rule(name, svg):
+    """CSS rule drawing the icon from its inlined SVG"""
+    # Drop the licence comment; the stylesheet header carries it once
+    svg = re.sub(r'<!--.*?-->', '', svg, flags=re.S).strip()
+    # The colour is set here, so a name missing from the subset stays blank instead of a square
+    rule = f'background-color: currentColor; --fa-icon: url("data:image/svg+xml,{quote(svg, safe=" /=:;,")}");'
+    view_box = re.search(r'viewBox="([\d.\s-]+)"', svg)
+    if view_box:
+        _, _, width, height = (float(value) for value in view_box.group(1).split())
+        if width != height:
+            rule += f' --fa-width: {width / height:.4g}em;'
+    return f'.fa-{name} {{ {rule} }}\n'
+
+
+def build(source_dir=None):
+    """Write the subset stylesheet and manifest; returns the manifest"""
+    source_dir = source_dir or settings.ICON_SOURCE_DIR
+    if not os.path.isdir(os.path.join(source_dir, 'svgs')):
+        raise FileNotFoundError(f'No Font Awesome svgs/ folder under {source_dir}')
+    aliases = load_aliases(source_dir)
+
+    rules, icons, missing = [], [], []
+    for name in used_icons():
+        path = find_svg(source_dir, name, aliases)
+        if path is None:
+            missing.append(name)
+            continue
+        with open(path, encoding='utf-8') as f:
+            rules.append(icon_rule(name, f.read()))
+        icons.append(name)
+
+    css = ('/* Font Awesome Free subset, https://fontawesome.com/license/free. '
+           'Generated by manage.py build_icons, do not edit. */\n' + BASE_CSS + ''.join(rules))
+    manifest = {
+        'version': hashlib.sha1(css.encode()).hexdigest()[:12],
+        'icons': icons,
+        'missing': missing,
+        'bytes': len(css.encode()),
+    }
+    os.makedirs(settings.ICON_SPRITE_ROOT, exist_ok=True)
+    # Write then rename, so a page never links a half-written stylesheet
+    for filename, content in (('icons.css', css), ('icons.json', json.dumps(manifest, indent=2))):
+        path = sprite_path(filename)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(path + '.tmp', path)
+    return manifest
+
+
+_manifest = (None, None)
+
+
+def manifest():
+    """The built manifest, or None; re-read when another process rebuilds it"""
+    global _manifest
+    try:
+        mtime = os.stat(sprite_path('icons.json')).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if _manifest[0] != mtime:
+        with open(sprite_path('icons.json'), encoding='utf-8') as f:
+            _manifest = (mtime, json.load(f))
+    return _manifest[1]
+
+
+def stylesheet_url():
+    """URL of the icon stylesheet: the built subset, or the CDN bundle before the first build"""
+    built = manifest()
+    if built is None:
+        return CDN_STYLESHEET
+    return f"{settings.ICON_SPRITE_URL}icons.css?v={built['version']}"
+
+
+def is_covered(name):
+    """Whether the built subset already has this icon (or already knows it is missing)"""
+    built = manifest()
+    name = (name or '').strip().removeprefix('fa-')
+    return built is None or not name or name in built['icons'] or name in built['missing']
+
+
+def rebuild():
+    """Rebuild after an icon change; failures are logged, pages then miss the new icon"""
+    try:
+        built = build()
+    except Exception:
+        logger.exception('Rebuilding the icon subset failed')
+        return
+    logger.info('Rebuilt the icon subset: %d icons, %d bytes', len(built['icons']), built['bytes'])
+    if built['missing']:
+        logger.warning('Icons not found in %s: %s', settings.ICON_SOURCE_DIR, ', '.join(built['missing']))
+
+
+def icon_stylesheet(request):
+    """Context processor: the icon stylesheet URL as {{ icon_stylesheet }}"""
+    return {'icon_stylesheet': stylesheet_url()}
@@ -0,0 +1,164 @@
+"""
+Click ingestion filter.
+
+track_click runs every beacon through ClickFilter.check() before it is queued
+(portal.clicks), in this order:
+
+    bot           user agents of crawlers, monitors, link previews and HTTP
+                  libraries, and requests flagged as prefetches
+    duplicate     the same visitor (user, or IP when anonymous) clicking the
+                  same card again within CLICK_DEDUP_SECONDS: double-clicks
+    rate_limited  an IP beyond its token bucket (CLICK_IP_RATE per second,
+                  bursts of CLICK_IP_BURST)
+    sampled_out   see below
+
+Under overload (more than CLICK_SAMPLE_ABOVE accepted clicks per second in
+this process, or more than CLICK_MAX_PENDING clicks waiting to be written)
+only 1 click in N is kept, N growing with the load, and the kept click is
+stored with weight N. Summing weights instead of counting rows keeps
+totals unbiased while the write volume stays capped. The trending summaries
+and frequency counts add the weight too; distinct-visitor sketches cannot,
+and undercount visitors while sampling is on.
+
+All state lives in process memory and is bounded: the dedup window keeps at
+most CLICK_DEDUP_ENTRIES keys and the token buckets CLICK_IP_BUCKETS IPs,
+the least recently seen going first.
+
+The IP is the client's as seen through the proxies in TRUSTED_PROXIES (see
+client_ip()). X-Forwarded-For is written by whoever sends the request, so
+only the hops appended by a trusted proxy are believed; a client cannot
+dodge its rate limit or dedup key by making up the header.
+"""
+import ipaddress
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+
+
+BOT_AGENTS = re.compile(
+    r'bot|crawl|spider|slurp|monitor|uptime|pingdom|statuscake|nagios|zabbix|headless|phantomjs|'
+    r'lighthouse|preview|facebookexternalhit|curl|wget|python-|httpclient|okhttp|go-http|java/|'
+    r'libwww|scrapy|postman',
+    re.IGNORECASE)
+
+# Headers browsers and proxies set on speculative requests
+PREFETCH_HEADERS = ('HTTP_PURPOSE', 'HTTP_SEC_PURPOSE', 'HTTP_X_PURPOSE', 'HTTP_X_MOZ')
+
+
+def is_bot(user_agent, meta=None):
+    """True for automated or speculative requests"""
+    if not user_agent or BOT_AGENTS.search(user_agent):
+        return True
+    meta = meta or {}
+    return any(meta.get(header, '').lower() in ('prefetch', 'preview', 'prerender') for header in PREFETCH_HEADERS)
+
+
+@lru_cache(maxsize=8)
+def _networks(proxies):
+    return tuple(ipaddress.ip_network(proxy, strict=False) for proxy in proxies)
+
+
+def _trusted(address):
+    try:
+        address = ipaddress.ip_address(address.strip())
+    except ValueError:
+        return False
+    return any(address in network for network in _networks(tuple(getattr(settings, 'TRUSTED_PROXIES', ()))))
+
+
+def client_ip(meta):
+    """The nearest address that is not a trusted proxy: REMOTE_ADDR, or an X-Forwarded-For hop"""
+    remote = meta.get('REMOTE_ADDR') or ''
+    if not _trusted(remote):
+        return remote
+    hops = [hop.strip() for hop in meta.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+    # Each proxy appends the address it got the request from: walk back from the last one
+    for hop in reversed(hops):
+        if not _trusted(hop):
+            return hop
+    return hops[0] if hops else remote
+
+
+class ClickFilter:
+    def __init__(self):
+        self.dedup_seconds = getattr(settings, 'CLICK_DEDUP_SECONDS', 5)
+        self.dedup_entries = getattr(settings, 'CLICK_DEDUP_ENTRIES', 50000)
+        self.ip_rate = getattr(settings, 'CLICK_IP_RATE', 2)
+        self.ip_burst = getattr(settings, 'CLICK_IP_BURST', 20)
+        self.ip_buckets = getattr(settings, 'CLICK_IP_BUCKETS', 10000)
+        self.sample_above = getattr(settings, 'CLICK_SAMPLE_ABOVE', 200)
+        self.max_pending = getattr(settings, 'CLICK_MAX_PENDING', 5000)
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()  # (visitor, card id) -> last click time
+        self._buckets = OrderedDict()  # ip -> [tokens, last refill]
+        self._second, self._in_second, self._rate = 0, 0, 0.0
+        self.sample_every = 1
+        self.verdicts = Counter()
+
+    def _duplicate(self, key, now):
+        # Oldest entries sit at the front: expire them, then cap the size
+        while self._seen and (len(self._seen) >= self.dedup_entries
+                              or next(iter(self._seen.values())) < now - self.dedup_seconds):
+            self._seen.popitem(last=False)
+        last = self._seen.pop(key, None)
+        self._seen[key] = now
+        return last is not None and now - last < self.dedup_seconds
+
+    def _take_token(self, ip_address, now):
+        """Seconds until the IP may click again, 0 when it may now"""
+        bucket = self._buckets.pop(ip_address, None) or [self.ip_burst, now]
+        if len(self._buckets) >= self.ip_buckets:
+            self._buckets.popitem(last=False)
+        self._buckets[ip_address] = bucket
+        bucket[0] = min(self.ip_burst, bucket[0] + (now - bucket[1]) * self.ip_rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            return (1 - bucket[0]) / self.ip_rate
+        bucket[0] -= 1
+        return 0
+
+    def _sample_every(self, now, pending):
+        second = int(now)
+        if second != self._second:
+            # Fold the finished second into the smoothed rate; idle seconds decay it
+            idle = min(second - self._second - 1, 10)
+            self._rate = (0.5 * self._rate + 0.5 * self._in_second) * 0.5 ** idle
+            self._second, self._in_second = second, 0
+        self._in_second += 1
+        # The running second is a lower bound of the current rate, so a burst counts at once
+        load = max(max(self._rate, self._in_second) / self.sample_above, pending / self.max_pending)
+        self.sample_every = math.ceil(load) if load > 1 else 1
+        return self.sample_every
+
+    def check(self, card_id, user_id, ip_address, user_agent, meta=None, pending=0):
+        """(verdict, weight, retry_after): the click is kept when verdict is 'ok', with weight"""
+        if is_bot(user_agent, meta):
+            return self._verdict('bot')
+        now = time.monotonic()
+        with self._lock:
+            if self._duplicate((user_id or ip_address, card_id), now):
+                return self._verdict('duplicate')
+            retry_after = self._take_token(ip_address, now)
+            if retry_after:
+                return self._verdict('rate_limited', retry_after=retry_after)
+            every = self._sample_every(time.time(), pending)
+        if every > 1 and random.random() * every >= 1:
+            return self._verdict('sampled_out')
+        return self._verdict('ok', weight=every)
+
+    def _verdict(self, verdict, weight=0, retry_after=0):
+        self.verdicts[verdict] += 1
+        return verdict, weight, retry_after
+
+    def stats(self):
+        return {'sample_every': self.sample_every, 'verdicts': dict(self.verdicts),
+                'dedup_keys': len(self._seen), 'ip_buckets': len(self._buckets)}
+
+
+click_filter = ClickFilter()
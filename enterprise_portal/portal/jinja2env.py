@@ -0,0 +1,38 @@
+"""
+Jinja2 environment for the public portal templates (base/jinja2, portal/jinja2).
+
+The Jinja2 templates mirror their Django counterparts under templates/ and get
+the same helpers: {{ url('name') }}, {{ static('path') }}, {{ _('text') }}
+through the i18n extension, get_current_language(), section_fragment() (see
+portal.fragments) and the capfirst filter.
+The backend itself provides request, csrf_input and csrf_token.
+
+Which views render with Jinja2 is chosen by PORTAL_JINJA2_VIEWS, see
+portal.utils.template_engine.
+"""
+from django.templatetags.static import static
+from django.urls import reverse
+from django.utils import translation
+from django.utils.text import capfirst
+from jinja2 import Environment, pass_context
+
+from portal.fragments import section_fragment as render_section
+
+
+def url(name, *args, **kwargs):
+    return reverse(name, args=args or None, kwargs=kwargs or None)
+
+
+@pass_context
+def section_fragment(context, section, template_name):
+    return render_section(section, template_name, 'jinja2', context['request'], context['settings'],
+                          context.get('is_edit_mode', False))
+
+
+def environment(**options):
+    env = Environment(extensions=['jinja2.ext.i18n'], **options)
+    env.install_gettext_callables(translation.gettext, translation.ngettext, newstyle=True)
+    env.globals.update(url=url, static=static, get_current_language=translation.get_language,
+                       section_fragment=section_fragment)
+    env.filters['capfirst'] = capfirst
+    return env
@@ -0,0 +1,234 @@
+"""
+Database-backed background jobs.
+
+There is no broker at the plants, so deferred work is queued as Job rows in
+the content database and run by ``manage.py run_jobs``:
+
+    from portal import jobs
+
+    @jobs.job('rebuild_icons')
+    def rebuild_icons():
+        ...
+
+    jobs.enqueue('rebuild_icons', key='rebuild_icons', delay=5)
+
+enqueue() only inserts a row, in the caller's transaction, so a view returns
+at once and the job only becomes visible to workers if the request commits.
+A non-empty ``key`` allows one queued job at a time (a unique constraint on
+queued rows): enqueueing the same key again while one waits is a no-op,
+which coalesces bursts such as "re-render after every card save".
+
+Workers claim jobs by update: a due job's row is switched from queued to
+running with a conditional UPDATE, and only the worker whose UPDATE matched
+the row runs it, so any number of workers can share the table. A failed
+job is queued again after JOB_RETRY_SECONDS, doubling per attempt, until
+max_attempts. A worker refreshes claimed_at of its running jobs while they
+run (heartbeat()); a job whose claim is older than JOB_TIMEOUT_SECONDS lost
+its worker and is queued again, or failed once it used its attempts, so a
+job that kills its worker does not loop. A worker only records the outcome
+of a job it still owns. A job that hangs keeps its live worker's heartbeat
+going and is never reclaimed; stop that worker to free it. Jobs registered
+with ``every=<seconds>`` are periodic: workers keep one occurrence queued
+and queue the next when it finishes.
+
+With JOB_RUN_INLINE a job runs right after the enqueueing transaction
+commits, in the same process, for development without a worker (no
+heartbeat: keep such jobs shorter than JOB_TIMEOUT_SECONDS).
+"""
+import logging
+import os
+import socket
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+class JobSpec:
+    __slots__ = ('name', 'func', 'max_attempts', 'every')
+
+    def __init__(self, name, func, max_attempts, every):
+        self.name = name
+        self.func = func
+        self.max_attempts = max_attempts
+        self.every = every
+
+    @property
+    def periodic_key(self):
+        return f'periodic:{self.name}'
+
+
+def job(name, max_attempts=3, every=None):
+    """Register the decorated function as the job `name`; `every` (seconds) makes it periodic"""
+    def register(func):
+        _registry[name] = JobSpec(name, func, max_attempts, every)
+        return func
+    return register
+
+
+def registered():
+    return dict(_registry)
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def enqueue(name, key='', run_at=None, delay=None, max_attempts=None, **kwargs):
+    """Queue a job; returns it, or None when a job with the same key is already queued"""
+    spec = _registry.get(name)
+    if spec is None:
+        raise KeyError(f'Unknown job: {name}')
+    if run_at is None:
+        run_at = timezone.now() + timedelta(seconds=delay or 0)
+    if key and Job.objects.filter(key=key, status=Job.QUEUED).exists():
+        return None
+    try:
+        # A savepoint, so losing the race to another enqueue leaves the caller's transaction usable
+        with transaction.atomic():
+            queued = Job.objects.create(name=name, args=kwargs, key=key, run_at=run_at,
+                                        max_attempts=max_attempts or spec.max_attempts)
+    except IntegrityError:
+        return None
+    if settings.JOB_RUN_INLINE:
+        transaction.on_commit(lambda: _run_inline(queued.pk))
+    return queued
+
+
+def _run_inline(job_id):
+    worker = worker_id()
+    if Job.objects.filter(pk=job_id, status=Job.QUEUED).update(
+            status=Job.RUNNING, claimed_by=worker, claimed_at=timezone.now(), attempts=1):
+        execute(job_id, worker)
+
+
+def claim(worker, limit):
+    """Ids of up to `limit` due jobs this worker now owns"""
+    now = timezone.now()
+    candidates = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).values_list('id', flat=True)
+    claimed = []
+    # Read a few more than needed: other workers may win some of them
+    for job_id in candidates[:limit * 2]:
+        won = Job.objects.filter(pk=job_id, status=Job.QUEUED).update(
+            status=Job.RUNNING, claimed_by=worker, claimed_at=now, attempts=F('attempts') + 1)
+        if won:
+            claimed.append(job_id)
+            if len(claimed) == limit:
+                break
+    return claimed
+
+
+def heartbeat(worker, job_ids):
+    """Refresh the claim of the worker's running jobs, so reclaim_stale() leaves them alone"""
+    return Job.objects.filter(pk__in=job_ids, status=Job.RUNNING, claimed_by=worker).update(
+        claimed_at=timezone.now())
+
+
+def _finish(claim, status, error=''):
+    """Record the outcome of the claimed job; False when the claim was lost meanwhile"""
+    return bool(claim.update(status=status, finished_at=timezone.now(), last_error=error))
+
+
+def _requeue(claim, run_at, error):
+    """
+    Queue the claimed job again; if a newer job with its key is already
+    queued, this one is superseded. False when the claim was lost meanwhile.
+    """
+    try:
+        with transaction.atomic():
+            return bool(claim.update(status=Job.QUEUED, run_at=run_at, last_error=error,
+                                     claimed_by='', claimed_at=None))
+    except IntegrityError:
+        return _finish(claim, Job.FAILED, error + '\nSuperseded by a newer queued job.')
+
+
+def retry(job_ids):
+    """Queue failed jobs again from their first attempt; returns how many were queued"""
+    queued = 0
+    for job_id in Job.objects.filter(pk__in=job_ids, status=Job.FAILED).values_list('id', flat=True):
+        try:
+            with transaction.atomic():
+                queued += Job.objects.filter(pk=job_id, status=Job.FAILED).update(
+                    status=Job.QUEUED, run_at=timezone.now(), attempts=0, claimed_by='', claimed_at=None,
+                    finished_at=None)
+        except IntegrityError:
+            pass  # a job with the same key is already queued
+    return queued
+
+
+def reclaim_stale():
+    """Queue again (or fail, out of attempts) the jobs whose worker stopped answering; returns how many"""
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT_SECONDS)
+    stale = Job.objects.filter(status=Job.RUNNING, claimed_at__lt=cutoff)
+    reclaimed = 0
+    for job_id, claimed_by, attempts, max_attempts in stale.values_list('id', 'claimed_by', 'attempts',
+                                                                       'max_attempts'):
+        # Still stale and still that worker's: a heartbeat since the read keeps the job
+        claim = stale.filter(pk=job_id, claimed_by=claimed_by)
+        error = f'Worker {claimed_by} stopped answering for {settings.JOB_TIMEOUT_SECONDS} s'
+        if attempts >= max_attempts:
+            reclaimed += _finish(claim, Job.FAILED, error)
+        else:
+            reclaimed += _requeue(claim, timezone.now(), error)
+    return reclaimed
+
+
+def schedule_periodic():
+    """Make sure every periodic job has an occurrence queued or running"""
+    now = timezone.now()
+    for spec in _registry.values():
+        if not spec.every:
+            continue
+        key = spec.periodic_key
+        if Job.objects.filter(key=key, status__in=(Job.QUEUED, Job.RUNNING)).exists():
+            continue
+        last = Job.objects.filter(key=key).order_by('-run_at').values_list('run_at', flat=True).first()
+        run_at = max(now, last + timedelta(seconds=spec.every)) if last else now
+        enqueue(spec.name, key=key, run_at=run_at)
+
+
+def execute(job_id, worker):
+    """Run a job claimed by `worker` and record the outcome, unless the claim was lost meanwhile"""
+    current = Job.objects.get(pk=job_id)
+    claim = Job.objects.filter(pk=job_id, status=Job.RUNNING, claimed_by=worker)
+    spec = _registry.get(current.name)
+    started = timezone.now()
+    try:
+        if spec is None:
+            raise KeyError(f'Unknown job: {current.name}')
+        spec.func(**current.args)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Job %s #%s failed (attempt %d of %d)', current.name, job_id,
+                       current.attempts, current.max_attempts, exc_info=True)
+        if spec is not None and current.attempts < current.max_attempts:
+            delay = settings.JOB_RETRY_SECONDS * 2 ** (current.attempts - 1)
+            recorded = _requeue(claim, timezone.now() + timedelta(seconds=delay), error)
+        else:
+            recorded = _finish(claim, Job.FAILED, error)
+    else:
+        recorded = _finish(claim, Job.DONE)
+        logger.info('Job %s #%s done in %.1f s', current.name, job_id,
+                    (timezone.now() - started).total_seconds())
+    if not recorded:
+        logger.warning('Job %s #%s was reclaimed from worker %s before it finished; outcome not recorded',
+                       current.name, job_id, worker)
+    if spec is not None and spec.every:
+        enqueue(spec.name, key=spec.periodic_key,
+                run_at=max(timezone.now(), current.run_at + timedelta(seconds=spec.every)))
+
+
+def prune(retention_days):
+    """Delete finished jobs older than retention_days; returns how many"""
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    return Job.objects.filter(status__in=(Job.DONE, Job.FAILED), finished_at__lt=cutoff).delete()[0]
@@ -0,0 +1,162 @@
+"""
+Change journal and feed for incremental sync.
+
+Every create, update and delete of a factory, section, card or the portal
+settings appends a ContentChange row in the same transaction as the change
+itself (portal.signals, and portal.catalogue for bulk imports). So does a
+change of an item's groups, as an update: they decide who sees the item, and
+the feed serves them with its values (``groups``, next to ``restricted``),
+including when a deleted group leaves its items. Its ``seq``
+only ever grows, so a consumer keeps the last ``seq`` it has seen as a
+cursor and asks for what changed since (changes_since), paying for the
+changes rather than for the whole catalogue.
+
+Entries carry no payload: the feed reads the current row of every changed
+object when it is served, so only the latest entry of an object matters.
+compact() therefore collapses each object's history to its latest entry,
+which keeps the journal about the size of the catalogue, and drops delete
+entries older than CHANGE_JOURNAL_RETENTION_DAYS. Dropping deletes raises
+the journal's floor; a consumer whose cursor is below it may have missed a
+delete and must download the catalogue again.
+
+Sequence numbers are taken at insert, not at commit. SQLite serialises
+writers so they become visible in order; on databases with concurrent
+writers set CHANGE_FEED_SETTLE_SECONDS so the feed holds back entries young
+enough to still have a lower-numbered transaction in flight.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import ContentChange, ContentChangeCompaction, FactoryButton, PortalSection, PortalSettings, SystemCard
+
+
+KINDS = {
+    FactoryButton: 'factory',
+    PortalSection: 'section',
+    SystemCard: 'card',
+    PortalSettings: 'settings',
+}
+MODELS = {kind: model for model, kind in KINDS.items()}
+
+# Columns served with each change: everything but the editing user
+FIELDS = {kind: [field.attname for field in model._meta.concrete_fields if field.name != 'updated_by']
+          for model, kind in KINDS.items()}
+# Kinds whose visibility is restricted by groups, served as a list of group ids
+GROUPED = {kind for model, kind in KINDS.items()
+           if any(field.name == 'groups' for field in model._meta.many_to_many)}
+
+
+class CursorExpired(Exception):
+    """The cursor is below the journal floor: the consumer must resync"""
+
+    def __init__(self, floor):
+        super().__init__(f'Cursor is older than the journal floor {floor}')
+        self.floor = floor
+
+
+def record(model, ids, action):
+    """Journal `action` for the rows `ids` of `model`"""
+    kind = KINDS[model]
+    now = timezone.now()
+    ContentChange.objects.bulk_create([ContentChange(kind=kind, object_id=pk, action=action, changed_at=now)
+                                       for pk in ids])
+
+
+def head():
+    """Cursor of the latest change, never below the floor (compaction may have pruned the latest entry)"""
+    latest = ContentChange.objects.aggregate(seq=Max('seq'))['seq']
+    return max(latest or 0, floor())
+
+
+def floor():
+    compaction = ContentChangeCompaction.objects.order_by('-floor').first()
+    return compaction.floor if compaction else 0
+
+
+def _group_ids(model, ids):
+    """{object id: [group id]} of the rows `ids` of `model`"""
+    field = model._meta.get_field('groups')
+    column = f'{field.m2m_field_name()}_id'
+    memberships = {}
+    for object_id, group_id in (field.remote_field.through.objects.filter(**{f'{column}__in': ids})
+                                .order_by('group_id').values_list(column, 'group_id')):
+        memberships.setdefault(object_id, []).append(group_id)
+    return memberships
+
+
+def changes_since(cursor, limit=None):
+    """
+    Changes after `cursor`, oldest first: ([change], next cursor, more).
+
+    Each object appears once per page, with its latest action and, unless it
+    was deleted, its current values. Raises CursorExpired when `cursor` is
+    below the journal floor.
+    """
+    limit = limit or settings.CHANGE_FEED_PAGE_SIZE
+    if cursor < floor():
+        raise CursorExpired(floor())
+
+    entries = ContentChange.objects.filter(seq__gt=cursor)
+    settle = getattr(settings, 'CHANGE_FEED_SETTLE_SECONDS', 0)
+    if settle:
+        entries = entries.filter(changed_at__lte=timezone.now() - timedelta(seconds=settle))
+    entries = list(entries.order_by('seq')[:limit + 1])
+    more = len(entries) > limit
+    entries = entries[:limit]
+    if not entries:
+        return [], cursor, False
+
+    latest = {}
+    for entry in entries:
+        latest.pop((entry.kind, entry.object_id), None)
+        latest[(entry.kind, entry.object_id)] = entry
+
+    wanted = {}
+    for (kind, object_id), entry in latest.items():
+        if entry.action != 'delete':
+            wanted.setdefault(kind, []).append(object_id)
+    rows = {}
+    for kind, ids in wanted.items():
+        groups = _group_ids(MODELS[kind], ids) if kind in GROUPED else None
+        for row in MODELS[kind].objects.filter(id__in=ids).values(*FIELDS[kind]):
+            if groups is not None:
+                row['groups'] = groups.get(row['id'], [])
+            rows[(kind, row['id'])] = row
+
+    changes = []
+    for key, entry in latest.items():
+        row = rows.get(key)
+        if entry.action != 'delete' and row is None:
+            # Deleted after this page was cut; its delete entry follows
+            continue
+        changes.append({
+            'seq': entry.seq,
+            'kind': entry.kind,
+            'id': entry.object_id,
+            'action': entry.action,
+            'changed_at': entry.changed_at,
+            'data': row,
+        })
+    return changes, entries[-1].seq, more
+
+
+def compact(retention_days=None):
+    """Collapse each object's history to its latest entry and drop old deletes"""
+    if retention_days is None:
+        retention_days = settings.CHANGE_JOURNAL_RETENTION_DAYS
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    with transaction.atomic():
+        latest = ContentChange.objects.values('kind', 'object_id').annotate(latest=Max('seq')).values('latest')
+        collapsed = ContentChange.objects.exclude(seq__in=latest).delete()[0]
+
+        old_deletes = ContentChange.objects.filter(action='delete', changed_at__lt=cutoff)
+        new_floor = old_deletes.aggregate(seq=Max('seq'))['seq']
+        pruned = old_deletes.delete()[0]
+
+        compaction = ContentChangeCompaction.objects.create(
+            floor=max(new_floor or 0, floor()), collapsed=collapsed, pruned=pruned)
+    return compaction
@@ -0,0 +1,119 @@
+"""
+Maintenance mode.
+
+MaintenanceMiddleware answers every public request with a 503 while
+PortalSettings.maintenance_mode is on, so planned downtime sheds traffic
+before any view, session or database work runs.
+
+The flag is read from the navigation snapshot (portal.navigation), which
+each worker keeps in memory and only recompiles when the content version in
+the shared cache changes; saving PortalSettings bumps that version. Checking
+the flag therefore costs one cache read per request and no query.
+
+The maintenance page itself is rendered once per language and content
+version and kept as bytes, so serving it is a dict lookup. Staff (signed in
+users with is_staff) and the paths in MAINTENANCE_EXEMPT_PATHS (admin,
+login, health checks, static files) pass through, so the portal can still be
+administered and switched back on.
+
+The middleware is sync and async capable: under ASGI it must not pin async
+views (long-polls, beacons) to Django's one thread for sync code, so the
+snapshot and the user are read on the database pool (portal.executor).
+"""
+import asyncio
+import json
+import threading
+
+from django.conf import settings as django_settings
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils import translation
+from django.utils.cache import patch_vary_headers
+
+from .executor import run_sync
+from .navigation import current
+
+
+_pages = {}
+_lock = threading.Lock()
+
+
+def exempt_paths():
+    paths = tuple(django_settings.MAINTENANCE_EXEMPT_PATHS)
+    return paths + tuple(url for url in (django_settings.STATIC_URL, django_settings.MEDIA_URL)
+                         if url and url.startswith('/'))
+
+
+def render_pages(snapshot):
+    """{lang: (html bytes, json bytes)} of the maintenance page for every language"""
+    pages = {}
+    for lang, _ in django_settings.LANGUAGES:
+        with translation.override(lang):
+            message = snapshot.settings.maintenance_message or translation.gettext(
+                'The portal is down for scheduled maintenance. Please try again shortly.')
+            html = render_to_string('portal/maintenance.html', {
+                'settings': snapshot.settings,
+                'message': message,
+                'retry_minutes': max(1, -(-django_settings.MAINTENANCE_RETRY_AFTER // 60)),
+                'LANGUAGE_CODE': lang,
+            })
+        pages[lang] = (html.encode(), json.dumps({'success': False, 'error': message}).encode())
+    return pages
+
+
+def pages_for(snapshot):
+    """The maintenance pages of this content version, rendered on first use"""
+    pages = _pages.get(snapshot.version)
+    if pages is None:
+        with _lock:
+            pages = _pages.get(snapshot.version)
+            if pages is None:
+                pages = render_pages(snapshot)
+                # Only the current version is ever served
+                _pages.clear()
+                _pages[snapshot.version] = pages
+    return pages
+
+
+def maintenance_response(request, snapshot):
+    pages = pages_for(snapshot)
+    html, payload = pages.get(getattr(request, 'LANGUAGE_CODE', None)) or pages[django_settings.LANGUAGE_CODE]
+    if request.path.startswith('/api/'):
+        response = HttpResponse(payload, status=503, content_type='application/json')
+    else:
+        response = HttpResponse(html, status=503)
+    response['Retry-After'] = str(django_settings.MAINTENANCE_RETRY_AFTER)
+    response['Cache-Control'] = 'no-store'
+    # Staff get the real page for the same URL, and each language its own copy
+    patch_vary_headers(response, ('Cookie', 'Accept-Language'))
+    return response
+
+
+class MaintenanceMiddleware:
+    """Serve the pre-rendered maintenance page while maintenance mode is on"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.exempt = exempt_paths()
+        if asyncio.iscoroutinefunction(get_response):
+            # Tells Django's handler this instance is a coroutine function, as MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not request.path.startswith(self.exempt):
+            snapshot = current()
+            # The user (a session read) is only looked at while maintenance is on
+            if snapshot.settings.maintenance_mode and not request.user.is_staff:
+                return maintenance_response(request, snapshot)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not request.path.startswith(self.exempt):
+            snapshot = await run_sync(current)
+            if snapshot.settings.maintenance_mode and not await run_sync(lambda: request.user.is_staff):
+                return await run_sync(maintenance_response, request, snapshot)
+        return await self.get_response(request)
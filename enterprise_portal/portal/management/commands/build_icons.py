@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from portal.icons import build, sprite_path
+
+
+class Command(BaseCommand):
+    help = 'Build the self-hosted icon stylesheet from the icons the catalogue and templates use'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', help='Unpacked Font Awesome Free download (default: ICON_SOURCE_DIR)')
+
+    def handle(self, *args, **options):
+        source = options['source'] or settings.ICON_SOURCE_DIR
+        try:
+            manifest = build(source)
+        except FileNotFoundError as e:
+            raise CommandError(f'{e}. Unpack fontawesome-free-6.x-web.zip there, or pass --source')
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(manifest['icons'])} icons, {manifest['bytes'] / 1024:.1f} KiB in {sprite_path('icons.css')}"))
+        if manifest['missing']:
+            self.stderr.write(f"Not found in {source}: {', '.join(manifest['missing'])}")
@@ -0,0 +1,50 @@
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from portal.agents import unpack_ip
+from portal.models import PortalAnalytics
+from portal.sketches import HyperLogLog, merge_into, visitor_key
+
+
+class Command(BaseCommand):
+    help = 'Build per-card daily visitor sketches from raw click analytics'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='First day to include (YYYY-MM-DD)')
+        parser.add_argument('--until', help='Last day to include (YYYY-MM-DD)')
+
+    def _parse_day(self, value):
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'Invalid date: {value}')
+
+    def handle(self, *args, **options):
+        clicks = PortalAnalytics.objects.order_by('clicked_at')
+        tz = timezone.get_current_timezone()
+        if options['since']:
+            day = self._parse_day(options['since'])
+            clicks = clicks.filter(clicked_at__gte=timezone.make_aware(datetime.combine(day, time.min), tz))
+        if options['until']:
+            day = self._parse_day(options['until']) + timedelta(days=1)
+            clicks = clicks.filter(clicked_at__lt=timezone.make_aware(datetime.combine(day, time.min), tz))
+
+        # Clicks come ordered by time, so only one day of sketches is held at once
+        current_day, sketches, written = None, {}, 0
+        rows = clicks.values_list('card_id', 'user_id', 'ip', 'clicked_at')
+        for card_id, user_id, ip, clicked_at in rows.iterator(chunk_size=5000):
+            day = timezone.localtime(clicked_at, tz).date()
+            if day != current_day:
+                written += self._flush(current_day, sketches)
+                current_day, sketches = day, {}
+            sketches.setdefault(card_id, HyperLogLog()).add(visitor_key(user_id, unpack_ip(ip)))
+        written += self._flush(current_day, sketches)
+
+        self.stdout.write(self.style.SUCCESS(f'Merged {written} card/day sketches'))
+
+    def _flush(self, day, sketches):
+        for card_id, sketch in sketches.items():
+            merge_into(card_id, day, sketch)
+        return len(sketches)
@@ -0,0 +1,94 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from portal.mmapcache import MmapCache
+
+
+# Values shaped like what the portal caches: the content version, a user's
+# group ids and a session
+VALUES = (
+    time.time_ns(),
+    frozenset({3, 7, 12}),
+    {'_auth_user_id': '42', '_auth_user_backend': 'portal.backends.CachedModelBackend',
+     '_auth_user_hash': 'f' * 64, 'django_language': 'zh-hans'},
+)
+
+
+def backends(directory, entries):
+    params = {'OPTIONS': {'MAX_ENTRIES': entries}}
+    return (
+        ('locmem', lambda: LocMemCache('benchmark', params)),
+        ('filebased', lambda: FileBasedCache(os.path.join(directory, 'files'), params)),
+        ('mmap', lambda: MmapCache(os.path.join(directory, 'cache.mmap'), params)),
+    )
+
+
+def rate(operation, keys, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for key in keys:
+            operation(key)
+    return len(keys) * repeat / (time.perf_counter() - started)
+
+
+def worker(make_cache, keys, repeat, filled, results):
+    """Read every key in a forked worker once the parent filled the cache: (gets per second, hit ratio)"""
+    cache = make_cache()
+    hits = 0
+    filled.wait()
+
+    def get(key):
+        nonlocal hits
+        hits += cache.get(key) is not None
+
+    results.put((rate(get, keys, repeat), hits / (len(keys) * repeat)))
+
+
+class Command(BaseCommand):
+    help = 'Compare the locmem, file-based and mmap cache backends, alone and shared by forked workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keys', type=int, default=1000, help='Distinct keys')
+        parser.add_argument('--repeat', type=int, default=5, help='Passes over the keys per measurement')
+        parser.add_argument('--workers', type=int, default=4, help='Forked workers reading the cache at once')
+
+    def handle(self, *args, **options):
+        keys = [f'benchmark:{i}' for i in range(options['keys'])]
+        repeat, workers = options['repeat'], options['workers']
+        directory = tempfile.mkdtemp(prefix='cache-benchmark-')
+        context = multiprocessing.get_context('fork')
+        try:
+            self.stdout.write(f"{'backend':<10} {'set/s':>10} {'get/s':>10} {'miss/s':>10} "
+                              f"{'shared get/s':>13} {'shared hits':>12}")
+            for name, make_cache in backends(directory, len(keys) * 2):
+                cache = make_cache()
+                cache.clear()
+                # Workers fork before the parent fills the cache: only a shared backend shows them its entries
+                filled, results = context.Event(), context.Queue()
+                processes = [context.Process(target=worker, args=(make_cache, keys, repeat, filled, results))
+                             for _ in range(workers)]
+                for process in processes:
+                    process.start()
+
+                sets = rate(lambda key: cache.set(key, VALUES[hash(key) % len(VALUES)]), keys, repeat)
+                gets = rate(cache.get, keys, repeat)
+                misses = rate(lambda key: cache.get(key + ':missing'), keys, repeat)
+
+                filled.set()
+                shared = [results.get() for _ in processes]
+                for process in processes:
+                    process.join()
+                shared_gets = sum(result[0] for result in shared)
+                hit_ratio = sum(result[1] for result in shared) / len(shared)
+
+                self.stdout.write(f'{name:<10} {sets:>10,.0f} {gets:>10,.0f} {misses:>10,.0f} '
+                                  f'{shared_gets:>13,.0f} {hit_ratio:>12.0%}')
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from portal.journal import compact
+
+
+class Command(BaseCommand):
+    help = "Collapse the change journal to each object's latest entry and drop old delete entries"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, default=settings.CHANGE_JOURNAL_RETENTION_DAYS,
+                            help='Keep delete entries this many days (default: CHANGE_JOURNAL_RETENTION_DAYS)')
+
+    def handle(self, *args, **options):
+        if options['retention_days'] < 0:
+            raise CommandError('--retention-days cannot be negative')
+        compaction = compact(options['retention_days'])
+        self.stdout.write(f'Collapsed {compaction.collapsed} superseded entries, '
+                          f'pruned {compaction.pruned} old deletes; floor is now {compaction.floor}')
@@ -0,0 +1,96 @@
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from portal.models import SystemCard
+
+
+async def http(host, port, method, path, timeout):
+    """Minimal HTTP/1.1 request on its own connection; returns (status, body)"""
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(f'{method} {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n'
+                     f'Content-Length: 0\r\n\r\n'.encode())
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), body
+
+
+class Command(BaseCommand):
+    help = ('Park long-poll connections on a running server and measure click beacon latency '
+            'meanwhile, to size WSGI versus ASGI workers')
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='Base URL of the running server, e.g. http://127.0.0.1:8000')
+        parser.add_argument('--pollers', type=int, default=200, help='Idle /api/version/ long-polls to hold open')
+        parser.add_argument('--clicks', type=int, default=200, help='Click beacons sent while the pollers wait')
+        parser.add_argument('--concurrency', type=int, default=20, help='Beacons in flight at once')
+        parser.add_argument('--hold', type=float, default=10, help='Seconds each long-poll is held open')
+        parser.add_argument('--timeout', type=float, default=15, help='Client timeout per request')
+
+    def handle(self, *args, **options):
+        card = SystemCard.objects.filter(is_active=True).first()
+        if card is None:
+            raise CommandError('No active card to click')
+        url = urlsplit(options['url'])
+        results = asyncio.run(self.run(url.hostname, url.port or 80, card.id, options))
+
+        pollers, clicks, elapsed = results
+        self.stdout.write(f"Pollers: {pollers['ok']}/{options['pollers']} answered, "
+                          f"{pollers['failed']} failed or timed out")
+        self.stdout.write(f"Beacons: {len(clicks['latency'])}/{options['clicks']} answered "
+                          f"({clicks['limited']} rate limited by the click filter), "
+                          f"{clicks['failed']} failed or timed out, in {elapsed:.1f} s")
+        if clicks['latency']:
+            latency = sorted(clicks['latency'])
+            p95 = latency[min(len(latency) - 1, int(len(latency) * 0.95))]
+            self.stdout.write(f'Beacon latency: median {statistics.median(latency) * 1000:.1f} ms, '
+                              f'p95 {p95 * 1000:.1f} ms, max {latency[-1] * 1000:.1f} ms')
+
+    async def run(self, host, port, card_id, options):
+        timeout = options['timeout']
+        status, body = await http(host, port, 'GET', '/api/version/?timeout=0', timeout)
+        if status != 200:
+            raise CommandError(f'/api/version/ answered {status}')
+        version = json.loads(body)['version']
+
+        pollers = {'ok': 0, 'failed': 0}
+        clicks = {'latency': [], 'limited': 0, 'failed': 0}
+
+        async def poll():
+            try:
+                status, _ = await http(host, port, 'GET', f"/api/version/?since={version}&timeout={options['hold']}",
+                                       options['hold'] + timeout)
+                pollers['ok' if status == 200 else 'failed'] += 1
+            except (OSError, asyncio.TimeoutError):
+                pollers['failed'] += 1
+
+        semaphore = asyncio.Semaphore(options['concurrency'])
+
+        async def click():
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    status, _ = await http(host, port, 'POST', f'/api/cards/{card_id}/track/', timeout)
+                except (OSError, asyncio.TimeoutError):
+                    status = None
+                # All beacons come from one IP, so most hit its token bucket (portal.ingest)
+                if status in (200, 429):
+                    clicks['latency'].append(time.perf_counter() - started)
+                    clicks['limited'] += status == 429
+                else:
+                    clicks['failed'] += 1
+
+        started = time.perf_counter()
+        parked = [asyncio.ensure_future(poll()) for _ in range(options['pollers'])]
+        await asyncio.sleep(1)  # let the pollers connect and park
+        await asyncio.gather(*(click() for _ in range(options['clicks'])))
+        await asyncio.gather(*parked)
+        return pollers, clicks, time.perf_counter() - started
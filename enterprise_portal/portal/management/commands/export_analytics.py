@@ -0,0 +1,42 @@
+import sys
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from portal.exports import export_rows, parse_quarter, stream_csv, stream_xlsx
+
+
+class Command(BaseCommand):
+    help = 'Stream raw click analytics to CSV or XLSX'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['csv', 'xlsx'], default='csv')
+        parser.add_argument('--factory', type=int, help='Only clicks on cards of this factory id')
+        parser.add_argument('--quarter', help='Calendar quarter, e.g. 2025Q3')
+        parser.add_argument('--start', help='First day to include (YYYY-MM-DD)')
+        parser.add_argument('--end', help='Last day to include (YYYY-MM-DD)')
+        parser.add_argument('--output', '-o', help='Output file (default: stdout)')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        try:
+            start = end = None
+            if options['quarter']:
+                start, end = parse_quarter(options['quarter'])
+            if options['start']:
+                start = datetime.strptime(options['start'], '%Y-%m-%d').date()
+            if options['end']:
+                end = datetime.strptime(options['end'], '%Y-%m-%d').date()
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        rows = export_rows(factory_id=options['factory'], start=start, end=end, chunk_size=options['chunk_size'])
+        stream = stream_csv(rows) if options['format'] == 'csv' else stream_xlsx(rows)
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in stream:
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
@@ -0,0 +1,26 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand
+
+from portal.catalogue import export_catalogue
+
+
+class Command(BaseCommand):
+    help = 'Export factories, sections and cards (all languages) as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--factory', type=int, action='append', dest='factories',
+                            help='Only export this factory id (repeatable)')
+        parser.add_argument('--no-home', action='store_true', help='Skip the home page sections')
+        parser.add_argument('--output', '-o', help='Output file (default: stdout)')
+
+    def handle(self, *args, **options):
+        data = export_catalogue(factory_ids=options['factories'], include_home=not options['no_home'])
+        output = open(options['output'], 'w', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            json.dump(data, output, ensure_ascii=False, indent=2)
+            output.write('\n')
+        finally:
+            if options['output']:
+                output.close()
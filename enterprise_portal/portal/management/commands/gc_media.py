@@ -0,0 +1,25 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from portal.storage import orphaned_media
+
+
+class Command(BaseCommand):
+    help = 'Delete uploaded settings images (logo, favicon, background) that PortalSettings no longer refers to'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=float, default=24,
+                            help='Only delete files older than this many hours (default: 24)')
+        parser.add_argument('--dry-run', action='store_true', help='List the files without deleting them')
+
+    def handle(self, *args, **options):
+        if options['min_age'] < 0:
+            raise CommandError('--min-age cannot be negative')
+        orphans = orphaned_media(options['min_age'] * 3600)
+        for name, size in orphans:
+            self.stdout.write(f'{name} ({size / 1024:.1f} KiB)')
+            if not options['dry_run']:
+                default_storage.delete(name)
+        total = sum(size for _, size in orphans) / 1024
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(orphans)} unreferenced files, {total:.1f} KiB'))
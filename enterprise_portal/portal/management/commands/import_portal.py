@@ -0,0 +1,40 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from portal.catalogue import import_catalogue
+
+
+class Command(BaseCommand):
+    help = 'Import a catalogue exported with export_portal, applying only the differences'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='JSON file written by export_portal')
+        parser.add_argument('--prune', action='store_true',
+                            help='Delete rows missing from the file, within the factories it contains')
+        parser.add_argument('--dry-run', action='store_true', help='Report the changes without saving them')
+        parser.add_argument('--user', help='Username recorded as updated_by')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"Unknown user: {options['user']}")
+
+        try:
+            with open(options['file'], encoding='utf-8') as f:
+                data = json.load(f)
+            stats = import_catalogue(data, user=user, prune=options['prune'], dry_run=options['dry_run'])
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(str(e))
+
+        for model, counts in stats.items():
+            summary = ', '.join(f'{count} {action}' for action, count in counts.items())
+            self.stdout.write(f'{model}: {summary}')
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('Dry run, nothing was saved'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Catalogue imported'))
@@ -0,0 +1,35 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from portal.models import FactoryButton, PortalSection, SystemCard
+from portal.navigation import Snapshot, content_version
+
+
+class Command(BaseCommand):
+    help = 'Compile the navigation snapshot and report its build time and memory footprint'
+
+    def handle(self, *args, **options):
+        snapshot = Snapshot(content_version())
+        objects, size = snapshot.footprint()
+
+        self.stdout.write(f'Content version: {snapshot.version}')
+        self.stdout.write('Catalogue: {} factories, {} sections, {} cards'.format(
+            FactoryButton.objects.count(), PortalSection.objects.count(), SystemCard.objects.count()))
+        self.stdout.write(f'Build time: {snapshot.build_seconds * 1000:.1f} ms')
+        self.stdout.write(f'Footprint: {objects} objects, {size / 1024:.1f} KiB')
+
+        self.stdout.write('')
+        self.stdout.write(f"{'language':<10} {'tier':<15} {'factories':>9} {'sections':>9} {'cards':>7}")
+        for (lang, tier), view in sorted(snapshot.views.items()):
+            sections = len(view.home_sections) + sum(len(s) for s in view.factory_sections.values())
+            self.stdout.write(f'{lang:<10} {tier:<15} {len(view.factories):>9} {sections:>9} {len(view.cards_by_id):>7}')
+
+        # Per card cost, for sizing large catalogues
+        card = next((v for view in snapshot.views.values() for v in view.cards_by_id.values()), None)
+        if card is not None:
+            card_size = sys.getsizeof(card) + sum(
+                sys.getsizeof(getattr(card, slot)) for slot in card.__slots__
+                if isinstance(getattr(card, slot), str))
+            self.stdout.write('')
+            self.stdout.write(f'One card view: ~{card_size} bytes (shared by every tier of a language)')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from portal.prerender import build, prerender_root
+
+
+class Command(BaseCommand):
+    help = 'Pre-render the anonymous home and factory pages for every language'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', help='Target directory (default: PRERENDER_ROOT)')
+        parser.add_argument('--force', action='store_true', help='Render every page, even unchanged ones')
+
+    def handle(self, *args, **options):
+        root = options['output'] or prerender_root()
+        stats = build(root, force=options['force'])
+        self.stdout.write(self.style.SUCCESS(
+            '{rendered} rendered, {unchanged} unchanged, {removed} removed'.format(**stats) + f' in {root}'))
@@ -0,0 +1,95 @@
+import multiprocessing
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+
+from portal import jobs
+
+
+def run_job(job_id, worker):
+    try:
+        jobs.execute(job_id, worker)
+    finally:
+        close_old_connections()
+
+
+def ignore_interrupt():
+    # Ctrl+C reaches the whole process group: the parent decides when children stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (see portal.jobs) until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.JOB_WORKER_CONCURRENCY,
+                            help='Jobs run at once (default: JOB_WORKER_CONCURRENCY)')
+        parser.add_argument('--processes', action='store_true',
+                            help='Run jobs in forked processes instead of threads (CPU-heavy jobs)')
+        parser.add_argument('--poll', type=float, default=settings.JOB_POLL_SECONDS,
+                            help='Seconds between looks for due jobs (default: JOB_POLL_SECONDS)')
+        parser.add_argument('--once', action='store_true', help='Run the jobs that are due now, then exit')
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        if concurrency < 1:
+            raise CommandError('--concurrency must be at least 1')
+        if options['processes']:
+            executor = ProcessPoolExecutor(concurrency, mp_context=multiprocessing.get_context('fork'),
+                                           initializer=ignore_interrupt)
+        else:
+            executor = ThreadPoolExecutor(concurrency, thread_name_prefix='job')
+
+        stopping = False
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+            self.stdout.write('Stopping after the running jobs finish')
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        worker = jobs.worker_id()
+        running = {}
+        done = 0
+        self.stdout.write(f'Worker {worker}: {len(jobs.registered())} jobs registered, concurrency {concurrency}')
+        try:
+            # After a stop, keep the heartbeat going until the running jobs finish
+            while running or not stopping:
+                if running:
+                    jobs.heartbeat(worker, list(running.values()))
+                if not options['once'] and not stopping:
+                    jobs.reclaim_stale()
+                    jobs.schedule_periodic()
+                for future in [future for future in running if future.done()]:
+                    job_id = running.pop(future)
+                    done += 1
+                    if future.exception() is not None:
+                        self.stderr.write(f'Job #{job_id} could not be recorded: {future.exception()}')
+
+                claimed = []
+                if not stopping and len(running) < concurrency:
+                    claimed = jobs.claim(worker, concurrency - len(running))
+                if claimed and options['processes']:
+                    # Forked children must not share the parent's database connection
+                    connections.close_all()
+                for job_id in claimed:
+                    running[executor.submit(run_job, job_id, worker)] = job_id
+
+                if options['once'] and not claimed and not running:
+                    break
+                if claimed:
+                    continue
+                # Wake up as soon as a slot frees, or after the poll interval
+                if running:
+                    wait(running, timeout=options['poll'], return_when=FIRST_COMPLETED)
+                elif not stopping:
+                    time.sleep(options['poll'])
+        finally:
+            executor.shutdown(wait=True)
+        self.stdout.write(self.style.SUCCESS(f'Worker {worker} stopped after {done} jobs'))
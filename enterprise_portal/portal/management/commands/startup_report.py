@@ -0,0 +1,75 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from portal.warmup import format_report
+
+
+# Runs in a fresh interpreter so nothing is imported yet
+CHILD = '''
+import json, os, time
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', {settings_module!r})
+started = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+get_wsgi_application()
+loaded = time.perf_counter() - started
+from portal.warmup import warm_up
+print(json.dumps({{'load': loaded, 'warm_up': warm_up(connect_databases=True)}}, default=str))
+'''
+
+
+def parse_importtime(output):
+    """[(module, self_us, cumulative_us)] from python -X importtime output"""
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+class Command(BaseCommand):
+    help = 'Report the import and warm-up cost of a fresh worker, by module and by step'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=15, help='Number of packages/modules to list')
+
+    def handle(self, *args, **options):
+        top = options['top']
+        code = CHILD.format(settings_module=os.environ.get('DJANGO_SETTINGS_MODULE', 'enterprise_portal.settings'))
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                cwd=settings.BASE_DIR, capture_output=True, text=True)
+        if result.returncode:
+            self.stderr.write(result.stderr)
+            return
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+        modules = parse_importtime(result.stderr)
+
+        packages = {}
+        for name, self_us, _ in modules:
+            package = name.split('.')[0]
+            count, total = packages.get(package, (0, 0))
+            packages[package] = (count + 1, total + self_us)
+
+        self.stdout.write(f"Application load: {timings['load'] * 1000:.1f} ms, "
+                          f'{len(modules)} modules imported in {sum(m[1] for m in modules) / 1000:.1f} ms')
+
+        self.stdout.write('')
+        self.stdout.write(f"{'package':<30} {'modules':>8} {'import ms':>10}")
+        for package, (count, total) in sorted(packages.items(), key=lambda item: -item[1][1])[:top]:
+            self.stdout.write(f'{package:<30} {count:>8} {total / 1000:>10.1f}')
+
+        self.stdout.write('')
+        self.stdout.write(f"{'module (cumulative)':<50} {'ms':>8}")
+        for name, _, cumulative_us in sorted(modules, key=lambda module: -module[2])[:top]:
+            self.stdout.write(f'{name:<50} {cumulative_us / 1000:>8.1f}')
+
+        self.stdout.write('')
+        self.stdout.write('Warm-up:')
+        for line in format_report(timings['warm_up']):
+            self.stdout.write(f'  {line}')
@@ -0,0 +1,74 @@
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management.base import BaseCommand, CommandError
+from django.template import engines
+from django.test import RequestFactory
+from django.urls import reverse
+from django.utils import translation
+
+from portal.navigation import current
+from portal.views import factory_context, home_context
+
+
+class Command(BaseCommand):
+    help = 'Compare render time and allocations of the public templates under the Django and Jinja2 engines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--factory', type=int, help='Factory page to render (default: the largest one)')
+        parser.add_argument('--user', help='Render as this user instead of an anonymous visitor')
+        parser.add_argument('--language', default='en')
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        if 'jinja2' not in engines:
+            raise CommandError('The Jinja2 engine is not configured (is Jinja2 installed?)')
+        if settings.DEBUG:
+            self.stderr.write('DEBUG is on: the Django engine runs without the cached loader and re-reads '
+                              'included templates on every render. Run with DEBUG off for production numbers.')
+        user = AnonymousUser()
+        if options['user']:
+            user = User.objects.get(username=options['user'])
+
+        with translation.override(options['language']):
+            factory_id = options['factory'] or self.largest_factory()
+            pages = [('home', 'portal/home.html', reverse('home'), home_context)]
+            if factory_id:
+                pages.append(('factory', 'portal/factory.html', reverse('factory') + f'?id={factory_id}',
+                              lambda request: factory_context(request, factory_id)))
+
+            self.stdout.write(f"{'page':<9} {'engine':<8} {'ms/render':>10} {'peak KiB':>9} {'bytes':>8}")
+            for name, template_name, path, build_context in pages:
+                request = RequestFactory().get(path)
+                request.user = user
+                context = build_context(request)
+                for alias in ('django', 'jinja2'):
+                    template = engines[alias].get_template(template_name)
+                    html = template.render(dict(context), request)  # compile and warm up
+                    seconds = self.timed(template, context, request, options['repeat'])
+                    peak = self.allocations(template, context, request)
+                    self.stdout.write(f'{name:<9} {alias:<8} {seconds * 1000:>10.3f} {peak / 1024:>9.1f} {len(html):>8}')
+
+    def largest_factory(self):
+        view = current().view(translation.get_language(), 'anonymous')
+        sizes = {factory.id: sum(len(section.filtered_cards) for section in view.sections_for(factory.id))
+                 for factory in view.factories}
+        return max(sizes, key=sizes.get) if sizes else None
+
+    def timed(self, template, context, request, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            template.render(dict(context), request)
+        return (time.perf_counter() - started) / repeat
+
+    def allocations(self, template, context, request):
+        """Peak bytes allocated while rendering once"""
+        tracemalloc.start()
+        try:
+            template.render(dict(context), request)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return peak
@@ -0,0 +1,15 @@
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.middleware import SessionMiddleware
+
+
+class PortalSessionMiddleware(SessionMiddleware):
+    """
+    Session middleware that never persists a brand new session for an
+    anonymous visitor, so browsing the portal creates no session rows.
+    """
+
+    def process_response(self, request, response):
+        session = getattr(request, 'session', None)
+        if session is not None and session.session_key is None and SESSION_KEY not in session:
+            session.modified = False
+        return super().process_response(request, response)
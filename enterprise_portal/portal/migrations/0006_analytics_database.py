@@ -0,0 +1,54 @@
+# Generated by Django 3.2.25 on 2026-10-19 08:49
+
+from django.conf import settings
+from django.db import connections, migrations, models
+import django.db.models.deletion
+
+
+def analytics_db():
+    # As portal.routers.analytics_db() was when this migration was written
+    return 'analytics' if 'analytics' in settings.DATABASES else 'default'
+
+
+def copy_existing_clicks(apps, schema_editor):
+    """Copy clicks recorded before the split from the default database (0019 drops the original)"""
+    target = schema_editor.connection.alias
+    if target == 'default':
+        return
+    source = connections['default']
+    if 'portal_portalanalytics' not in source.introspection.table_names():
+        return
+
+    PortalAnalytics = apps.get_model('portal', 'PortalAnalytics')
+    rows = PortalAnalytics.objects.using('default').order_by('pk')
+    batch = []
+    for row in rows.iterator(chunk_size=2000):
+        batch.append(row)
+        if len(batch) >= 2000:
+            PortalAnalytics.objects.using(target).bulk_create(batch)
+            batch = []
+    if batch:
+        PortalAnalytics.objects.using(target).bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('portal', '0005_auto_20250818_0917'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='portalanalytics',
+            name='card',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='analytics', to='portal.systemcard'),
+        ),
+        migrations.AlterField(
+            model_name='portalanalytics',
+            name='user',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(copy_existing_clicks, migrations.RunPython.noop,
+                             hints={'target_db': analytics_db()}),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-19 09:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('portal', '0006_analytics_database'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserCardFrequency',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('epoch', models.FloatField()),
+                ('weights', models.TextField(default='{}')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='card_frequency', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-19 10:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0008_trendingcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardVisitorSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('sketch', models.BinaryField(default=b'')),
+                ('card', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='visitor_sketches', to='portal.systemcard')),
+            ],
+            options={
+                'unique_together': {('card', 'day')},
+            },
+        ),
+    ]
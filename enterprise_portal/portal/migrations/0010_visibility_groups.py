@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('portal', '0009_cardvisitorsketch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='factorybutton',
+            name='groups',
+            field=models.ManyToManyField(blank=True, help_text='Only members of these groups see it (none: no restriction)', related_name='portal_factories', to='auth.Group'),
+        ),
+        migrations.AddField(
+            model_name='portalsection',
+            name='groups',
+            field=models.ManyToManyField(blank=True, help_text='Only members of these groups see it (none: no restriction)', related_name='portal_sections', to='auth.Group'),
+        ),
+        migrations.AddField(
+            model_name='systemcard',
+            name='groups',
+            field=models.ManyToManyField(blank=True, help_text='Only members of these groups see it (none: no restriction)', related_name='portal_cards', to='auth.Group'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:17
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0010_visibility_groups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentChange',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('create', 'Create'), ('update', 'Update'), ('delete', 'Delete')], max_length=10)),
+                ('changed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['seq'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ContentChangeCompaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('floor', models.BigIntegerField(default=0)),
+                ('collapsed', models.IntegerField(default=0)),
+                ('pruned', models.IntegerField(default=0)),
+                ('ran_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-ran_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='contentchange',
+            index=models.Index(fields=['kind', 'object_id'], name='portal_cont_kind_6e683d_idx'),
+        ),
+    ]
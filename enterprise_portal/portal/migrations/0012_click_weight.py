@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0011_change_journal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='portalanalytics',
+            name='weight',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,173 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:23
+
+import hashlib
+import ipaddress
+import re
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+BATCH_SIZE = 5000
+
+# Frozen copies of portal.agents and portal.ingest as of this migration: it
+# must keep backfilling the same way whatever later becomes of those modules
+
+BOT_AGENTS = re.compile(
+    r'bot|crawl|spider|slurp|monitor|uptime|pingdom|statuscake|nagios|zabbix|headless|phantomjs|'
+    r'lighthouse|preview|facebookexternalhit|curl|wget|python-|httpclient|okhttp|go-http|java/|'
+    r'libwww|scrapy|postman',
+    re.IGNORECASE)
+
+BROWSERS = (
+    ('Edge', re.compile(r'Edg(?:e|A|iOS)?/([\d.]+)')),
+    ('Opera', re.compile(r'(?:OPR|Opera)/([\d.]+)')),
+    ('Samsung Internet', re.compile(r'SamsungBrowser/([\d.]+)')),
+    ('Chrome', re.compile(r'(?:Chrome|CriOS)/([\d.]+)')),
+    ('Firefox', re.compile(r'(?:Firefox|FxiOS)/([\d.]+)')),
+    ('Safari', re.compile(r'Version/([\d.]+).*Safari/')),
+    ('Internet Explorer', re.compile(r'(?:MSIE |Trident/.*rv:)([\d.]+)')),
+)
+
+WINDOWS_VERSIONS = {'10.0': '10', '6.3': '8.1', '6.2': '8', '6.1': '7', '6.0': 'Vista', '5.1': 'XP'}
+
+SYSTEMS = (
+    ('Windows', re.compile(r'Windows NT ([\d.]+)'), lambda version: WINDOWS_VERSIONS.get(version, version)),
+    ('Android', re.compile(r'Android ([\d.]+)'), None),
+    ('iOS', re.compile(r'(?:iPhone|CPU) OS (\d+(?:_\d+)?)'), lambda version: version.replace('_', '.')),
+    ('macOS', re.compile(r'Mac OS X (\d+(?:[_.]\d+)?)'), lambda version: version.replace('_', '.')),
+    ('Chrome OS', re.compile(r'CrOS \S+ ([\d.]+)'), None),
+    ('Linux', re.compile(r'Linux()'), None),
+)
+
+TABLET = re.compile(r'iPad|Tablet|Android(?!.*Mobile)', re.IGNORECASE)
+MOBILE = re.compile(r'Mobi|iPhone|iPod|Windows Phone', re.IGNORECASE)
+
+
+def parse(user_agent):
+    """(browser, browser version, os, device) of a user agent string"""
+    browser = version = os = ''
+    for name, pattern in BROWSERS:
+        match = pattern.search(user_agent)
+        if match:
+            browser, version = name, match.group(1).split('.')[0]
+            break
+    for name, pattern, label in SYSTEMS:
+        match = pattern.search(user_agent)
+        if match:
+            os = f'{name} {label(match.group(1)) if label else match.group(1)}'.strip()
+            break
+
+    if not user_agent or BOT_AGENTS.search(user_agent):
+        device = 'bot'
+    elif TABLET.search(user_agent):
+        device = 'tablet'
+    elif MOBILE.search(user_agent):
+        device = 'mobile'
+    elif browser or os:
+        device = 'desktop'
+    else:
+        device = 'other'
+    return browser, version, os, device
+
+
+def digest(user_agent):
+    return hashlib.sha1(user_agent.encode('utf-8', 'replace')).hexdigest()
+
+
+def pack_ip(ip_address):
+    """Packed bytes of an IP address, b'' when it is missing or malformed"""
+    try:
+        return ipaddress.ip_address((ip_address or '').strip()).packed
+    except ValueError:
+        return b''
+
+
+def intern_with(model, user_agents, using=None):
+    """{string: id} of UserAgent rows for the strings, inserting the missing ones"""
+    manager = model.objects.db_manager(using)
+    wanted = {digest(user_agent): user_agent for user_agent in set(user_agents)}
+    ids = dict(manager.filter(digest__in=list(wanted)).values_list('digest', 'id'))
+    missing = []
+    for key, user_agent in wanted.items():
+        if key not in ids:
+            browser, version, os, device = parse(user_agent)
+            missing.append(model(digest=key, string=user_agent, browser=browser, browser_version=version,
+                                 os=os, device=device))
+    if missing:
+        manager.bulk_create(missing, ignore_conflicts=True)
+        ids.update(manager.filter(digest__in=[row.digest for row in missing]).values_list('digest', 'id'))
+    return {user_agent: ids[key] for key, user_agent in wanted.items()}
+
+
+def analytics_db():
+    return 'analytics' if 'analytics' in settings.DATABASES else 'default'
+
+
+def backfill_dimensions(apps, schema_editor):
+    """Intern the user agents and pack the IPs of existing clicks, a batch of rows at a time"""
+    db = schema_editor.connection.alias
+    PortalAnalytics = apps.get_model('portal', 'PortalAnalytics')
+    UserAgent = apps.get_model('portal', 'UserAgent')
+    rows = PortalAnalytics.objects.using(db).order_by('pk')
+    table = schema_editor.connection.ops.quote_name(PortalAnalytics._meta.db_table)
+    last_pk = 0
+    while True:
+        batch = list(rows.filter(pk__gt=last_pk).values_list('pk', 'ip_address', 'user_agent')[:BATCH_SIZE])
+        if not batch:
+            return
+        in_batch = rows.filter(pk__gt=last_pk, pk__lte=batch[-1][0])
+
+        # Few distinct agents per batch: one UPDATE each
+        agents = intern_with(UserAgent, (user_agent for _, _, user_agent in batch), using=db)
+        for user_agent, agent_id in agents.items():
+            in_batch.filter(user_agent=user_agent).update(agent=agent_id)
+
+        # IPs are nearly per row: one prepared UPDATE run for the whole batch
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(f'UPDATE {table} SET ip = %s WHERE id = %s',
+                               [(pack_ip(ip_address), pk) for pk, ip_address, _ in batch])
+        last_pk = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0012_click_weight'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAgent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=40, unique=True)),
+                ('string', models.TextField()),
+                ('browser', models.CharField(blank=True, max_length=50)),
+                ('browser_version', models.CharField(blank=True, max_length=20)),
+                ('os', models.CharField(blank=True, max_length=50)),
+                ('device', models.CharField(choices=[('desktop', 'Desktop'), ('mobile', 'Mobile'), ('tablet', 'Tablet'), ('bot', 'Bot'), ('other', 'Other')], default='other', max_length=10)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='portalanalytics',
+            name='ip',
+            field=models.BinaryField(default=b'', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='portalanalytics',
+            name='agent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='clicks', to='portal.useragent'),
+        ),
+        migrations.RunPython(backfill_dimensions, migrations.RunPython.noop,
+                             hints={'target_db': analytics_db()}),
+        migrations.RemoveField(
+            model_name='portalanalytics',
+            name='ip_address',
+        ),
+        migrations.RemoveField(
+            model_name='portalanalytics',
+            name='user_agent',
+        ),
+    ]
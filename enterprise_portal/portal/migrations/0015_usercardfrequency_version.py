@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0014_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usercardfrequency',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0015_usercardfrequency_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cardvisitorsketch',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
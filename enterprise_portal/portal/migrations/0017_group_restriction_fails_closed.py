@@ -0,0 +1,53 @@
+# Generated by Django 3.2.25 on 2026-10-19 17:10
+
+from django.db import migrations, models
+
+
+def restrict_items_with_groups(apps, schema_editor):
+    """Items that have groups today are the restricted ones"""
+    db = schema_editor.connection.alias
+    for model_name in ('FactoryButton', 'PortalSection', 'SystemCard'):
+        model = apps.get_model('portal', model_name)
+        model.objects.using(db).filter(groups__isnull=False).update(restricted=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('portal', '0016_cardvisitorsketch_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='factorybutton',
+            name='restricted',
+            field=models.BooleanField(default=False, help_text='Only members of its groups (and staff) see it; with no groups left, for instance after its group was deleted, only staff do. Untick to show it to everyone again'),
+        ),
+        migrations.AddField(
+            model_name='portalsection',
+            name='restricted',
+            field=models.BooleanField(default=False, help_text='Only members of its groups (and staff) see it; with no groups left, for instance after its group was deleted, only staff do. Untick to show it to everyone again'),
+        ),
+        migrations.AddField(
+            model_name='systemcard',
+            name='restricted',
+            field=models.BooleanField(default=False, help_text='Only members of its groups (and staff) see it; with no groups left, for instance after its group was deleted, only staff do. Untick to show it to everyone again'),
+        ),
+        migrations.AlterField(
+            model_name='factorybutton',
+            name='groups',
+            field=models.ManyToManyField(blank=True, help_text='Who sees it while it is restricted (adding a group restricts it)', related_name='portal_factories', to='auth.Group'),
+        ),
+        migrations.AlterField(
+            model_name='portalsection',
+            name='groups',
+            field=models.ManyToManyField(blank=True, help_text='Who sees it while it is restricted (adding a group restricts it)', related_name='portal_sections', to='auth.Group'),
+        ),
+        migrations.AlterField(
+            model_name='systemcard',
+            name='groups',
+            field=models.ManyToManyField(blank=True, help_text='Who sees it while it is restricted (adding a group restricts it)', related_name='portal_cards', to='auth.Group'),
+        ),
+        migrations.RunPython(restrict_items_with_groups, migrations.RunPython.noop),
+    ]
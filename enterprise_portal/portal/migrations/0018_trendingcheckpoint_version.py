@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 17:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0017_group_restriction_fails_closed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trendingcheckpoint',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
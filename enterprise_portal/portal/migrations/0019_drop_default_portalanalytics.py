@@ -0,0 +1,56 @@
+# Generated by Django 3.2.25 on 2026-10-19 17:40
+
+import warnings
+
+from django.conf import settings
+from django.db import connections, migrations
+
+
+TABLE = 'portal_portalanalytics'
+
+
+def analytics_db():
+    # As portal.routers.analytics_db() was when this migration was written
+    return 'analytics' if 'analytics' in settings.DATABASES else 'default'
+
+
+def drop_copied_clicks(apps, schema_editor):
+    """
+    Drop from the default database the clicks 0006 copied out of it.
+
+    The router keeps the model out of default, so the old table was left
+    there: a stale duplicate of every click recorded before the split that
+    nothing reads. Like 0006 this runs with `migrate --database=analytics`,
+    after the copy, and drops the table only when the analytics database
+    holds at least as many rows over the same id range; otherwise it is kept
+    and a warning says so.
+    """
+    target = schema_editor.connection
+    source = connections['default']
+    if target.alias == 'default' or TABLE not in source.introspection.table_names():
+        return
+    with source.cursor() as cursor:
+        cursor.execute(f'SELECT COUNT(*), MIN(id), MAX(id) FROM {TABLE}')
+        count, first, last = cursor.fetchone()
+    if count:
+        with target.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {TABLE} WHERE id BETWEEN %s AND %s', [first, last])
+            copied = cursor.fetchone()[0]
+        if copied < count:
+            warnings.warn(f'{TABLE} in the default database has {count} clicks but only {copied} of them are in '
+                          f'the analytics database; keeping it. Copy the missing rows, then drop it by hand.')
+            return
+    with source.schema_editor() as editor:
+        editor.execute(editor.sql_delete_table % {'table': editor.quote_name(TABLE)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0018_trendingcheckpoint_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_copied_clicks, migrations.RunPython.noop,
+                             hints={'target_db': analytics_db()}),
+    ]
@@ -0,0 +1,381 @@
+"""
+Cache backend on a memory-mapped file, shared by every worker on the host.
+
+The file-based cache pays an open, read and unpickle per get and culls by
+listing its directory, and locmem is private to each worker. This backend
+maps one file into every worker process and keeps a fixed-size hash table
+in it, so a get is a hash, a lock and a slice of shared memory.
+
+Layout: a small header, then MAX_ENTRIES slots of SLOT_SIZE bytes grouped
+into buckets of WAYS slots. A key hashes (blake2b, 128 bits) to one bucket
+and may live in any of its slots. A set takes the key's own slot, else a
+free or expired one, else evicts the least recently used slot of the
+bucket, so the table never grows and never needs culling. Each slot holds
+the key hash, expiry, last access time and the encoded value:
+
+    ints, floats, str, bytes, None and booleans are stored as raw bytes with
+    a one-byte type tag, anything else is pickled; payloads above
+    COMPRESS_MIN bytes are zlib-compressed when that saves space.
+
+A value that does not fit a slot is not cached (the key is dropped).
+
+Buckets are guarded by lock stripes: a threading lock for the threads of
+one worker plus a POSIX record lock (fcntl.lockf) on one byte of the
+header for the other workers. Each process maps the file once per location
+and shares it between threads, and never closes it, since closing any
+descriptor of a file drops the process' record locks on it.
+
+    CACHES = {'default': {
+        'BACKEND': 'portal.mmapcache.MmapCache',
+        'LOCATION': '/var/cache/portal/default.mmap',
+        'OPTIONS': {'MAX_ENTRIES': 5000, 'SLOT_SIZE': 2048},
+    }}
+
+The file is created (sparse) on first use and rebuilt empty when its
+geometry no longer matches the settings. POSIX only.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+MAGIC = b'PCMM0001'
+# magic, slots, slot size, ways
+HEADER = struct.Struct('<8sIII')
+# Lock stripes are record locks on single bytes of this page, which is
+# otherwise unused
+LOCK_PAGE = 4096
+LOCK_STRIPES = 256
+# key hash, expires (0: never), last access, tag, payload length
+SLOT = struct.Struct('<16sddBI')
+
+EMPTY, PICKLE, BYTES, STR, INT, FLOAT, NONE, TRUE, FALSE = range(9)
+COMPRESSED = 0x80
+
+INT64 = struct.Struct('<q')
+FLOAT64 = struct.Struct('<d')
+
+
+def encode(value, compress_min):
+    """(tag, payload) of a value"""
+    kind = type(value)
+    if kind is bytes:
+        tag, payload = BYTES, value
+    elif kind is str:
+        tag, payload = STR, value.encode()
+    elif kind is int and -2 ** 63 <= value < 2 ** 63:
+        return INT, INT64.pack(value)
+    elif kind is float:
+        return FLOAT, FLOAT64.pack(value)
+    elif value is None:
+        return NONE, b''
+    elif value is True:
+        return TRUE, b''
+    elif value is False:
+        return FALSE, b''
+    else:
+        tag, payload = PICKLE, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    if len(payload) > compress_min:
+        packed = zlib.compress(payload, 1)
+        if len(packed) < len(payload) * 0.9:
+            return tag | COMPRESSED, packed
+    return tag, payload
+
+
+def decode(tag, payload):
+    if tag & COMPRESSED:
+        tag, payload = tag & ~COMPRESSED, zlib.decompress(payload)
+    if tag == INT:
+        return INT64.unpack(payload)[0]
+    if tag == STR:
+        return payload.decode()
+    if tag == BYTES:
+        return payload
+    if tag == FLOAT:
+        return FLOAT64.unpack(payload)[0]
+    if tag == NONE:
+        return None
+    if tag in (TRUE, FALSE):
+        return tag == TRUE
+    return pickle.loads(payload)
+
+
+class Table:
+    """The mapped hash table of one cache file, shared by the threads of a process"""
+
+    def __init__(self, path, slots, slot_size, ways):
+        self.path = path
+        self.ways = ways
+        self.buckets = max(1, -(-slots // ways))
+        self.slots = self.buckets * ways
+        self.slot_size = slot_size
+        self.capacity = slot_size - SLOT.size
+        self.data_offset = LOCK_PAGE
+        self.thread_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self.pid = os.getpid()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = self.data_offset + self.slots * slot_size
+        header = HEADER.pack(MAGIC, self.slots, slot_size, ways)
+        # The whole lock page: no worker touches a stripe while the file is (re)initialised
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, LOCK_PAGE, 0)
+        try:
+            fresh = os.fstat(self.fd).st_size != size
+            if fresh:
+                # New file, or another geometry: start over with an empty, sparse one
+                os.ftruncate(self.fd, 0)
+                os.ftruncate(self.fd, size)
+            self.map = mmap.mmap(self.fd, size)
+            if os.pread(self.fd, HEADER.size, 0) != header:
+                if not fresh:
+                    self.clear()
+                os.pwrite(self.fd, header, 0)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, LOCK_PAGE, 0)
+
+    def bucket(self, key_hash):
+        return int.from_bytes(key_hash[:8], 'little') % self.buckets
+
+    def lock(self, bucket):
+        return _StripeLock(self, bucket % LOCK_STRIPES)
+
+    def lock_all(self):
+        return _StripeLock(self, None)
+
+    def offsets(self, bucket):
+        start = self.data_offset + bucket * self.ways * self.slot_size
+        return range(start, start + self.ways * self.slot_size, self.slot_size)
+
+    def find(self, key_hash, bucket):
+        """(offset, header) of the key's slot in its bucket, or (None, None)"""
+        for offset in self.offsets(bucket):
+            header = SLOT.unpack_from(self.map, offset)
+            if header[3] != EMPTY and header[0] == key_hash:
+                return offset, header
+        return None, None
+
+    def victim(self, key_hash, bucket, now):
+        """Slot to write the key to: its own, a free or expired one, else the least recently used"""
+        oldest, oldest_access = None, None
+        for offset in self.offsets(bucket):
+            stored_hash, expires, accessed, tag, _ = SLOT.unpack_from(self.map, offset)
+            if tag == EMPTY or stored_hash == key_hash or (expires and expires <= now):
+                return offset
+            if oldest is None or accessed < oldest_access:
+                oldest, oldest_access = offset, accessed
+        return oldest
+
+    def read(self, offset, header):
+        _, _, _, tag, length = header
+        start = offset + SLOT.size
+        return decode(tag, self.map[start:start + length])
+
+    def write(self, offset, key_hash, expires, now, tag, payload):
+        start = offset + SLOT.size
+        self.map[start:start + len(payload)] = payload
+        SLOT.pack_into(self.map, offset, key_hash, expires, now, tag, len(payload))
+
+    def touch(self, offset, now, expires=None):
+        key_hash, old_expires, _, tag, length = SLOT.unpack_from(self.map, offset)
+        SLOT.pack_into(self.map, offset, key_hash, old_expires if expires is None else expires, now, tag, length)
+
+    def clear_slot(self, offset):
+        SLOT.pack_into(self.map, offset, bytes(16), 0, 0, EMPTY, 0)
+
+    def clear(self):
+        for offset in range(self.data_offset, self.data_offset + self.slots * self.slot_size, self.slot_size):
+            self.clear_slot(offset)
+
+
+class _StripeLock:
+    """Thread lock plus record lock of one stripe (or of all of them)"""
+    __slots__ = ('table', 'stripe')
+
+    def __init__(self, table, stripe):
+        self.table = table
+        self.stripe = stripe
+
+    def __enter__(self):
+        table = self.table
+        if self.stripe is None:
+            for lock in table.thread_locks:
+                lock.acquire()
+            fcntl.lockf(table.fd, fcntl.LOCK_EX, LOCK_STRIPES, 0)
+        else:
+            table.thread_locks[self.stripe].acquire()
+            fcntl.lockf(table.fd, fcntl.LOCK_EX, 1, self.stripe)
+
+    def __exit__(self, *exc_info):
+        table = self.table
+        if self.stripe is None:
+            fcntl.lockf(table.fd, fcntl.LOCK_UN, LOCK_STRIPES, 0)
+            for lock in reversed(table.thread_locks):
+                lock.release()
+        else:
+            fcntl.lockf(table.fd, fcntl.LOCK_UN, 1, self.stripe)
+            table.thread_locks[self.stripe].release()
+
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def table_for(path, slots, slot_size, ways):
+    """The process' mapping of a cache file; Django builds a backend per thread, they share it"""
+    key = (os.path.abspath(path), slots, slot_size, ways)
+    table = _tables.get(key)
+    if table is None or table.pid != os.getpid():
+        with _tables_lock:
+            table = _tables.get(key)
+            if table is None or table.pid != os.getpid():
+                # Forked workers inherit the mapping but need their own descriptor for record locks
+                table = _tables[key] = Table(key[0], slots, slot_size, ways)
+    return table
+
+
+class MmapCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = location
+        self._slot_size = int(options.get('SLOT_SIZE', 2048))
+        self._ways = int(options.get('WAYS', 8))
+        self._compress_min = int(options.get('COMPRESS_MIN', 512))
+        self._table = None
+
+    @property
+    def table(self):
+        table = self._table
+        if table is None or table.pid != os.getpid():
+            table = self._table = table_for(self._path, self._max_entries, self._slot_size, self._ways)
+        return table
+
+    def _key_hash(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return hashlib.blake2b(key.encode(), digest_size=16).digest()
+
+    def _expiry(self, timeout):
+        expires = self.get_backend_timeout(timeout)
+        # None: never expires; 0 in a slot means the same
+        return 0 if expires is None else expires
+
+    def _store(self, key, value, timeout, version, only_new):
+        key_hash = self._key_hash(key, version)
+        tag, payload = encode(value, self._compress_min)
+        table = self.table
+        bucket = table.bucket(key_hash)
+        now = time.time()
+        with table.lock(bucket):
+            offset, header = table.find(key_hash, bucket)
+            if only_new and offset is not None and not (header[1] and header[1] <= now):
+                return False
+            if len(payload) > table.capacity:
+                # Too large to cache; the old value must not outlive the new one
+                if offset is not None:
+                    table.clear_slot(offset)
+                return False
+            if offset is None:
+                offset = table.victim(key_hash, bucket, now)
+            table.write(offset, key_hash, self._expiry(timeout), now, tag, payload)
+        return True
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._store(key, value, timeout, version, only_new=True)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store(key, value, timeout, version, only_new=False)
+
+    def get(self, key, default=None, version=None):
+        key_hash = self._key_hash(key, version)
+        table = self.table
+        bucket = table.bucket(key_hash)
+        now = time.time()
+        with table.lock(bucket):
+            offset, header = table.find(key_hash, bucket)
+            if offset is None:
+                return default
+            if header[1] and header[1] <= now:
+                table.clear_slot(offset)
+                return default
+            table.touch(offset, now)
+            tag, length = header[3], header[4]
+            start = offset + SLOT.size
+            payload = table.map[start:start + length]
+        # Decoding (and unpickling) happens outside the lock
+        return decode(tag, payload)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key_hash = self._key_hash(key, version)
+        table = self.table
+        bucket = table.bucket(key_hash)
+        now = time.time()
+        with table.lock(bucket):
+            offset, header = table.find(key_hash, bucket)
+            if offset is None or (header[1] and header[1] <= now):
+                return False
+            table.touch(offset, now, self._expiry(timeout))
+        return True
+
+    def delete(self, key, version=None):
+        key_hash = self._key_hash(key, version)
+        table = self.table
+        bucket = table.bucket(key_hash)
+        with table.lock(bucket):
+            offset, header = table.find(key_hash, bucket)
+            if offset is None:
+                return False
+            table.clear_slot(offset)
+        return not (header[1] and header[1] <= time.time())
+
+    def has_key(self, key, version=None):
+        key_hash = self._key_hash(key, version)
+        table = self.table
+        bucket = table.bucket(key_hash)
+        with table.lock(bucket):
+            offset, header = table.find(key_hash, bucket)
+        return offset is not None and not (header[1] and header[1] <= time.time())
+
+    def incr(self, key, delta=1, version=None):
+        """Atomic across workers, unlike BaseCache.incr"""
+        key_hash = self._key_hash(key, version)
+        table = self.table
+        bucket = table.bucket(key_hash)
+        now = time.time()
+        with table.lock(bucket):
+            offset, header = table.find(key_hash, bucket)
+            if offset is None or (header[1] and header[1] <= now):
+                raise ValueError(f"Key '{key}' not found")
+            value = table.read(offset, header) + delta
+            tag, payload = encode(value, self._compress_min)
+            table.write(offset, key_hash, header[1], now, tag, payload)
+        return value
+
+    def clear(self):
+        table = self.table
+        with table.lock_all():
+            table.clear()
+
+    def stats(self):
+        """{'slots', 'used', 'expired', 'bytes'} of the table, for benchmarks and health checks"""
+        table = self.table
+        now = time.time()
+        used = expired = size = 0
+        for offset in range(table.data_offset, table.data_offset + table.slots * table.slot_size, table.slot_size):
+            _, expires, _, tag, length = SLOT.unpack_from(table.map, offset)
+            if tag != EMPTY:
+                used += 1
+                expired += bool(expires and expires <= now)
+                size += length
+        return {'slots': table.slots, 'used': used, 'expired': expired, 'bytes': size}
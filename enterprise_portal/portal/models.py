@@ -1,9 +1,16 @@
 from django.db import models
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Group, User
 from django.core.validators import URLValidator
+from django.utils import timezone
+import ipaddress
 import json
 
 
+# Group restrictions fail closed: removing groups (or deleting a group) never opens an item up
+RESTRICTED_HELP = ('Only members of its groups (and staff) see it; with no groups left, for instance after '
+                   'its group was deleted, only staff do. Untick to show it to everyone again')
+
+
 class FactoryButton(models.Model):
     """Factory buttons in the middle section"""
     name = models.CharField(max_length=50)
@@ -30,6 +37,9 @@ class FactoryButton(models.Model):
         ],
         default='public'
     )
+    groups = models.ManyToManyField(Group, blank=True, related_name='portal_factories',
+                                    help_text='Who sees it while it is restricted (adding a group restricts it)')
+    restricted = models.BooleanField(default=False, help_text=RESTRICTED_HELP)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     updated_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
@@ -58,6 +68,9 @@ class PortalSection(models.Model):
     color = models.CharField(max_length=7, default='#6366f1')  # Hex color
     order = models.IntegerField(default=0)
     is_active = models.BooleanField(default=True)
+    groups = models.ManyToManyField(Group, blank=True, related_name='portal_sections',
+                                    help_text='Who sees it while it is restricted (adding a group restricts it)')
+    restricted = models.BooleanField(default=False, help_text=RESTRICTED_HELP)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     updated_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
@@ -105,6 +118,9 @@ class SystemCard(models.Model):
         ],
         default='public'
     )
+    groups = models.ManyToManyField(Group, blank=True, related_name='portal_cards',
+                                    help_text='Who sees it while it is restricted (adding a group restricts it)')
+    restricted = models.BooleanField(default=False, help_text=RESTRICTED_HELP)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     updated_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
@@ -149,16 +165,161 @@ class PortalSettings(models.Model):
         return settings
 
 
+class UserAgent(models.Model):
+    """Interned user agent string, parsed once (analytics database, see portal.agents)"""
+    DEVICE_CHOICES = [
+        ('desktop', 'Desktop'),
+        ('mobile', 'Mobile'),
+        ('tablet', 'Tablet'),
+        ('bot', 'Bot'),
+        ('other', 'Other'),
+    ]
+
+    digest = models.CharField(max_length=40, unique=True)  # sha1 of the string
+    string = models.TextField()
+    browser = models.CharField(max_length=50, blank=True)
+    browser_version = models.CharField(max_length=20, blank=True)
+    os = models.CharField(max_length=50, blank=True)
+    device = models.CharField(max_length=10, choices=DEVICE_CHOICES, default='other')
+
+    def __str__(self):
+        return f"{self.browser or 'Unknown'} {self.browser_version} / {self.os or 'Unknown'} ({self.device})"
+
+
 class PortalAnalytics(models.Model):
-    """Track portal usage analytics"""
-    card = models.ForeignKey(SystemCard, on_delete=models.CASCADE, related_name='analytics')
-    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
-    ip_address = models.GenericIPAddressField()
-    user_agent = models.TextField()
+    """Track portal usage analytics (stored in the analytics database, see portal.routers)"""
+    # Cards and users live in the default database, so these relations carry no
+    # db constraint; cascades are applied by the handlers in portal.signals.
+    card = models.ForeignKey(SystemCard, on_delete=models.DO_NOTHING, related_name='analytics',
+                             db_constraint=False)
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, null=True, blank=True,
+                             db_constraint=False)
+    ip = models.BinaryField(max_length=16, default=b'')  # packed, see portal.agents
+    agent = models.ForeignKey(UserAgent, on_delete=models.PROTECT, null=True, blank=True, related_name='clicks')
     clicked_at = models.DateTimeField(auto_now_add=True)
+    weight = models.PositiveIntegerField(default=1)  # clicks this row stands for (see portal.ingest)
 
     class Meta:
         ordering = ['-clicked_at']
 
     def __str__(self):
-        return f"{self.card.name} - {self.clicked_at}"
\ No newline at end of file
+        return f"{self.card.name} - {self.clicked_at}"
+
+    @property
+    def ip_address(self):
+        return str(ipaddress.ip_address(bytes(self.ip))) if self.ip else ''
+
+
+class UserCardFrequency(models.Model):
+    """Decayed per-card click counts of one user (analytics database, see portal.frequency)"""
+    user = models.OneToOneField(User, on_delete=models.DO_NOTHING, related_name='card_frequency',
+                                db_constraint=False)
+    epoch = models.FloatField()  # unix time the stored weights are relative to
+    weights = models.TextField(default='{}')  # JSON {card_id: weight}
+    version = models.PositiveIntegerField(default=0)  # compare-and-swap stamp of concurrent writers
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user_id} - card frequency"
+
+
+class TrendingCheckpoint(models.Model):
+    """Last checkpoint of the live top-K summaries of one scope/window (see portal.trending)"""
+    scope = models.CharField(max_length=50)  # 'global', 'home' or 'factory:<id>'
+    window = models.CharField(max_length=10)
+    state = models.TextField(default='{}')  # JSON {bucket_start: {card_id: [count, error]}}
+    version = models.PositiveIntegerField(default=0)  # compare-and-swap stamp of concurrent writers
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('scope', 'window')
+
+    def __str__(self):
+        return f"{self.scope} - {self.window}"
+
+
+class CardVisitorSketch(models.Model):
+    """HyperLogLog sketch of one card's distinct visitors on one day (see portal.sketches)"""
+    card = models.ForeignKey(SystemCard, on_delete=models.DO_NOTHING, related_name='visitor_sketches',
+                             db_constraint=False)
+    day = models.DateField()
+    sketch = models.BinaryField(default=b'')  # zlib-compressed registers
+    version = models.PositiveIntegerField(default=0)  # compare-and-swap stamp of concurrent writers
+
+    class Meta:
+        unique_together = ('card', 'day')
+
+    def __str__(self):
+        return f"{self.card_id} - {self.day}"
+
+
+class ContentChange(models.Model):
+    """One create/update/delete of a catalogue or settings row (see portal.journal)"""
+    ACTION_CHOICES = [
+        ('create', 'Create'),
+        ('update', 'Update'),
+        ('delete', 'Delete'),
+    ]
+
+    seq = models.BigAutoField(primary_key=True)  # the feed cursor
+    kind = models.CharField(max_length=10)  # 'factory', 'section', 'card' or 'settings'
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    changed_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        ordering = ['seq']
+        indexes = [models.Index(fields=['kind', 'object_id'])]
+
+    def __str__(self):
+        return f"{self.seq} {self.action} {self.kind} {self.object_id}"
+
+
+class ContentChangeCompaction(models.Model):
+    """One compaction run of the change journal; cursors below `floor` must resync"""
+    floor = models.BigIntegerField(default=0)
+    collapsed = models.IntegerField(default=0)
+    pruned = models.IntegerField(default=0)
+    ran_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-ran_at']
+
+    def __str__(self):
+        return f"{self.ran_at} - floor {self.floor}"
+
+
+class Job(models.Model):
+    """Deferred or periodic piece of work, run by manage.py run_jobs (see portal.jobs)"""
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)  # registered with @portal.jobs.job
+    args = models.JSONField(default=dict, blank=True)  # keyword arguments
+    # At most one queued job per non-empty key: enqueueing it again is a no-op
+    key = models.CharField(max_length=100, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    last_error = models.TextField(blank=True)
+    claimed_by = models.CharField(max_length=100, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['run_at', 'id']
+        indexes = [models.Index(fields=['status', 'run_at'])]
+        constraints = [
+            models.UniqueConstraint(fields=['key'], condition=models.Q(status='queued') & ~models.Q(key=''),
+                                    name='portal_job_one_queued_per_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
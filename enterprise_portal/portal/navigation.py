@@ -0,0 +1,284 @@
+"""
+Compiled navigation snapshot shared by the public portal views.
+
+Rendering the portal only needs names, icons, colours and urls, yet the
+models carry every translation column, timestamps and an updated_by relation.
+The snapshot compiles the catalogue once into small immutable ``__slots__``
+objects, pre-translated for every language in LANGUAGES and pre-filtered for
+every access tier, so portal_home, factory and the header render without any
+ORM work.
+
+Group-restricted items (the ``groups`` of factories, sections and cards) are
+resolved per *group set*: each distinct set of restricting groups a user can
+belong to maps to its own pre-filtered view, so a request only needs the
+user's cached group ids (portal.visibility) and a dict lookup. An item that
+is ``restricted`` but has no groups left (its group was deleted) is shown to
+staff only.
+
+Each worker keeps one snapshot. Content changes bump a version stamp in the
+shared cache (see portal.signals); the next request notices the new stamp,
+compiles a fresh snapshot and swaps the module reference in one assignment,
+so concurrent requests always see either the old or the new snapshot whole.
+"""
+import logging
+import sys
+import threading
+import time
+
+from django.conf import settings as django_settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from .fragments import section_versions
+from .models import FactoryButton, PortalSection, PortalSettings, SystemCard
+from .utils import ACCESS_TIERS, translated
+
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'portal:content-version'
+
+
+class CardView:
+    __slots__ = ('id', 'url', 'icon', 'icon_color', 'status', 'is_external', 'access_level',
+                 'translated_name', 'translated_description', 'description', 'section_id', 'factory_id')
+
+    def __init__(self, card, lang, factory_id):
+        self.id = card.id
+        self.url = card.url
+        self.icon = card.icon
+        self.icon_color = card.icon_color
+        self.status = card.status
+        self.is_external = card.is_external
+        self.access_level = card.access_level
+        self.translated_name, self.translated_description = translated(card, lang)
+        # Templates only test the base description for truthiness
+        self.description = bool(card.description)
+        self.section_id = card.section_id
+        self.factory_id = factory_id
+
+
+class SectionView:
+    __slots__ = ('id', 'icon', 'color', 'is_active', 'translated_name', 'translated_description',
+                 'description', 'factory_id', 'filtered_cards', 'version')
+
+    def __init__(self, section, lang, cards, version):
+        self.id = section.id
+        self.icon = section.icon
+        self.color = section.color
+        self.is_active = section.is_active
+        self.translated_name, self.translated_description = translated(section, lang)
+        self.description = bool(section.description)
+        self.factory_id = section.factory_id
+        self.filtered_cards = cards
+        # Fragment cache stamp, see portal.fragments
+        self.version = version
+
+
+class FactoryView:
+    __slots__ = ('id', 'url', 'icon', 'background_color', 'text_color', 'access_level', 'is_active',
+                 'translated_name', 'translated_description')
+
+    def __init__(self, factory, lang):
+        self.id = factory.id
+        self.url = factory.url
+        self.icon = factory.icon
+        self.background_color = factory.background_color
+        self.text_color = factory.text_color
+        self.access_level = factory.access_level
+        self.is_active = factory.is_active
+        self.translated_name, self.translated_description = translated(factory, lang)
+
+    @property
+    def pk(self):
+        return self.id
+
+
+class TierView:
+    """What one access tier sees in one language"""
+    __slots__ = ('factories', 'home_sections', 'factory_sections', 'cards_by_id')
+
+    def __init__(self, factories, home_sections, factory_sections, cards_by_id):
+        self.factories = factories
+        self.home_sections = home_sections
+        self.factory_sections = factory_sections
+        self.cards_by_id = cards_by_id
+
+    def sections_for(self, factory_id):
+        return self.factory_sections.get(factory_id, ())
+
+
+def group_restrictions():
+    """{(kind, id): frozenset of group ids} for every group-restricted factory, section and card"""
+    restrictions = {}
+    for kind, model, column in (('factory', FactoryButton, 'factorybutton_id'),
+                                ('section', PortalSection, 'portalsection_id'),
+                                ('card', SystemCard, 'systemcard_id')):
+        for item_id in model.objects.filter(restricted=True).values_list('id', flat=True):
+            restrictions[(kind, item_id)] = set()
+        for item_id, group_id in model.groups.through.objects.values_list(column, 'group_id'):
+            restrictions.setdefault((kind, item_id), set()).add(group_id)
+    return {key: frozenset(groups) for key, groups in restrictions.items()}
+
+
+class Snapshot:
+    __slots__ = ('version', 'settings', 'factories_by_id', 'views', 'cards', 'groups', 'built_at', 'build_seconds',
+                 '_factories', '_sections', '_section_factory', '_section_versions', '_card_views', '_restrictions',
+                 '_group_views')
+
+    def __init__(self, version):
+        started = time.perf_counter()
+        self.version = version
+        # Stamps first: a fragment may then be stored under an older stamp than its data, never a newer one
+        self._section_versions = section_versions(PortalSection.objects.values_list('id', flat=True))
+        self.settings = PortalSettings.get_settings()
+
+        self._factories = list(FactoryButton.objects.all())
+        self._sections = list(PortalSection.objects.filter(is_active=True))
+        cards = list(SystemCard.objects.filter(is_active=True))
+        self._section_factory = {section.id: section.factory_id for section in self._sections}
+
+        self._restrictions = group_restrictions()
+        # Only groups that restrict something matter when keying views by a user's groups
+        self.groups = frozenset().union(*self._restrictions.values())
+        self._group_views = {}
+
+        self.factories_by_id = {}
+        self._card_views = {}
+        self.views = {}
+        self.cards = {}
+        for lang, _ in django_settings.LANGUAGES:
+            self.factories_by_id[lang] = {factory.id: FactoryView(factory, lang) for factory in self._factories}
+            # Card views are shared by every tier and group set of the same language
+            self._card_views[lang] = [CardView(card, lang, self._section_factory[card.section_id])
+                                      for card in cards if card.section_id in self._section_factory]
+            if lang == django_settings.LANGUAGE_CODE:
+                self.cards = {card.id: card for card in self._card_views[lang]}
+            for tier in ACCESS_TIERS:
+                self.views[(lang, tier)] = self._build(lang, tier, frozenset())
+
+        # Precompute the group sets members already have; new combinations are built on first use
+        memberships = {}
+        for user_id, group_id in User.groups.through.objects.filter(group_id__in=self.groups).values_list(
+                'user_id', 'group_id'):
+            memberships.setdefault(user_id, set()).add(group_id)
+        for groups in {frozenset(groups) for groups in memberships.values()}:
+            for lang, _ in django_settings.LANGUAGES:
+                self.view(lang, 'authenticated', groups)
+
+        self.built_at = time.time()
+        self.build_seconds = time.perf_counter() - started
+
+    def _build(self, lang, tier, groups):
+        levels = ACCESS_TIERS[tier]
+        everything = tier == 'staff'
+
+        def allowed(kind, item_id):
+            restricted = self._restrictions.get((kind, item_id))
+            return everything or restricted is None or not restricted.isdisjoint(groups)
+
+        # Group restrictions cascade: a card also needs its section and factory to be allowed
+        sections = [section for section in self._sections
+                    if allowed('section', section.id)
+                    and (section.factory_id is None or allowed('factory', section.factory_id))]
+        section_ids = {section.id for section in sections}
+        visible_cards = [card for card in self._card_views[lang]
+                         if card.access_level in levels and card.section_id in section_ids
+                         and allowed('card', card.id)]
+        by_section = {}
+        for card in visible_cards:
+            by_section.setdefault(card.section_id, []).append(card)
+
+        home_sections, factory_sections = [], {}
+        for section in sections:
+            view = SectionView(section, lang, tuple(by_section.get(section.id, ())),
+                               self._section_versions.get(section.id, 0))
+            if section.factory_id is None:
+                home_sections.append(view)
+            else:
+                factory_sections.setdefault(section.factory_id, []).append(view)
+
+        factory_views = self.factories_by_id[lang]
+        return TierView(
+            factories=tuple(factory_views[factory.id] for factory in self._factories
+                            if factory.is_active and factory.access_level in levels
+                            and allowed('factory', factory.id)),
+            home_sections=tuple(home_sections),
+            factory_sections={key: tuple(value) for key, value in factory_sections.items()},
+            cards_by_id={card.id: card for card in visible_cards},
+        )
+
+    def view(self, lang, tier, groups=frozenset()):
+        """What a user of the access tier and the given group ids sees"""
+        if (lang, tier) not in self.views:
+            lang = django_settings.LANGUAGE_CODE
+        groups = self.groups.intersection(groups)
+        if not groups or tier == 'staff':
+            return self.views[(lang, tier)]
+        key = (lang, tier, groups)
+        view = self._group_views.get(key)
+        if view is None:
+            # Racing threads may both build it; either result is correct
+            view = self._group_views[key] = self._build(lang, tier, groups)
+        return view
+
+    def factory(self, lang, factory_id):
+        factories = self.factories_by_id.get(lang) or self.factories_by_id[django_settings.LANGUAGE_CODE]
+        return factories.get(factory_id)
+
+    def card(self, card_id):
+        """Any active card regardless of access level, in the default language"""
+        return self.cards.get(card_id)
+
+    def footprint(self):
+        """(objects, bytes) reachable from the compiled views, settings excluded"""
+        seen, stack, total = set(), [self.views, self._group_views, self.factories_by_id], 0
+        while stack:
+            obj = stack.pop()
+            if id(obj) in seen or obj is None or isinstance(obj, (bool, int, float)):
+                continue
+            seen.add(id(obj))
+            total += sys.getsizeof(obj)
+            if isinstance(obj, dict):
+                stack.extend(obj.keys())
+                stack.extend(obj.values())
+            elif isinstance(obj, (list, tuple)):
+                stack.extend(obj)
+            elif hasattr(obj, '__slots__'):
+                stack.extend(getattr(obj, slot) for slot in obj.__slots__)
+        return len(seen), total
+
+
+_snapshot = None
+_lock = threading.Lock()
+
+
+def content_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = time.time_ns()
+        cache.add(VERSION_KEY, version, None)
+        version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def bump_version():
+    """Mark the catalogue as changed so every worker recompiles its snapshot"""
+    cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+def current():
+    """The snapshot for the current content version, compiling it if needed"""
+    global _snapshot
+    version = content_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    with _lock:
+        if _snapshot is None or _snapshot.version != version:
+            snapshot = Snapshot(version)
+            objects, size = snapshot.footprint()
+            logger.info('Compiled navigation snapshot %s in %.1f ms: %d objects, %.1f KiB',
+                        version, snapshot.build_seconds * 1000, objects, size / 1024)
+            _snapshot = snapshot
+        return _snapshot
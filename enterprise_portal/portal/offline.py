@@ -0,0 +1,65 @@
+"""
+Offline shell for the public portal.
+
+The portal registers a service worker (portal/service_worker.js, served at
+/sw.js so it controls the whole site) that precaches everything a visitor
+needs to open the portal without a network: the home page and every factory
+page they can see, already translated and filtered for them, the logo,
+favicon and background image, and the CSS/JS bundles of the public
+templates. Visits are then answered from the cache at once while the worker
+checks /api/version/ in the background. A 503 from it means maintenance
+mode: the worker drops its cached pages and goes to the network, so the
+maintenance page is not hidden behind the cache.
+
+The precache manifest is generated here for each visitor and inlined into
+the worker script, together with a version hashed from the manifest, the
+content version, the language and the user. Browsers re-fetch the worker on
+navigation and install it again only when its bytes change, so the cache is
+refreshed exactly when the content version (or the visitor's view of it)
+changes. Signing in or out and switching language drop the cached pages
+(see the worker), since those pages belong to the previous session.
+"""
+import hashlib
+import json
+
+from django.urls import reverse
+from django.utils.translation import get_language
+
+from .icons import stylesheet_url
+from .navigation import content_version, current
+from .utils import access_tier
+from .visibility import user_group_ids
+
+
+# CSS/JS bundles of the public templates (base/base.html, portal/home.html,
+# portal/factory.html); keep in step with them. The icon stylesheet is added
+# per manifest, see portal.icons
+SHELL_ASSETS = (
+    'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
+    'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js',
+    'https://cdn.tailwindcss.com',
+)
+
+# Same-origin paths the worker never caches
+NETWORK_ONLY = ('/admin/', '/api/', '/edit/', '/login/', '/logout/', '/i18n/')
+
+# Requests under these paths mean a new session or language: cached pages are dropped
+SESSION_PATHS = ('/login/', '/logout/', '/i18n/')
+
+
+def precache_manifest(request):
+    """{'version', 'content_version', 'pages', 'assets'} of the offline shell for this request's user"""
+    navigation = current()
+    view = navigation.view(get_language(), access_tier(request.user), user_group_ids(request.user))
+    settings = navigation.settings
+
+    pages = [reverse('home')] + [f"{reverse('factory')}?id={factory.id}" for factory in view.factories]
+    media = [image.url for image in (settings.logo, settings.favicon, settings.background_image) if image]
+    manifest = {
+        'content_version': str(content_version()),
+        'pages': pages,
+        'assets': list(SHELL_ASSETS) + [stylesheet_url()] + media,
+    }
+    stamp = json.dumps([manifest, get_language(), request.user.pk], sort_keys=True)
+    manifest['version'] = hashlib.sha1(stamp.encode()).hexdigest()[:16]
+    return manifest
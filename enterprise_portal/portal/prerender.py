@@ -0,0 +1,186 @@
+"""
+Static pre-rendering of the public portal for edge serving.
+
+For every language in LANGUAGES the anonymous home page and each factory page
+visible to anonymous users are rendered to
+
+    <PRERENDER_ROOT>/<lang>/home/index.html
+    <PRERENDER_ROOT>/<lang>/factory/<id>.html
+
+next to .gz (and .br when the brotli package is installed) variants. A front
+proxy can then answer anonymous requests (no session cookie) for /home/ and
+/factory/?id=<id> from these files, picking <lang> from the django_language
+cookie, with gzip_static/brotli_static and no Python involved.
+
+Builds are incremental: manifest.json records a fingerprint of the rows and
+templates each page was rendered from, and only pages whose fingerprint
+changed are rendered again. Live strips (trending, frequently used) are left
+out of static pages.
+
+While maintenance mode is on, build() removes every page instead, so the
+proxy falls through to Django and MaintenanceMiddleware answers with its
+503 (and lets staff in). Saving the settings queues a build (see
+portal.tasks), and switching maintenance off changes the settings
+fingerprint, so the next build renders every page again.
+"""
+import gzip
+import hashlib
+import json
+import os
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.template import TemplateDoesNotExist, engines
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from django.urls import reverse
+from django.utils import translation
+
+from .models import FactoryButton, PortalSection, PortalSettings, SystemCard
+from .navigation import group_restrictions
+from .utils import template_engine
+from .views import factory_context, home_context
+
+try:
+    import brotli
+except ImportError:  # optional, gzip variants are always written
+    brotli = None
+
+
+MANIFEST = 'manifest.json'
+TEMPLATES = ['portal/home.html', 'portal/factory.html', 'portal/sections/home.html', 'portal/sections/factory.html',
+             'base/base.html', 'base/header.html', 'base/footer.html']
+
+
+def prerender_root():
+    return getattr(settings, 'PRERENDER_ROOT', os.path.join(settings.BASE_DIR, 'prerendered'))
+
+
+def _digest(*parts):
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+def _template_stamp():
+    stamps = []
+    for engine in engines.all():
+        for name in TEMPLATES:
+            try:
+                origin = engine.get_template(name).origin.name
+            except TemplateDoesNotExist:
+                continue
+            stamps.append((engine.name, name, os.path.getmtime(origin)))
+    return stamps
+
+
+def _fingerprints():
+    """{page key: fingerprint} of every page that should exist, language independent"""
+    common = (
+        list(PortalSettings.objects.values_list('id', 'updated_at')),
+        _template_stamp(),
+        # Group restrictions change no updated_at but hide items from anonymous visitors
+        sorted((kind, item_id) for kind, item_id in group_restrictions()),
+    )
+    factories = list(FactoryButton.objects.order_by('id').values_list(
+        'id', 'updated_at', 'is_active', 'access_level'))
+    sections = {}
+    for section_id, factory_id, updated_at in PortalSection.objects.order_by('id').values_list(
+            'id', 'factory_id', 'updated_at'):
+        sections.setdefault(factory_id, []).append((section_id, updated_at))
+    section_factory = {section_id: factory_id
+                       for factory_id, items in sections.items() for section_id, _ in items}
+    cards = {}
+    for card_id, section_id, updated_at in SystemCard.objects.order_by('id').values_list(
+            'id', 'section_id', 'updated_at'):
+        cards.setdefault(section_factory.get(section_id), []).append((card_id, updated_at))
+
+    pages = {'home': _digest(common, factories, sections.get(None), cards.get(None))}
+    for factory_id, updated_at, is_active, access_level in factories:
+        if is_active and access_level == 'public':
+            pages[f'factory/{factory_id}'] = _digest(
+                common, factory_id, updated_at, sections.get(factory_id), cards.get(factory_id))
+    return pages
+
+
+def _request(path):
+    request = RequestFactory().get(path)
+    request.user = AnonymousUser()
+    return request
+
+
+def _render(key):
+    if key == 'home':
+        request = _request(reverse('home'))
+        context = home_context(request)
+        template, view = 'portal/home.html', 'home'
+    else:
+        factory_id = int(key.split('/')[1])
+        request = _request(reverse('factory') + f'?id={factory_id}')
+        context = factory_context(request, factory_id)
+        template, view = 'portal/factory.html', 'factory'
+    context.update(trending_cards=[], frequent_cards=[], static_render=True)
+    return render_to_string(template, context, request, using=template_engine(view)).encode()
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    variants = [(path, content), (path + '.gz', gzip.compress(content, 9, mtime=0))]
+    if brotli is not None:
+        variants.append((path + '.br', brotli.compress(content)))
+    for target, data in variants:
+        tmp = target + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, target)  # atomic, the proxy never serves half a file
+
+
+def _remove(path):
+    for target in (path, path + '.gz', path + '.br'):
+        if os.path.exists(target):
+            os.remove(target)
+
+
+def _page_path(root, lang, key):
+    return os.path.join(root, lang, 'home', 'index.html') if key == 'home' \
+        else os.path.join(root, lang, key + '.html')
+
+
+def build(root=None, force=False):
+    """Render changed pages; returns {'rendered', 'unchanged', 'removed'} counts"""
+    root = root or prerender_root()
+    manifest_path = os.path.join(root, MANIFEST)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    stats = {'rendered': 0, 'unchanged': 0, 'removed': 0}
+    # A static page would bypass maintenance mode: serve none, the proxy falls through to Django
+    pages = {} if PortalSettings.get_settings().maintenance_mode else _fingerprints()
+    new_manifest = {}
+    for lang, _ in settings.LANGUAGES:
+        with translation.override(lang):
+            for key, fingerprint in pages.items():
+                manifest_key = f'{lang}/{key}'
+                path = _page_path(root, lang, key)
+                if not force and manifest.get(manifest_key) == fingerprint and os.path.exists(path):
+                    stats['unchanged'] += 1
+                else:
+                    _write(path, _render(key))
+                    stats['rendered'] += 1
+                new_manifest[manifest_key] = fingerprint
+
+    for manifest_key in set(manifest) - set(new_manifest):
+        lang, key = manifest_key.split('/', 1)
+        _remove(_page_path(root, lang, key))
+        stats['removed'] += 1
+
+    _write_manifest(manifest_path, new_manifest)
+    return stats
+
+
+def _write_manifest(path, manifest):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
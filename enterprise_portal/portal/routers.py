@@ -0,0 +1,43 @@
+from django.conf import settings
+
+
+ANALYTICS_DB = 'analytics'
+
+
+def analytics_db():
+    """Alias of the analytics database, falling back to default when it is not configured"""
+    return ANALYTICS_DB if ANALYTICS_DB in settings.DATABASES else 'default'
+
+
+class AnalyticsRouter:
+    """
+    Keep click analytics (and its rollup tables) in their own database so
+    ingestion never competes with content edits for the same write lock.
+    """
+    analytics_models = {
+        'portalanalytics', 'usercardfrequency', 'trendingcheckpoint', 'cardvisitorsketch', 'useragent',
+    }
+
+    def _is_analytics(self, model):
+        return model._meta.app_label == 'portal' and model._meta.model_name in self.analytics_models
+
+    def db_for_read(self, model, **hints):
+        # Always answer explicitly: otherwise Django falls back to the hinted
+        # instance's database and would look for SystemCard/User in analytics.
+        return analytics_db() if self._is_analytics(model) else 'default'
+
+    def db_for_write(self, model, **hints):
+        return analytics_db() if self._is_analytics(model) else 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Analytics rows reference cards and users by id only (no db constraint)
+        if self._is_analytics(obj1) or self._is_analytics(obj2):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if 'target_db' in hints:
+            return db == hints['target_db']
+        if app_label == 'portal' and model_name in self.analytics_models:
+            return db == analytics_db()
+        return db == 'default'
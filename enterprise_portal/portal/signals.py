@@ -0,0 +1,147 @@
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import fragments, icons, jobs, journal, tasks
+from .backends import user_cache_key
+from .models import (FactoryButton, PortalSection, SystemCard, PortalSettings, PortalAnalytics,
+                     UserCardFrequency, CardVisitorSketch)
+from .navigation import bump_version
+from .visibility import forget_user_groups
+
+
+@receiver(post_delete, sender=SystemCard)
+def delete_card_analytics(sender, instance, **kwargs):
+    """Cascade card deletes into the analytics database"""
+    PortalAnalytics.objects.filter(card_id=instance.pk).delete()
+    CardVisitorSketch.objects.filter(card_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=User)
+def detach_user_analytics(sender, instance, **kwargs):
+    """Keep clicks of deleted users, as SET_NULL did before analytics moved out"""
+    PortalAnalytics.objects.filter(user_id=instance.pk).update(user=None)
+    UserCardFrequency.objects.filter(user_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Drop the cached session user so staff/active changes apply immediately"""
+    cache.delete(user_cache_key(instance.pk))
+    forget_user_groups([instance.pk])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Drop the cached group ids of the users whose memberships changed"""
+    if not reverse:
+        # user.groups.add/remove/clear(...)
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            forget_user_groups([instance.pk])
+    elif action == 'pre_clear':
+        # group.user_set.clear(): remember who was in it
+        instance._cleared_user_ids = list(instance.user_set.values_list('id', flat=True))
+    elif action == 'post_clear':
+        forget_user_groups(getattr(instance, '_cleared_user_ids', ()))
+    elif action in ('post_add', 'post_remove'):
+        forget_user_groups(pk_set)
+
+
+@receiver(post_save, sender=FactoryButton)
+@receiver(post_save, sender=PortalSection)
+@receiver(post_save, sender=SystemCard)
+@receiver(post_save, sender=PortalSettings)
+@receiver(post_delete, sender=FactoryButton)
+@receiver(post_delete, sender=PortalSection)
+@receiver(post_delete, sender=SystemCard)
+@receiver(post_delete, sender=PortalSettings)
+def content_changed(sender, instance, **kwargs):
+    """Recompile the navigation snapshot after any catalogue or settings change"""
+    # After commit: a worker rebuilding before it would cache the old rows under the new stamps.
+    # Sections first, as the snapshot version makes the next snapshot read the new section stamps
+    section_ids = []
+    if sender is SystemCard:
+        section_ids = [instance.section_id]
+    elif sender is PortalSection:
+        section_ids = [instance.pk]
+    if section_ids:
+        transaction.on_commit(lambda: fragments.bump_sections(section_ids))
+    transaction.on_commit(bump_version)
+    tasks.prerender_soon()
+
+
+@receiver(post_save, sender=FactoryButton)
+@receiver(post_save, sender=PortalSection)
+@receiver(post_save, sender=SystemCard)
+@receiver(post_save, sender=PortalSettings)
+def journal_save(sender, instance, created, **kwargs):
+    """Append the change to the journal served by the change feed"""
+    journal.record(sender, [instance.pk], 'create' if created else 'update')
+
+
+@receiver(post_delete, sender=FactoryButton)
+@receiver(post_delete, sender=PortalSection)
+@receiver(post_delete, sender=SystemCard)
+@receiver(post_delete, sender=PortalSettings)
+def journal_delete(sender, instance, **kwargs):
+    """Append the delete to the journal served by the change feed"""
+    journal.record(sender, [instance.pk], 'delete')
+
+
+@receiver(post_save, sender=FactoryButton)
+@receiver(post_save, sender=PortalSection)
+@receiver(post_save, sender=SystemCard)
+def icon_changed(sender, instance, **kwargs):
+    """Rebuild the icon subset when an item uses an icon it does not have yet"""
+    if not icons.is_covered(instance.icon):
+        jobs.enqueue('rebuild_icons', key='rebuild_icons')
+
+
+GROUPED = (FactoryButton, PortalSection, SystemCard)
+
+
+@receiver(m2m_changed, sender=FactoryButton.groups.through)
+@receiver(m2m_changed, sender=PortalSection.groups.through)
+@receiver(m2m_changed, sender=SystemCard.groups.through)
+def visibility_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """Recompile the navigation snapshot and journal an update when the groups of an item change"""
+    if action == 'post_add':
+        # Adding a group restricts the item; removing groups never lifts it (see RESTRICTED_HELP)
+        if reverse:
+            model.objects.filter(pk__in=pk_set, restricted=False).update(restricted=True)
+        else:
+            type(instance).objects.filter(pk=instance.pk, restricted=False).update(restricted=True)
+            instance.restricted = True
+    if reverse and action == 'pre_clear':
+        # group.portal_cards.clear(): remember whose groups change
+        instance._cleared_item_ids = getattr(instance, '_cleared_item_ids', {})
+        instance._cleared_item_ids[model] = list(model.objects.filter(groups=instance).values_list('id', flat=True))
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            journal.record(type(instance), [instance.pk], 'update')
+        elif action == 'post_clear':
+            journal.record(model, getattr(instance, '_cleared_item_ids', {}).pop(model, ()), 'update')
+        else:
+            journal.record(model, pk_set, 'update')
+        transaction.on_commit(bump_version)
+        # The static pages are anonymous views: a card given a group must leave them
+        tasks.prerender_soon()
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleting(sender, instance, **kwargs):
+    """Remember the items of the group: the cascade removing it from them sends no m2m_changed"""
+    instance._item_ids = {model: list(model.objects.filter(groups=instance).values_list('id', flat=True))
+                          for model in GROUPED}
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    """Items restricted to the group stay restricted; journal the change of their groups"""
+    for model, ids in getattr(instance, '_item_ids', {}).items():
+        journal.record(model, ids, 'update')
+    transaction.on_commit(bump_version)
+    tasks.prerender_soon()
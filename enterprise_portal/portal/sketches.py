@@ -0,0 +1,154 @@
+"""
+Approximate distinct-visitor counts.
+
+Every card gets one HyperLogLog sketch per day (CardVisitorSketch), updated by
+track_click. A visitor is the user when logged in, otherwise the client IP.
+Sketches merge by taking the register-wise maximum, so any date range and any
+group of cards (a section, a factory) is answered by merging the stored
+sketches, without touching raw PortalAnalytics rows.
+
+With PRECISION = 12 the relative standard error is 1.04 / sqrt(4096) ~ 1.6%.
+"""
+import hashlib
+import math
+import zlib
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import CardVisitorSketch, SystemCard
+from .routers import analytics_db
+
+
+PRECISION = 12
+REGISTERS = 1 << PRECISION
+RELATIVE_ERROR = 1.04 / math.sqrt(REGISTERS)
+
+
+class HyperLogLog:
+    """Dense HyperLogLog with 64-bit hashes"""
+    __slots__ = ('registers',)
+
+    def __init__(self, registers=None):
+        self.registers = bytearray(registers) if registers else bytearray(REGISTERS)
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(zlib.decompress(data)) if data else cls()
+
+    def to_bytes(self):
+        # Registers of small sketches are mostly zero and compress to a few bytes
+        return zlib.compress(bytes(self.registers), 9)
+
+    def add(self, value):
+        """Add a value; returns True when the sketch changed"""
+        digest = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+        index = digest >> (64 - PRECISION)
+        rest = digest & ((1 << (64 - PRECISION)) - 1)
+        rank = (64 - PRECISION) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / REGISTERS)
+        estimate = alpha * REGISTERS * REGISTERS / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * REGISTERS and zeros:
+            # Small range: linear counting is far more accurate
+            return REGISTERS * math.log(REGISTERS / zeros)
+        return estimate
+
+
+def visitor_key(user_id, ip_address):
+    return f'u:{user_id}' if user_id else f'ip:{ip_address}'
+
+
+def record_visit(card_id, user_id, ip_address, day=None):
+    """Add one click to the card's sketch for the day, writing only when it changed"""
+    record_visits(card_id, [visitor_key(user_id, ip_address)], day)
+
+
+def record_visits(card_id, visitors, day=None):
+    """Add a batch of visitor keys (see visitor_key) to the card's sketch for the day"""
+    def add(sketch):
+        changed = False
+        for visitor in visitors:
+            changed = sketch.add(visitor) or changed
+        return changed
+
+    _update(card_id, day or timezone.localdate(), add)
+
+
+def merge_into(card_id, day, sketch):
+    """Merge an externally built sketch into the stored one (used by the backfill command)"""
+    def merge(stored):
+        stored.merge(sketch)
+        return True
+
+    _update(card_id, day, merge)
+
+
+def _update(card_id, day, change):
+    """
+    Apply change(sketch) -> changed to the card's stored sketch for the day.
+
+    Each worker process has its own click writer, so the row is written with
+    a compare-and-swap on its version; on a conflict the change is applied
+    again to the re-read sketch, which is safe as merging is idempotent.
+    """
+    while True:
+        row = CardVisitorSketch.objects.filter(card_id=card_id, day=day).first()
+        sketch = HyperLogLog.from_bytes(row.sketch if row else None)
+        if not change(sketch):
+            return
+        if row is None:
+            try:
+                with transaction.atomic(using=analytics_db()):
+                    CardVisitorSketch.objects.create(card_id=card_id, day=day, sketch=sketch.to_bytes())
+                return
+            except IntegrityError:
+                continue  # created meanwhile by another writer
+        if CardVisitorSketch.objects.filter(pk=row.pk, version=row.version).update(
+                sketch=sketch.to_bytes(), version=row.version + 1):
+            return
+
+
+def unique_visitors(card_ids, start, end=None):
+    """
+    Distinct visitors over the cards and the inclusive date range, as
+    {'estimate', 'standard_error', 'low', 'high'} with a ~95% interval.
+    """
+    end = end or start
+    merged = HyperLogLog()
+    rows = CardVisitorSketch.objects.filter(card_id__in=list(card_ids), day__range=(start, end))
+    for data in rows.values_list('sketch', flat=True).iterator():
+        merged.merge(HyperLogLog.from_bytes(data))
+
+    estimate = merged.count()
+    error = estimate * RELATIVE_ERROR
+    return {
+        'estimate': round(estimate),
+        'standard_error': round(error, 1),
+        'low': max(0, math.floor(estimate - 2 * error)),
+        'high': math.ceil(estimate + 2 * error),
+    }
+
+
+def card_unique_visitors(card_id, start, end=None):
+    return unique_visitors([card_id], start, end)
+
+
+def section_unique_visitors(section_id, start, end=None):
+    card_ids = SystemCard.objects.filter(section_id=section_id).values_list('id', flat=True)
+    return unique_visitors(card_ids, start, end)
+
+
+def factory_unique_visitors(factory_id, start, end=None):
+    card_ids = SystemCard.objects.filter(section__factory_id=factory_id).values_list('id', flat=True)
+    return unique_visitors(card_ids, start, end)
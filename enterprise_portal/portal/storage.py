@@ -0,0 +1,117 @@
+"""
+Content-addressed media storage.
+
+FileSystemStorage keeps the uploaded file name and appends a random suffix
+on a clash, so every re-upload of the same logo added another copy under
+media/ that nothing removed. ContentAddressedStorage (DEFAULT_FILE_STORAGE)
+names an upload after the SHA-256 of its bytes instead,
+
+    logo/<first 32 hex digits of the hash><original extension>
+
+so uploading a file that is already stored writes nothing and returns the
+existing name. A name then always maps to the same bytes, which makes
+media safe to serve with a far-future, immutable Cache-Control (see
+immutable_cache_control(); the development server's media view applies it,
+a front proxy should do the same for names matching CONTENT_NAME).
+
+Files that no PortalSettings image field refers to any more are removed by
+manage.py gc_media.
+"""
+import hashlib
+import os
+import re
+import time
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.utils import validate_file_name
+from django.db.models import FileField
+
+
+DIGEST_LENGTH = 32
+
+# Base name of a content-addressed file
+CONTENT_NAME = re.compile(r'^[0-9a-f]{%d}(\.[A-Za-z0-9]+)?$' % DIGEST_LENGTH)
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def content_digest(content):
+    sha = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        sha.update(chunk)
+    content.seek(0)
+    return sha.hexdigest()[:DIGEST_LENGTH]
+
+
+def is_content_addressed(name):
+    return bool(CONTENT_NAME.match(os.path.basename(name)))
+
+
+def immutable_cache_control(response, name):
+    """Mark the response cacheable forever when it serves a content-addressed file"""
+    if response.status_code == 200 and is_content_addressed(name):
+        response['Cache-Control'] = IMMUTABLE
+    return response
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage that names files after their content and stores each content once"""
+
+    def hashed_name(self, name, content):
+        directory, base = os.path.split(name)
+        extension = os.path.splitext(base)[1].lower()
+        return os.path.join(directory, content_digest(content) + extension).replace('\\', '/')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        validate_file_name(name, allow_relative_path=True)
+        if self.exists(name):
+            # Same name, same bytes: nothing to write. Touch it so gc_media's
+            # grace period covers it until the row referring to it is saved
+            os.utime(self.path(name))
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+def _settings_file_fields():
+    from .models import PortalSettings
+    return [field for field in PortalSettings._meta.get_fields() if isinstance(field, FileField)]
+
+
+def referenced_media():
+    """Names stored in any PortalSettings image field"""
+    from .models import PortalSettings
+    names = set()
+    for values in PortalSettings.objects.values_list(*(field.name for field in _settings_file_fields())):
+        names.update(value for value in values if value)
+    return names
+
+
+def orphaned_media(min_age):
+    """
+    [(name, size)] of files under the upload directories of the PortalSettings
+    image fields that no row refers to and that are older than min_age
+    seconds (younger files may belong to an upload whose row is not saved yet).
+    Other media (generated icons, fixtures under system/) is never considered.
+    """
+    referenced = referenced_media()
+    directories = {field.upload_to.strip('/') for field in _settings_file_fields()
+                   if isinstance(field.upload_to, str) and field.upload_to.strip('/')}
+    cutoff = time.time() - min_age
+    orphans = []
+    for directory in sorted(directories):
+        root = os.path.join(default_storage.location, directory)
+        for path, _, files in os.walk(root):
+            for filename in files:
+                full = os.path.join(path, filename)
+                name = os.path.relpath(full, default_storage.location).replace(os.sep, '/')
+                stat = os.stat(full)
+                if name not in referenced and stat.st_mtime < cutoff:
+                    orphans.append((name, stat.st_size))
+    return orphans
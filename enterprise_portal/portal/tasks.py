@@ -0,0 +1,61 @@
+"""
+Background jobs of the portal (see portal.jobs), run by manage.py run_jobs.
+
+Deferred:
+    rebuild_icons       the icon subset, after an item got an icon it lacks
+    prerender_portal    the static pages, shortly after content changes
+
+Periodic:
+    build_visitor_sketches  today's and yesterday's visitor sketches, hourly
+    compact_changes         the change journal, daily
+    prune_jobs              finished jobs older than JOB_RETENTION_DAYS, daily
+"""
+import io
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import call_command
+from django.utils import timezone
+
+from . import jobs
+
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+@jobs.job('rebuild_icons')
+def rebuild_icons():
+    from .icons import rebuild
+    rebuild()
+
+
+@jobs.job('prerender_portal')
+def prerender_portal():
+    from .prerender import build
+    build()
+
+
+def prerender_soon():
+    """Queue one static re-render for a burst of content changes"""
+    if settings.PRERENDER_ON_CHANGE:
+        jobs.enqueue('prerender_portal', key='prerender_portal', delay=settings.PRERENDER_DELAY_SECONDS)
+
+
+@jobs.job('build_visitor_sketches', every=HOUR)
+def build_visitor_sketches():
+    # Merging is idempotent, so re-reading yesterday picks up late clicks at no risk
+    today = timezone.localdate()
+    call_command('build_visitor_sketches', since=str(today - timedelta(days=1)), until=str(today),
+                 stdout=io.StringIO())
+
+
+@jobs.job('compact_changes', every=DAY)
+def compact_changes():
+    from .journal import compact
+    compact(settings.CHANGE_JOURNAL_RETENTION_DAYS)
+
+
+@jobs.job('prune_jobs', every=DAY)
+def prune_jobs():
+    jobs.prune(settings.JOB_RETENTION_DAYS)
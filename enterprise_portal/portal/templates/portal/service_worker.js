@@ -0,0 +1,132 @@
+// Offline shell of the portal, generated per visitor (see portal/offline.py)
+const MANIFEST = {{ manifest|safe }};
+const NETWORK_ONLY = {{ network_only|safe }};
+const SESSION_PATHS = {{ session_paths|safe }};
+const PAGE_PATHS = {{ page_paths|safe }};
+const VERSION_URL = '{% url "version_poll" %}?timeout=0';
+const PAGES = `portal-pages-${MANIFEST.version}`;
+const ASSETS = `portal-assets-${MANIFEST.version}`;
+const VERSION_CHECK_MS = 30000;
+const VERSION_WAIT_MS = 1000;
+
+let lastVersionCheck = 0;
+
+function assetRequest(url) {
+    // Cross-origin bundles are cached opaque, as the page loads them
+    return new URL(url, self.location).origin === self.location.origin ? new Request(url) : new Request(url, { mode: 'no-cors' });
+}
+
+async function precache(cacheName, requests) {
+    // One failing url must not leave the visitor without the rest
+    const cache = await caches.open(cacheName);
+    await Promise.all(requests.map(async request => {
+        try {
+            const response = await fetch(request);
+            if ((response.ok && !response.redirected) || response.type === 'opaque') {
+                await cache.put(request, response);
+            }
+        } catch (error) {
+            // offline or gone: picked up at runtime instead
+        }
+    }));
+}
+
+self.addEventListener('install', event => {
+    event.waitUntil(Promise.all([
+        precache(PAGES, MANIFEST.pages.map(url => new Request(url, { credentials: 'same-origin' }))),
+        precache(ASSETS, MANIFEST.assets.map(assetRequest)),
+    ]).then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(caches.keys()
+        .then(names => Promise.all(names
+            .filter(name => name.startsWith('portal-') && name !== PAGES && name !== ASSETS)
+            .map(name => caches.delete(name))))
+        .then(() => self.clients.claim()));
+});
+
+function startsWithAny(path, prefixes) {
+    return prefixes.some(prefix => path.startsWith(prefix));
+}
+
+async function checkVersion() {
+    // The pages were cached at MANIFEST.content_version; a new one means a new worker.
+    // Resolves to true when the server is in maintenance mode
+    if (Date.now() - lastVersionCheck < VERSION_CHECK_MS) return false;
+    lastVersionCheck = Date.now();
+    try {
+        const response = await fetch(VERSION_URL, { cache: 'no-store' });
+        if (response.status === 503) {
+            // Cached pages would hide the maintenance page: drop them until the portal is back
+            await caches.delete(PAGES);
+            return true;
+        }
+        const { version } = await response.json();
+        if (version !== MANIFEST.content_version) {
+            await self.registration.update();
+        }
+    } catch (error) {
+        // offline: keep serving the cache
+    }
+    return false;
+}
+
+async function page(event) {
+    const cache = await caches.open(PAGES);
+    const cached = await cache.match(event.request, { ignoreVary: true });
+    if (cached) {
+        // A due check is waited for briefly, so maintenance mode is not hidden behind the cache
+        const check = checkVersion();
+        event.waitUntil(check);
+        const timeout = new Promise(resolve => setTimeout(resolve, VERSION_WAIT_MS, false));
+        if (await Promise.race([check, timeout])) {
+            return fetch(event.request).catch(() => cached);
+        }
+        return cached;
+    }
+    try {
+        const response = await fetch(event.request);
+        if (response.ok && !response.redirected) {
+            event.waitUntil(cache.put(event.request, response.clone()));
+        }
+        return response;
+    } catch (error) {
+        return (await cache.match(MANIFEST.pages[0])) || Response.error();
+    }
+}
+
+async function asset(event) {
+    const cache = await caches.open(ASSETS);
+    const cached = await cache.match(event.request);
+    if (cached) return cached;
+    const response = await fetch(event.request);
+    if (response.ok || response.type === 'opaque') {
+        event.waitUntil(cache.put(event.request, response.clone()));
+    }
+    return response;
+}
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    const url = new URL(request.url);
+    const sameOrigin = url.origin === self.location.origin;
+
+    if (sameOrigin && startsWithAny(url.pathname, SESSION_PATHS)) {
+        // Signing in or out, or a new language: the cached pages were someone else's
+        event.waitUntil(caches.delete(PAGES));
+        return;
+    }
+    if (request.method !== 'GET' || (sameOrigin && startsWithAny(url.pathname, NETWORK_ONLY))) {
+        return;
+    }
+    if (request.mode === 'navigate') {
+        if (sameOrigin && PAGE_PATHS.includes(url.pathname)) {
+            event.respondWith(page(event));
+        }
+        return;
+    }
+    if (!sameOrigin || MANIFEST.assets.includes(url.href) || MANIFEST.assets.includes(url.pathname)) {
+        event.respondWith(asset(event));
+    }
+});
@@ -0,0 +1,13 @@
+from django import template
+
+from portal.fragments import section_fragment as render_section
+
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def section_fragment(context, section, template_name):
+    """{% section_fragment section 'portal/sections/home.html' %}: the section's cached HTML"""
+    return render_section(section, template_name, 'django', context['request'], context['settings'],
+                          context.get('is_edit_mode', False))
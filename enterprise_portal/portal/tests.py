@@ -1,3 +1,755 @@
-from django.test import TestCase
+import json
+import os
+import pickle
+import re
+import shutil
+import tempfile
+import time
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings as django_settings
+from django.contrib.auth import get_user
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.db import OperationalError
+from django.http import HttpRequest
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from . import fragments, jobs, journal, navigation, prerender, trending, warmup
+from .backends import CachedModelBackend, user_cache_key
+from .catalogue import export_catalogue, import_catalogue
+from .frequency import frequent_card_ids, record_click
+from .ingest import ClickFilter, client_ip
+from .mmapcache import MmapCache
+from .sketches import RELATIVE_ERROR, HyperLogLog, card_unique_visitors, record_visits
+from .models import (ContentChange, FactoryButton, Job, PortalAnalytics, PortalSection, PortalSettings, SystemCard,
+                     UserCardFrequency)
+from .routers import AnalyticsRouter
+from .trending import SpaceSaving, TrendingTracker
+
+
+# Tests must not read or bump the shared memory-mapped caches of a running portal
+LOCMEM = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-default'},
+    'sessions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-sessions'},
+}
+
+
+calls = []
+
+
+@jobs.job('tests.record')
+def record_call(value):
+    calls.append(value)
+
+
+def make_card(name='Card', section=None):
+    if section is None:
+        factory = FactoryButton.objects.create(name='Factory', url='https://factory.example.com')
+        section = PortalSection.objects.create(name='Section', factory=factory)
+    return SystemCard.objects.create(section=section, name=name, url='https://card.example.com')
+
+
+CACHED_TEMPLATES = [dict(django_settings.TEMPLATES[0], APP_DIRS=False, OPTIONS=dict(
+    django_settings.TEMPLATES[0]['OPTIONS'], loaders=[('django.template.loaders.cached.Loader', [
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    ])]))] + django_settings.TEMPLATES[1:]
+
+
+class WarmUpTests(SimpleTestCase):
+    def test_templates_are_reported_when_not_cached(self):
+        with override_settings(DEBUG=True, TEMPLATES=django_settings.TEMPLATES[:1]):
+            self.assertRegex(str(warmup._templates()), r'^\d+, not cached$')
+
+    @override_settings(TEMPLATES=CACHED_TEMPLATES)
+    def test_app_templates_are_compiled_into_the_cached_loader(self):
+        from django.template import engines
+        warmup._templates()
+        cached = engines['django'].engine.template_loaders[0].get_template_cache
+        self.assertIn('portal/home.html', cached)
+        self.assertIn('base/base.html', cached)
+
+
+class RouterTests(SimpleTestCase):
+    def test_analytics_models_live_in_the_analytics_database(self):
+        router = AnalyticsRouter()
+        self.assertEqual(router.db_for_write(PortalAnalytics), 'analytics')
+        self.assertEqual(router.db_for_read(UserCardFrequency), 'analytics')
+        self.assertEqual(router.db_for_read(SystemCard), 'default')
+        self.assertTrue(router.allow_migrate('analytics', 'portal', 'portalanalytics'))
+        self.assertFalse(router.allow_migrate('default', 'portal', 'portalanalytics'))
+        self.assertFalse(router.allow_migrate('analytics', 'portal', 'systemcard'))
+
+
+class SpaceSavingTests(SimpleTestCase):
+    def test_heavy_hitters_are_kept_with_bounded_error(self):
+        summary = SpaceSaving(capacity=5)
+        counts = {'a': 50, 'b': 30, 'c': 20}
+        for item, count in counts.items():
+            summary.add(item, count)
+        for rare in range(40):
+            summary.add(f'rare{rare}')
+        top = summary.top(3)
+        self.assertEqual([item for item, _, _ in top], ['a', 'b', 'c'])
+        for item, count, error in top:
+            self.assertLessEqual(count - error, counts[item])
+            self.assertGreaterEqual(count, counts[item])
+
+    def test_merge_adds_counts(self):
+        left, right = SpaceSaving(capacity=5), SpaceSaving(capacity=5)
+        left.add('a', 3)
+        right.add('a', 4)
+        right.add('b', 2)
+        self.assertEqual(left.merge(right).top(2), [('a', 7, 0), ('b', 2, 0)])
+
+
+@override_settings(CLICK_DEDUP_SECONDS=5, CLICK_IP_RATE=1, CLICK_IP_BURST=2, CLICK_SAMPLE_ABOVE=1000,
+                   CLICK_MAX_PENDING=10)
+class ClickFilterTests(SimpleTestCase):
+    agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'
+
+    def test_bots_and_prefetches_are_dropped(self):
+        click_filter = ClickFilter()
+        self.assertEqual(click_filter.check(1, None, '203.0.113.7', 'curl/8.0')[0], 'bot')
+        self.assertEqual(click_filter.check(1, None, '203.0.113.7', self.agent, {'HTTP_PURPOSE': 'prefetch'})[0],
+                         'bot')
+
+    def test_double_click_is_a_duplicate(self):
+        click_filter = ClickFilter()
+        self.assertEqual(click_filter.check(1, 7, '203.0.113.7', self.agent), ('ok', 1, 0))
+        self.assertEqual(click_filter.check(1, 7, '203.0.113.7', self.agent)[0], 'duplicate')
+        self.assertEqual(click_filter.check(2, 7, '203.0.113.7', self.agent)[0], 'ok')
+
+    def test_flood_from_one_ip_is_rate_limited(self):
+        click_filter = ClickFilter()
+        verdicts = [click_filter.check(card_id, None, '203.0.113.7', self.agent) for card_id in range(3)]
+        self.assertEqual([verdict for verdict, _, _ in verdicts], ['ok', 'ok', 'rate_limited'])
+        self.assertGreater(verdicts[2][2], 0)
+        self.assertEqual(click_filter.check(9, None, '198.51.100.1', self.agent)[0], 'ok')
+
+    def test_backlog_samples_with_compensating_weight(self):
+        click_filter = ClickFilter()
+        with mock.patch('portal.ingest.random.random', return_value=0.0):
+            self.assertEqual(click_filter.check(1, 7, '203.0.113.7', self.agent, pending=40), ('ok', 4, 0))
+
+
+class MmapCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = MmapCache(os.path.join(self.directory, 'test.mmap'),
+                               {'OPTIONS': {'MAX_ENTRIES': 64, 'SLOT_SIZE': 256}})
+
+    def test_values_round_trip(self):
+        for value in (1, 2.5, 'text', b'bytes', None, True, {'nested': [1, 2]}, 'x' * 5000):
+            self.cache.set('key', value)
+            self.assertEqual(self.cache.get('key', 'missing'), value)
+        self.assertTrue(self.cache.add('other', 1))
+        self.assertFalse(self.cache.add('other', 2))
+        self.assertEqual(self.cache.get('other'), 1)
+
+    def test_value_larger_than_a_slot_drops_the_key(self):
+        self.cache.set('key', 'small')
+        self.cache.set('key', os.urandom(5000))
+        self.assertEqual(self.cache.get('key', 'missing'), 'missing')
+
+    def test_incr_and_expiry(self):
+        self.cache.set('counter', 1, timeout=10)
+        self.assertEqual(self.cache.incr('counter', 2), 3)
+        with mock.patch('time.time', return_value=time.time() + 11):
+            self.assertIsNone(self.cache.get('counter'))
+            with self.assertRaises(ValueError):
+                self.cache.incr('counter')
+
+
+@override_settings(CACHES=LOCMEM)
+class AuthUserCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('visitor', password='secret')
+        cache.delete(user_cache_key(self.user.pk))
+
+    def test_cached_user_holds_no_password_hash(self):
+        backend = CachedModelBackend()
+        backend.get_user(self.user.pk)
+        # What the shared cache file would hold
+        self.assertNotIn(self.user.password.encode(), pickle.dumps(cache.get(user_cache_key(self.user.pk))))
+        with self.assertNumQueries(0):
+            cached = backend.get_user(self.user.pk)
+            self.assertEqual((cached.username, cached.is_staff), ('visitor', False))
+        cached.first_name = 'Ann'
+        cached.save()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Ann')
+        self.assertTrue(self.user.check_password('secret'))
+
+    def test_session_is_checked_against_the_current_password(self):
+        self.client.login(username='visitor', password='secret')
+        request = HttpRequest()
+        request.session = self.client.session
+        self.assertEqual(get_user(request).pk, self.user.pk)
+        self.assertEqual(get_user(request).pk, self.user.pk)
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertTrue(get_user(request).is_anonymous)
+
+
+@override_settings(CACHES=LOCMEM)
+class JournalTests(TestCase):
+    databases = {'default', 'analytics'}
+
+    def test_head_is_not_below_floor_after_pruning_latest_entry(self):
+        card = make_card()
+        card.delete()
+        # The newest entry is an old delete: compaction prunes it and raises the floor past every other entry
+        ContentChange.objects.filter(action='delete').update(changed_at=timezone.now() - timedelta(days=90))
+        journal.compact(retention_days=30)
+
+        self.assertFalse(ContentChange.objects.filter(seq__gte=journal.floor()).exists())
+        self.assertEqual(journal.head(), journal.floor())
+        self.assertEqual(journal.changes_since(journal.head()), ([], journal.head(), False))
+
+    def test_feed_cursor_of_new_client_is_accepted(self):
+        User.objects.create_user('staff', password='secret', is_staff=True)
+        self.client.login(username='staff', password='secret')
+        self.client.get('/api/changes/')  # creates the portal settings, journaling them
+        card = make_card()
+        card.delete()
+        ContentChange.objects.filter(action='delete').update(changed_at=timezone.now() - timedelta(days=90))
+        journal.compact(retention_days=30)
+
+        cursor = self.client.get('/api/changes/').json()['cursor']
+        response = self.client.get('/api/changes/', {'since': cursor})
+        self.assertEqual(response.status_code, 200)
+
+    def feed(self, cursor):
+        changes, _, _ = journal.changes_since(cursor)
+        return {(change['kind'], change['id']): change for change in changes}
+
+    def test_group_changes_are_journaled_with_the_group_ids(self):
+        card, other = make_card(), make_card('Other')
+        finance, hr = Group.objects.create(name='Finance'), Group.objects.create(name='HR')
+
+        cursor = journal.head()
+        card.groups.add(finance, hr)
+        change = self.feed(cursor)[('card', card.pk)]
+        self.assertEqual(change['action'], 'update')
+        self.assertEqual(change['data']['groups'], sorted([finance.pk, hr.pk]))
+        self.assertTrue(change['data']['restricted'])
+
+        cursor = journal.head()
+        other.groups.add(hr)
+        hr.portal_cards.clear()
+        changes = self.feed(cursor)
+        self.assertEqual(changes[('card', card.pk)]['data']['groups'], [finance.pk])
+        self.assertEqual(changes[('card', other.pk)]['data']['groups'], [])
+
+        cursor = journal.head()
+        finance.delete()
+        change = self.feed(cursor)[('card', card.pk)]
+        self.assertEqual(change['data']['groups'], [])
+        self.assertTrue(change['data']['restricted'])
+
+
+@override_settings(CACHES=LOCMEM)
+class VisibilityTests(TestCase):
+    def setUp(self):
+        self.public = make_card('Public')
+        self.secret = make_card('Secret', self.public.section)
+        self.group = Group.objects.create(name='Finance')
+        self.secret.groups.add(self.group)
+
+    def visible(self, tier, groups=frozenset()):
+        view = navigation.Snapshot(0).view('en', tier, groups)
+        return set(view.cards_by_id)
+
+    def test_restricted_card_is_shown_to_its_group_only(self):
+        other = Group.objects.create(name='Sales')
+        self.assertEqual(self.visible('anonymous'), {self.public.pk})
+        self.assertEqual(self.visible('authenticated', {other.pk}), {self.public.pk})
+        self.assertEqual(self.visible('authenticated', {self.group.pk}), {self.public.pk, self.secret.pk})
+        self.assertEqual(self.visible('staff'), {self.public.pk, self.secret.pk})
+
+    def test_deleting_the_group_keeps_its_cards_hidden(self):
+        self.group.delete()
+        self.assertEqual(self.visible('anonymous'), {self.public.pk})
+        self.assertEqual(self.visible('authenticated'), {self.public.pk})
+        self.assertEqual(self.visible('staff'), {self.public.pk, self.secret.pk})
+
+    def test_only_clearing_the_flag_lifts_the_restriction(self):
+        self.secret.groups.clear()
+        self.assertEqual(self.visible('anonymous'), {self.public.pk})
+        SystemCard.objects.filter(pk=self.secret.pk).update(restricted=False)
+        self.assertEqual(self.visible('anonymous'), {self.public.pk, self.secret.pk})
+
+
+@override_settings(CACHES=LOCMEM)
+class VisibilityViewTests(TestCase):
+    databases = {'default', 'analytics'}
+
+    def setUp(self):
+        # Committed as far as the snapshot is concerned: it is recompiled on the version bump
+        with self.captureOnCommitCallbacks(execute=True):
+            settings = PortalSettings.get_settings()
+            settings.logo = settings.favicon = settings.background_image = 'system/no_image.jpg'
+            settings.save()
+            make_card('Public card', PortalSection.objects.create(name='Home section'))
+            hidden = PortalSection.objects.create(name='Finance section')
+            make_card('Ledger card', hidden)
+            self.group = Group.objects.create(name='Finance')
+            hidden.groups.add(self.group)
+        self.member = User.objects.create_user('member', password='secret')
+        self.member.groups.add(self.group)
+
+    def home(self):
+        return self.client.get('/home/').content.decode()
+
+    def test_cards_of_a_restricted_section_follow_membership(self):
+        page = self.home()
+        self.assertIn('Public card', page)
+        self.assertNotIn('Ledger card', page)
+
+        self.client.login(username='member', password='secret')
+        self.assertIn('Ledger card', self.home())
+        self.member.groups.remove(self.group)
+        self.assertNotIn('Ledger card', self.home())
+
+
+def markup(html):
+    """The page without scripts, comments and CSRF tokens, one stripped line per line"""
+    html = re.sub(r'(?s)<script\b.*?</script>|<!--.*?-->|name="csrfmiddlewaretoken" value="[^"]*"', '', html)
+    return [line.strip() for line in html.splitlines() if line.strip()]
+
+
+@override_settings(CACHES=LOCMEM)
+class Jinja2TemplateTests(TestCase):
+    databases = {'default', 'analytics'}
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            settings = PortalSettings.get_settings()
+            settings.logo = settings.favicon = settings.background_image = 'system/no_image.jpg'
+            settings.save()
+            card = make_card('Factory card')
+            make_card('Home card', PortalSection.objects.create(name='Home section'))
+        self.urls = ['/home/', f'/factory/?id={card.section.factory_id}']
+        User.objects.create_user('staff', password='secret', is_staff=True)
+
+    def render(self, views):
+        with override_settings(PORTAL_JINJA2_VIEWS=views):
+            return [markup(self.client.get(url).content.decode()) for url in self.urls]
+
+    def test_both_engines_render_the_same_pages(self):
+        for staff in (False, True):
+            if staff:
+                self.client.login(username='staff', password='secret')
+            django_pages, jinja2_pages = self.render([]), self.render(['home', 'factory'])
+            self.assertIn('Home card', django_pages[0])
+            self.assertIn('Factory card', '\n'.join(django_pages[1]))
+            for django_page, jinja2_page in zip(django_pages, jinja2_pages):
+                self.assertEqual(django_page, jinja2_page)
+
+    @override_settings(PORTAL_JINJA2_VIEWS=['home'], TEMPLATES=[
+        {'BACKEND': 'django.template.backends.django.DjangoTemplates', 'APP_DIRS': True}])
+    def test_jinja2_views_without_the_engine_fail_at_startup(self):
+        with self.assertRaises(ImproperlyConfigured):
+            apps.get_app_config('portal').ready()
+
+
+@override_settings(CACHES=LOCMEM)
+class ContentVersionTests(TestCase):
+    databases = {'default', 'analytics'}
+
+    def test_version_is_bumped_after_commit(self):
+        card = make_card('x')
+        navigation.current()
+        before = navigation.content_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            card.name = card.name_en = 'x RENAMED'
+            card.save()
+            # Another worker rebuilding now reads the committed rows: it must keep the old version
+            self.assertEqual(navigation.content_version(), before)
+        self.assertNotEqual(navigation.content_version(), before)
+        self.assertEqual(navigation.current().card(card.pk).translated_name, 'x RENAMED')
+
+    def test_section_stamp_is_bumped_after_commit(self):
+        card = make_card()
+        before = fragments.section_versions([card.section_id])
+        with self.captureOnCommitCallbacks(execute=True):
+            card.name = 'Renamed'
+            card.save()
+            self.assertEqual(fragments.section_versions([card.section_id]), before)
+        self.assertNotEqual(fragments.section_versions([card.section_id]), before)
+
+
+@override_settings(CACHES=LOCMEM, JOB_RUN_INLINE=False, JOB_TIMEOUT_SECONDS=60)
+class JobTests(TestCase):
+    databases = {'default', 'analytics'}
+
+    def setUp(self):
+        calls.clear()
+
+    def test_keyed_enqueue_coalesces(self):
+        first = jobs.enqueue('tests.record', key='k', value=1)
+        self.assertIsNotNone(first)
+        self.assertIsNone(jobs.enqueue('tests.record', key='k', value=2))
+        self.assertEqual(Job.objects.filter(key='k').count(), 1)
+
+    def test_job_is_claimed_once(self):
+        queued = jobs.enqueue('tests.record', value=1)
+        self.assertEqual(jobs.claim('a', 5), [queued.pk])
+        self.assertEqual(jobs.claim('b', 5), [])
+        jobs.execute(queued.pk, 'a')
+        self.assertEqual(calls, [1])
+        self.assertEqual(Job.objects.get(pk=queued.pk).status, Job.DONE)
+
+    def test_heartbeat_keeps_a_long_job(self):
+        queued = jobs.enqueue('tests.record', value=1)
+        jobs.claim('a', 1)
+        Job.objects.filter(pk=queued.pk).update(claimed_at=timezone.now() - timedelta(seconds=120))
+        self.assertEqual(jobs.heartbeat('a', [queued.pk]), 1)
+        self.assertEqual(jobs.reclaim_stale(), 0)
+        self.assertEqual(Job.objects.get(pk=queued.pk).status, Job.RUNNING)
+
+    def test_reclaimed_job_outcome_is_not_overwritten(self):
+        queued = jobs.enqueue('tests.record', value=1)
+        jobs.claim('a', 1)
+        Job.objects.filter(pk=queued.pk).update(claimed_at=timezone.now() - timedelta(seconds=120))
+        self.assertEqual(jobs.reclaim_stale(), 1)
+        self.assertEqual(jobs.claim('b', 1), [queued.pk])
+
+        # The first worker finishing late must not record over the re-run
+        jobs.execute(queued.pk, 'a')
+        rerun = Job.objects.get(pk=queued.pk)
+        self.assertEqual((rerun.status, rerun.claimed_by), (Job.RUNNING, 'b'))
+        jobs.execute(queued.pk, 'b')
+        self.assertEqual(Job.objects.get(pk=queued.pk).status, Job.DONE)
+
+    def test_reclaim_fails_a_job_out_of_attempts(self):
+        queued = jobs.enqueue('tests.record', max_attempts=1, value=1)
+        jobs.claim('a', 1)
+        Job.objects.filter(pk=queued.pk).update(claimed_at=timezone.now() - timedelta(seconds=120))
+        self.assertEqual(jobs.reclaim_stale(), 1)
+        self.assertEqual(Job.objects.get(pk=queued.pk).status, Job.FAILED)
+        self.assertEqual(jobs.claim('b', 1), [])
+
+
+@override_settings(CACHES=LOCMEM)
+class CatalogueTests(TestCase):
+    databases = {'default', 'analytics'}
+
+    def setUp(self):
+        self.plant_a = FactoryButton.objects.create(name='Plant A', url='https://a.example.com')
+        self.plant_b = FactoryButton.objects.create(name='Plant B', url='https://b.example.com')
+        for factory in (self.plant_a, self.plant_b, None):
+            section = PortalSection.objects.create(name='Systems', factory=factory)
+            make_card('ERP', section)
+
+    def test_round_trip_changes_nothing(self):
+        stats = import_catalogue(export_catalogue(), prune=True)
+        self.assertEqual(stats['cards'], {'created': 0, 'updated': 0, 'deleted': 0})
+        self.assertEqual(stats['factories'], {'created': 0, 'updated': 0, 'deleted': 0})
+
+    def test_new_icons_queue_a_sprite_rebuild(self):
+        data = export_catalogue()
+        Job.objects.all().delete()
+        with mock.patch('portal.icons.is_covered', lambda name: name != 'fa-rocket'):
+            import_catalogue(data)
+            self.assertFalse(Job.objects.filter(name='rebuild_icons').exists())
+            data['home_sections'][0]['cards'][0]['icon'] = 'fa-rocket'
+            import_catalogue(data)
+        self.assertTrue(Job.objects.filter(name='rebuild_icons').exists())
+
+    def test_prune_of_a_partial_export_keeps_other_factories_and_home(self):
+        data = export_catalogue(factory_ids=[self.plant_a.pk], include_home=False)
+        data['factories'][0]['sections'][0]['cards'] = []
+        stats = import_catalogue(data, prune=True)
+
+        self.assertEqual(stats['cards']['deleted'], 1)
+        self.assertEqual(stats['sections']['deleted'], 0)
+        self.assertEqual(stats['factories']['deleted'], 0)
+        self.assertFalse(SystemCard.objects.filter(section__factory=self.plant_a).exists())
+        self.assertTrue(SystemCard.objects.filter(section__factory=self.plant_b).exists())
+        self.assertTrue(SystemCard.objects.filter(section__factory=None).exists())
+
+    def test_prune_of_a_full_export_deletes_missing_factories(self):
+        data = export_catalogue()
+        data['factories'] = [item for item in data['factories'] if item['name'] != 'Plant B']
+        stats = import_catalogue(data, prune=True)
+        self.assertEqual(stats['factories']['deleted'], 1)
+        self.assertFalse(FactoryButton.objects.filter(name='Plant B').exists())
+
+    def test_duplicate_names_are_refused(self):
+        data = export_catalogue()
+        cards = data['factories'][0]['sections'][0]['cards']
+        cards.append(dict(cards[0], url='https://other.example.com'))
+        with self.assertRaisesMessage(ValueError, "Duplicate card 'Plant A / Systems / ERP' in the file"):
+            import_catalogue(data)
+        self.assertEqual(SystemCard.objects.filter(name='ERP').count(), 3)
+
+
+@override_settings(CACHES=LOCMEM, LANGUAGES=[('en', 'English')])
+class PrerenderTests(TestCase):
+    databases = {'default', 'analytics'}
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def test_maintenance_mode_removes_static_pages(self):
+        make_card()
+        settings = PortalSettings.get_settings()
+        # The base templates expect the images to be set
+        settings.logo = settings.favicon = settings.background_image = 'system/no_image.jpg'
+        with self.captureOnCommitCallbacks(execute=True):
+            settings.save()
+        home = os.path.join(self.root, 'en', 'home', 'index.html')
+        prerender.build(self.root)
+        self.assertTrue(os.path.exists(home))
+
+        settings.maintenance_mode = True
+        with self.captureOnCommitCallbacks(execute=True):
+            settings.save()
+        stats = prerender.build(self.root)
+        self.assertEqual(stats['rendered'], 0)
+        self.assertFalse(os.path.exists(home))
+
+        settings.maintenance_mode = False
+        with self.captureOnCommitCallbacks(execute=True):
+            settings.save()
+        prerender.build(self.root)
+        self.assertTrue(os.path.exists(home))
+
+    def test_group_changes_rerender_without_the_restricted_card(self):
+        section = PortalSection.objects.create(name='Home section')
+        make_card('Public card', section)
+        secret = make_card('Secret card', section)
+        settings = PortalSettings.get_settings()
+        settings.logo = settings.favicon = settings.background_image = 'system/no_image.jpg'
+        with self.captureOnCommitCallbacks(execute=True):
+            settings.save()
+        home = os.path.join(self.root, 'en', 'home', 'index.html')
+
+        def rendered():
+            prerender.build(self.root)
+            with open(home, encoding='utf-8') as page:
+                return page.read()
+
+        self.assertIn('Secret card', rendered())
+        group = Group.objects.create(name='Finance')
+        Job.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            secret.groups.add(group)
+        self.assertTrue(Job.objects.filter(name='prerender_portal').exists())
+        page = rendered()
+        self.assertNotIn('Secret card', page)
+        self.assertIn('Public card', page)
+
+        Job.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            group.delete()
+        self.assertTrue(Job.objects.filter(name='prerender_portal').exists())
+        self.assertNotIn('Secret card', rendered())
+
+
+class TrendingCheckpointTests(TestCase):
+    databases = {'default', 'analytics'}
+
+    def ranked(self):
+        return [(card_id, count) for card_id, count, _ in TrendingTracker().top('global')]
+
+    def test_concurrent_checkpoints_keep_both_workers_clicks(self):
+        first, second = TrendingTracker(), TrendingTracker()
+        first.record(1, None)
+        first.checkpoint()
+        first.record(1, None)
+        second.record(2, None, weight=2)
+        decode, raced = trending._decode, []
+
+        def racing(state):
+            if not raced:
+                # The other worker checkpoints between this worker's read and its write
+                raced.append(True)
+                second.checkpoint()
+            return decode(state)
+
+        with mock.patch('portal.trending._decode', racing):
+            first.checkpoint()
+        self.assertEqual(sorted(self.ranked()), [(1, 2), (2, 2)])
+
+    @override_settings(TRENDING_CHECKPOINT_SECONDS=0)
+    def test_failed_checkpoint_keeps_clicks_for_the_next(self):
+        tracker = TrendingTracker()
+        with mock.patch('portal.trending._fold', side_effect=OperationalError('database is locked')):
+            tracker.record(1, None)
+        self.assertEqual(self.ranked(), [])
+        self.assertEqual(tracker.top('global'), [(1, 1, 0)])
+        tracker.checkpoint()
+        self.assertEqual(self.ranked(), [(1, 1)])
+
+
+@override_settings(CACHES=LOCMEM)
+class FrequencyTests(TestCase):
+    databases = {'default', 'analytics'}
+
+    def test_ranking_follows_decayed_counts(self):
+        now = 1_800_000_000
+        record_click(1, 10, now=now)
+        record_click(1, 20, now=now)
+        record_click(1, 20, now=now)
+        # A click one half-life later counts double: 1 + 2 against 2
+        record_click(1, 10, now=now + 7 * 86400)
+        self.assertEqual(frequent_card_ids(1), [10, 20])
+
+    def test_concurrent_writer_is_not_overwritten(self):
+        now = 1_800_000_000
+        record_click(1, 10, now=now)
+        get_or_create, raced = UserCardFrequency.objects.get_or_create, []
+
+        def racing(*args, **kwargs):
+            result = get_or_create(*args, **kwargs)
+            if not raced:
+                # Another worker's writer records a click between this read and its write
+                raced.append(True)
+                record_click(1, 20, now=now)
+            return result
+
+        with mock.patch.object(UserCardFrequency.objects, 'get_or_create', racing):
+            record_click(1, 10, now=now)
+        weights = json.loads(UserCardFrequency.objects.get(user_id=1).weights)
+        self.assertEqual(weights, {'10': 2.0, '20': 1.0})
+
+
+class SketchTests(TestCase):
+    databases = {'default', 'analytics'}
+
+    def test_estimate_is_within_the_error(self):
+        sketch = HyperLogLog()
+        for i in range(20000):
+            sketch.add(f'visitor-{i}')
+        self.assertAlmostEqual(sketch.count(), 20000, delta=20000 * 3 * RELATIVE_ERROR)
+
+    def test_merge_is_idempotent_and_round_trips(self):
+        a, b = HyperLogLog(), HyperLogLog()
+        for i in range(500):
+            a.add(i)
+            b.add(i + 250)
+        merged = HyperLogLog.from_bytes(a.to_bytes()).merge(b)
+        self.assertEqual(merged.registers, HyperLogLog(merged.registers).merge(b).merge(a).registers)
+        self.assertAlmostEqual(merged.count(), 750, delta=750 * 3 * RELATIVE_ERROR)
+
+    def test_concurrent_writer_is_not_overwritten(self):
+        day = date(2026, 1, 1)
+        record_visits(1, ['a'], day)
+        from_bytes, raced = HyperLogLog.from_bytes, []
+
+        def racing(data):
+            sketch = from_bytes(data)
+            if not raced:
+                # Another worker's writer stores a visitor between this read and its write
+                raced.append(True)
+                record_visits(1, ['b'], day)
+            return sketch
+
+        with mock.patch.object(HyperLogLog, 'from_bytes', racing):
+            record_visits(1, ['c'], day)
+        self.assertEqual(card_unique_visitors(1, day)['estimate'], 3)
+
+
+@override_settings(CACHES=LOCMEM)
+class PartialUpdateTests(TestCase):
+    def setUp(self):
+        self.card = make_card()
+        User.objects.create_user('staff', password='secret', is_staff=True)
+        self.client.login(username='staff', password='secret')
+        self.url = f'/api/cards/{self.card.pk}/update/'
+
+    def post(self, data):
+        return self.client.post(self.url, json.dumps(data), content_type='application/json')
+
+    def test_stale_version_is_a_conflict(self):
+        version = self.post({'name': 'Renamed'}).json()['version']
+        response = self.post({'name': 'Stale', 'version': '2000-01-01T00:00:00+00:00'})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['current']['version'], version)
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.name, 'Renamed')
+
+    def test_invalid_values_are_refused_before_writing(self):
+        for data in ({'access_level': 'bogus'}, {'order': 'first'}, {'section_id': 999999}, {'name': ''}):
+            response = self.post(data)
+            self.assertEqual(response.status_code, 400, data)
+            self.assertFalse(response.json()['success'])
+        self.card.refresh_from_db()
+        self.assertEqual((self.card.access_level, self.card.name), ('public', 'Card'))
+
+    def test_current_version_writes_only_changed_fields(self):
+        version = self.post({}).json()['version']
+        response = self.post({'name': 'Renamed', 'url': self.card.url, 'version': version})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['changed'], ['name'])
+
+
+class ExportTests(TestCase):
+    databases = {'default', 'analytics'}
+
+    def setUp(self):
+        User.objects.create_user('staff', password='secret', is_staff=True)
+        self.client.login(username='staff', password='secret')
+
+    def test_file_is_named_from_the_parsed_quarter(self):
+        response = self.client.get('/api/analytics/export/?quarter=2025q3%0A')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="clicks-2025Q3.csv"')
+        response.close()
+
+    def test_malformed_quarter_is_a_bad_request(self):
+        response = self.client.get('/api/analytics/export/?quarter=2025Q3%22%0D%0AX-Injected:%201')
+        self.assertEqual(response.status_code, 400)
+
+    def test_non_numeric_factory_is_a_bad_request(self):
+        response = self.client.get('/api/analytics/export/?factory=abc')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(TRUSTED_PROXIES=('10.0.0.0/8',))
+class ClientIpTests(SimpleTestCase):
+    def test_forwarded_for_from_a_client_is_ignored(self):
+        meta = {'REMOTE_ADDR': '203.0.113.7', 'HTTP_X_FORWARDED_FOR': '198.51.100.1'}
+        self.assertEqual(client_ip(meta), '203.0.113.7')
+
+    def test_forwarded_for_from_a_trusted_proxy_is_honoured(self):
+        meta = {'REMOTE_ADDR': '10.0.0.2', 'HTTP_X_FORWARDED_FOR': '203.0.113.7'}
+        self.assertEqual(client_ip(meta), '203.0.113.7')
+
+    def test_hops_prepended_by_the_client_are_ignored(self):
+        meta = {'REMOTE_ADDR': '10.0.0.2', 'HTTP_X_FORWARDED_FOR': '198.51.100.1, 203.0.113.7, 10.0.0.3'}
+        self.assertEqual(client_ip(meta), '203.0.113.7')
+
+
+@override_settings(CACHES=LOCMEM)
+class ClickBeaconTests(TransactionTestCase):
+    # The async view reads on portal.executor's threads, which must see committed rows
+    databases = {'default', 'analytics'}
+
+    def setUp(self):
+        self.card = make_card()
+        self.client = Client(enforce_csrf_checks=True)
+        User.objects.create_user('visitor', password='secret')
+        self.client.login(username='visitor', password='secret')
+        self.url = f'/api/cards/{self.card.pk}/track/'
+
+    def test_cross_site_click_is_refused(self):
+        self.assertEqual(self.client.post(self.url).status_code, 403)
+
+    def test_click_with_csrf_token_is_accepted(self):
+        # What a pre-rendered page does before its first click
+        self.assertEqual(self.client.get('/api/csrf/').status_code, 204)
+        token = self.client.cookies['csrftoken'].value
+        response = self.client.post(self.url, HTTP_X_CSRFTOKEN=token)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['success'])
@@ -0,0 +1,210 @@
+"""
+Live "most used right now" cards.
+
+Clicks from track_click feed Space-Saving heavy-hitter summaries kept in
+process memory, so memory stays bounded (CAPACITY counters per bucket) no
+matter how many cards or clicks there are. Each scope (all cards, the home
+page, one factory) keeps a ring of time buckets per sliding window; a window
+query merges the buckets still inside it.
+
+Every worker periodically folds the clicks it saw since its last checkpoint
+into the TrendingCheckpoint rows and reloads the merged result, so workers
+converge on the same view and a restart resumes from the last checkpoint.
+Each row is written with a compare-and-swap on its version, as workers
+checkpoint concurrently. A checkpoint that fails (say, the database is
+locked) keeps the clicks for the next one and never fails the click batch
+that triggered it.
+"""
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from django.utils import timezone
+
+from .models import TrendingCheckpoint
+from .routers import analytics_db
+
+
+logger = logging.getLogger(__name__)
+
+CAPACITY = 50
+
+# window name -> (span, bucket width) in seconds
+WINDOWS = {
+    'hour': (3600, 300),
+    'day': (86400, 3600),
+}
+
+
+class SpaceSaving:
+    """Space-Saving summary: counts are over-estimates by at most their error"""
+    __slots__ = ('capacity', 'counters')
+
+    def __init__(self, capacity=CAPACITY, counters=None):
+        self.capacity = capacity
+        self.counters = counters or {}  # item -> [count, error]
+
+    def _floor(self):
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(count for count, _ in self.counters.values())
+
+    def add(self, item, weight=1):
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += weight
+        elif len(self.counters) < self.capacity:
+            self.counters[item] = [weight, 0]
+        else:
+            victim = min(self.counters, key=lambda k: self.counters[k][0])
+            floor = self.counters.pop(victim)[0]
+            self.counters[item] = [floor + weight, floor]
+
+    def merge(self, other):
+        """Fold another summary in, keeping the over-estimate guarantee"""
+        mine, theirs = self._floor(), other._floor()
+        merged = {}
+        for item in set(self.counters) | set(other.counters):
+            count, error = self.counters.get(item, (mine, mine))
+            other_count, other_error = other.counters.get(item, (theirs, theirs))
+            merged[item] = [count + other_count, error + other_error]
+        if len(merged) > self.capacity:
+            top = sorted(merged, key=lambda k: merged[k][0], reverse=True)[:self.capacity]
+            merged = {item: merged[item] for item in top}
+        self.counters = merged
+        return self
+
+    def top(self, limit):
+        """[(item, count, error)] with the highest counts first"""
+        ranked = sorted(self.counters.items(), key=lambda kv: kv[1][0], reverse=True)
+        return [(item, count, error) for item, (count, error) in ranked[:limit]]
+
+
+def _decode(state):
+    return {int(start): SpaceSaving(counters={int(k): v for k, v in counters.items()})
+            for start, counters in json.loads(state).items()}
+
+
+def _encode(buckets):
+    return json.dumps({start: summary.counters for start, summary in buckets.items()}, separators=(',', ':'))
+
+
+def _in_window(start, window, now):
+    span, width = WINDOWS[window]
+    return start + width > now - span
+
+
+def _prune(buckets, window, now):
+    for start in [start for start in buckets if not _in_window(start, window, now)]:
+        del buckets[start]
+
+
+def _add(buckets, delta):
+    for start, summary in delta.items():
+        buckets.setdefault(start, SpaceSaving()).merge(summary)
+
+
+def _fold(key, delta, now):
+    """Merge a scope/window's new clicks into its row, retrying when another worker wrote it first"""
+    scope, window = key
+    while True:
+        row = TrendingCheckpoint.objects.filter(scope=scope, window=window).first()
+        buckets = _decode(row.state) if row else {}
+        _add(buckets, delta)
+        _prune(buckets, window, now)
+        if row is None:
+            try:
+                with transaction.atomic(using=analytics_db()):
+                    TrendingCheckpoint.objects.create(scope=scope, window=window, state=_encode(buckets))
+                return
+            except IntegrityError:
+                continue  # created meanwhile by another worker
+        if TrendingCheckpoint.objects.filter(pk=row.pk, version=row.version).update(
+                state=_encode(buckets), version=row.version + 1, updated_at=timezone.now()):
+            return
+
+
+class TrendingTracker:
+    """Per-process heavy-hitter state; use the module-level ``tracker``"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._view = None   # (scope, window) -> {bucket_start: SpaceSaving}, merged with other workers
+        self._delta = {}    # same shape, clicks not yet checkpointed
+        self._last_checkpoint = 0
+
+    def _load(self):
+        self._view = {(row.scope, row.window): _decode(row.state) for row in TrendingCheckpoint.objects.all()}
+        self._last_checkpoint = time.time()
+
+    @staticmethod
+    def scopes(factory_id):
+        return ('global', 'factory:%s' % factory_id if factory_id else 'home')
+
+    def record(self, card_id, factory_id, weight=1, now=None):
+        now = now or time.time()
+        with self._lock:
+            if self._view is None:
+                self._load()
+            for scope in self.scopes(factory_id):
+                for window, (_, width) in WINDOWS.items():
+                    start = int(now // width * width)
+                    for state in (self._view, self._delta):
+                        buckets = state.setdefault((scope, window), {})
+                        buckets.setdefault(start, SpaceSaving()).add(card_id, weight)
+            due = now - self._last_checkpoint >= getattr(settings, 'TRENDING_CHECKPOINT_SECONDS', 60)
+        if due:
+            try:
+                self.checkpoint()
+            except DatabaseError:
+                logger.warning('Trending checkpoint failed, retrying with the next one', exc_info=True)
+
+    def checkpoint(self):
+        """Fold this worker's new clicks into the shared checkpoint rows and reload them"""
+        now = time.time()
+        with self._lock:
+            pending, self._delta = self._delta, {}
+            # Also on failure: the next attempt waits a full interval
+            self._last_checkpoint = now
+        try:
+            for key in list(pending):
+                _fold(key, pending[key], now)
+                del pending[key]
+            rows = list(TrendingCheckpoint.objects.all())
+        finally:
+            with self._lock:
+                # Clicks not written yet stay for the next checkpoint
+                for key, delta in pending.items():
+                    _add(self._delta.setdefault(key, {}), delta)
+        view = {(row.scope, row.window): _decode(row.state) for row in rows}
+        with self._lock:
+            # Clicks recorded while the rows were written are not in them yet
+            for key, delta in self._delta.items():
+                _add(view.setdefault(key, {}), delta)
+            self._view = view
+
+    def top(self, scope, window='hour', limit=10, now=None):
+        """[(card_id, count, error)] for the scope over the sliding window"""
+        now = now or time.time()
+        with self._lock:
+            if self._view is None:
+                self._load()
+            total = SpaceSaving()
+            for start, summary in self._view.get((scope, window), {}).items():
+                if _in_window(start, window, now):
+                    total.merge(summary)
+        return total.top(limit)
+
+
+tracker = TrendingTracker()
+
+
+def trending_cards(view, factory_id=None, window='hour', limit=5, scope=None):
+    """[(card, count, error)] from the navigation view (see portal.navigation) for the scope"""
+    scope = scope or TrendingTracker.scopes(factory_id)[1]
+    ranked = ((view.cards_by_id.get(card_id), count, error)
+              for card_id, count, error in tracker.top(scope, window, CAPACITY))
+    return [entry for entry in ranked if entry[0] is not None][:limit]
@@ -30,12 +30,28 @@ urlpatterns = [
     url(r'^api/sections/create/$', create_section, name='create_section'),
     url(r'^api/sections/(?P<section_id>\d+)/update/$', update_section, name='update_section'),
     url(r'^api/sections/(?P<section_id>\d+)/delete/$', delete_section, name='delete_section'),
+    url(r'^api/sections/(?P<section_id>\d+)/cards/$', section_cards, name='section_cards'),
 
     # Card management
     url(r'^api/cards/create/$', create_card, name='create_card'),
     url(r'^api/cards/(?P<card_id>\d+)/update/$', update_card, name='update_card'),
     url(r'^api/cards/(?P<card_id>\d+)/delete/$', delete_card, name='delete_card'),
     url(r'^api/cards/(?P<card_id>\d+)/track/$', track_click, name='track_click'),
+    url(r'^api/csrf/$', csrf_cookie, name='csrf_cookie'),
+
+    # Analytics
+    url(r'^api/trending/$', trending, name='trending'),
+    url(r'^api/analytics/export/$', export_analytics, name='export_analytics'),
+
+    # Incremental sync
+    url(r'^api/changes/$', change_feed, name='change_feed'),
+
+    # Status (async, see enterprise_portal/asgi.py)
+    url(r'^api/health/$', health, name='health'),
+    url(r'^api/version/$', version_poll, name='version_poll'),
 
     url(r'^home/', portal_home, name='home'),
+
+    # Offline shell (see portal.offline)
+    url(r'^sw\.js$', service_worker, name='service_worker'),
 ]
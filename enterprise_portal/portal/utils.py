@@ -1,27 +1,59 @@
+from django.conf import settings
+from django.template import engines
 from django.utils.translation import get_language
 from collections.abc import Iterable
 
 
+# Access levels visible to each tier of user
+ACCESS_TIERS = {
+    'anonymous': ('public',),
+    'authenticated': ('public', 'authenticated'),
+    'staff': ('public', 'authenticated', 'admin'),
+}
+
+
+def access_tier(user):
+    """Name of the ACCESS_TIERS entry that applies to the user"""
+    if not user.is_authenticated:
+        return 'anonymous'
+    return 'staff' if user.is_staff else 'authenticated'
+
+
+def template_engine(view_name):
+    """Template engine alias for a view: 'jinja2' when listed in PORTAL_JINJA2_VIEWS, else the default"""
+    if view_name in getattr(settings, 'PORTAL_JINJA2_VIEWS', ()) and 'jinja2' in engines:
+        return 'jinja2'
+    return None
+
+
+def language_suffix(lang):
+    """Field suffix of the translated columns for a language code, None for the base columns"""
+    lang_map = {
+        "vi": "vi",
+        "zh-hant": "zh_hant",
+        "zh-hans": "zh_hans",
+    }
+    return lang_map.get((lang or "en").lower())
+
+
+def translated(obj, lang):
+    """(name, description) of obj in the given language, falling back to the base columns"""
+    suffix = language_suffix(lang)
+    if suffix:
+        return (getattr(obj, f"name_{suffix}", None) or obj.name,
+                getattr(obj, f"description_{suffix}", None) or obj.description)
+    return obj.name, obj.description
+
+
 def translate(objs):
     """
     Translate one object or many objects (QuerySet, list)
     that have name and description fields with language suffixes.
     """
     lang = get_language() or "en"
-    lang_map = {
-        "vi": "vi",
-        "zh-hant": "zh_hant",
-        "zh-hans": "zh_hans",
-    }
-    suffix = lang_map.get(lang.lower())
 
     def _translate_single(obj):
-        if suffix:
-            obj.translated_name = getattr(obj, f"name_{suffix}", None) or obj.name
-            obj.translated_description = getattr(obj, f"description_{suffix}", None) or obj.description
-        else:
-            obj.translated_name = obj.name
-            obj.translated_description = obj.description
+        obj.translated_name, obj.translated_description = translated(obj, lang)
         return obj
 
     # Handle multiple (QuerySet, list, tuple, etc.)
@@ -30,3 +62,4 @@ def translate(objs):
 
     # Handle single object
     return _translate_single(objs)
+
@@ -1,13 +1,57 @@
+import asyncio
+import math
+import time
 from datetime import datetime
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
-from django.http import JsonResponse
+from django.conf import settings as django_settings
+from django.core.exceptions import FieldDoesNotExist, ObjectDoesNotExist, ValidationError
+from django.db import connections, transaction
+from django.db.models import Count
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.utils.translation import get_language
+from django.views.decorators.csrf import ensure_csrf_cookie
 from django.views.decorators.http import require_http_methods
+from django.views.static import serve
 import json
-from .models import PortalSection, SystemCard, FactoryButton, PortalSettings, PortalAnalytics
-from portal.utils import translate
+from .models import PortalSection, SystemCard, FactoryButton, PortalSettings
+from portal.utils import access_tier, template_engine
+from portal.visibility import user_group_ids
+from portal.navigation import content_version, current as current_navigation
+from portal.frequency import frequent_cards
+from portal.trending import WINDOWS, trending_cards
+from portal.clicks import batcher as click_batcher
+from portal.ingest import click_filter, client_ip
+from portal.executor import run_sync
+from portal import fragments, journal
+from portal.offline import NETWORK_ONLY, SESSION_PATHS, precache_manifest
+from portal.storage import immutable_cache_control
+from portal.exports import export_rows, parse_quarter, stream_csv, stream_xlsx
+
+
+LONG_POLL_SECONDS = getattr(django_settings, 'LONG_POLL_SECONDS', 25)
+VERSION_POLL_SECONDS = 1
+
+# Edit mode loads cards a page at a time, per section
+CARD_PAGE_SIZE = 60
+MAX_CARD_PAGE_SIZE = 200
+
+# Fields the edit modals are filled from (the client-side store in edit_mode.html)
+FACTORY_EDIT_FIELDS = ('id', 'name', 'name_vi', 'name_zh_hant', 'name_zh_hans',
+                       'description', 'description_vi', 'description_zh_hant', 'description_zh_hans',
+                       'url', 'icon', 'background_color', 'text_color', 'is_active', 'access_level', 'order')
+SECTION_EDIT_FIELDS = ('id', 'name', 'name_vi', 'name_zh_hant', 'name_zh_hans',
+                       'description', 'description_vi', 'description_zh_hant', 'description_zh_hans',
+                       'icon', 'color', 'is_active', 'order')
+CARD_EDIT_FIELDS = ('id', 'section_id', 'name', 'name_vi', 'name_zh_hant', 'name_zh_hans',
+                    'description', 'description_vi', 'description_zh_hant', 'description_zh_hans',
+                    'url', 'icon', 'icon_color', 'status', 'is_active', 'is_external', 'access_level', 'order')
+EDIT_FIELDS = {FactoryButton: FACTORY_EDIT_FIELDS, PortalSection: SECTION_EDIT_FIELDS, SystemCard: CARD_EDIT_FIELDS}
+# Never taken from a posted update
+READ_ONLY_FIELDS = ('created_at', 'updated_at', 'updated_by')
 
 
 def is_admin(user):
@@ -15,125 +59,83 @@ def is_admin(user):
     return user.is_authenticated and user.is_staff
 
 
-def portal_home(request):
-    """Main portal homepage"""
-    settings = PortalSettings.get_settings()
+def _edit_fields(obj, fields):
+    return {field: getattr(obj, field) for field in fields}
 
-    # if settings.maintenance_mode and not request.user.is_staff:
-    #     return render(request, 'portal/maintenance.html', {'settings': settings})
-
-    # Get active sections and cards
-    sections = PortalSection.objects.filter(factory=None, is_active=True).prefetch_related('cards')
-
-    # Filter cards based on user access level
-    for section in sections:
-        if request.user.is_authenticated:
-            if request.user.is_staff:
-                # Admin can see all cards
-                section.filtered_cards = section.cards.filter(is_active=True)
-            else:
-                # Authenticated users can see public and authenticated cards
-                section.filtered_cards = section.cards.filter(
-                    is_active=True,
-                    access_level__in=['public', 'authenticated']
-                )
-        else:
-            # Anonymous users can only see public cards
-            section.filtered_cards = section.cards.filter(
-                is_active=True,
-                access_level='public'
-            )
-
-    # Get quick access buttons
-    if request.user.is_authenticated:
-        if request.user.is_staff:
-            factory_buttons = FactoryButton.objects.filter(is_active=True)
-        else:
-            factory_buttons = FactoryButton.objects.filter(
-                is_active=True,
-                access_level__in=['public', 'authenticated']
-            )
-    else:
-        factory_buttons = FactoryButton.objects.filter(
-            is_active=True,
-            access_level='public'
-        )
 
-    factory_buttons = translate(factory_buttons)
-    sections = translate(sections)
-    for section in sections:
-        section.filtered_cards = translate(section.filtered_cards)
+def _edit_store_entry(obj, fields):
+    return {**_edit_fields(obj, fields), 'version': _version(obj)}
 
-    context = {
-        'settings': settings,
-        'sections': sections,
-        'factory_buttons': factory_buttons,
+
+def home_context(request):
+    """Context of the home page, shared with the static pre-renderer"""
+    navigation = current_navigation()
+    view = navigation.view(get_language(), access_tier(request.user), user_group_ids(request.user))
+
+    # Sections, cards and factory buttons come pre-translated and pre-filtered
+    # for the user's access tier from the navigation snapshot
+    return {
+        'settings': navigation.settings,
+        'sections': view.home_sections,
+        'factory_buttons': view.factories,
+        'frequent_cards': frequent_cards(request.user, view),
+        'trending_cards': trending_cards(view, scope='global'),
+        'is_edit_mode': request.GET.get('edit') == '1' and request.user.is_staff,
+    }
+
+
+def factory_context(request, factory_id):
+    """Context of a factory page, shared with the static pre-renderer"""
+    navigation = current_navigation()
+    factory_data = navigation.factory(get_language(), factory_id)
+    if factory_data is None:
+        raise Http404("Factory not found")
+    view = navigation.view(get_language(), access_tier(request.user), user_group_ids(request.user))
+
+    return {
+        'settings': navigation.settings,
+        'sections': view.sections_for(factory_id),
+        'factory': factory_data,
+        'factory_id': factory_id,
+        'trending_cards': trending_cards(view, factory_id=factory_id),
         'is_edit_mode': request.GET.get('edit') == '1' and request.user.is_staff,
     }
 
-    return render(request, 'portal/home.html', context)
+
+def portal_home(request):
+    """Main portal homepage"""
+    return render(request, 'portal/home.html', home_context(request), using=template_engine('home'))
 
 
 def factory(request):
     """Main portal homepage"""
-    factory_id = request.GET.get("id", 1)
-    factory_data = FactoryButton.objects.get(pk=factory_id)
-    settings = PortalSettings.get_settings()
+    try:
+        factory_id = int(request.GET.get("id", 1))
+    except ValueError:
+        raise Http404("Factory not found")
+
+    return render(request, 'portal/factory.html', factory_context(request, factory_id),
+                  using=template_engine('factory'))
 
-    # if settings.maintenance_mode and not request.user.is_staff:
-    #     return render(request, 'portal/maintenance.html', {'settings': settings})
-
-    # Get active sections and cards
-    sections = PortalSection.objects.filter(factory_id=factory_id, is_active=True).prefetch_related('cards')
-
-    # Filter cards based on user access level
-    for section in sections:
-        if request.user.is_authenticated:
-            if request.user.is_staff:
-                # Admin can see all cards
-                section.filtered_cards = section.cards.filter(is_active=True)
-            else:
-                # Authenticated users can see public and authenticated cards
-                section.filtered_cards = section.cards.filter(
-                    is_active=True,
-                    access_level__in=['public', 'authenticated']
-                )
-        else:
-            # Anonymous users can only see public cards
-            section.filtered_cards = section.cards.filter(
-                is_active=True,
-                access_level='public'
-            )
-
-    # Get quick access buttons
-    if request.user.is_authenticated:
-        if request.user.is_staff:
-            factory_buttons = FactoryButton.objects.filter(is_active=True)
-        else:
-            factory_buttons = FactoryButton.objects.filter(
-                is_active=True,
-                access_level__in=['public', 'authenticated']
-            )
-    else:
-        factory_buttons = FactoryButton.objects.filter(
-            is_active=True,
-            access_level='public'
-        )
 
-    factory_data = translate(factory_data)
-    sections = translate(sections)
-    for section in sections:
-        section.filtered_cards = translate(section.filtered_cards)
+def serve_media(request, path, document_root=None):
+    """Development media server; content-addressed files are marked immutable"""
+    return immutable_cache_control(serve(request, path, document_root=document_root), path)
 
+
+def service_worker(request):
+    """Service worker of the offline shell, with this visitor's precache manifest"""
     context = {
-        'settings': settings,
-        'sections': sections,
-        'factory': factory_data,
-        'factory_id': factory_id,
-        'is_edit_mode': request.GET.get('edit') == '1' and request.user.is_staff,
+        'manifest': json.dumps(precache_manifest(request)),
+        'network_only': json.dumps(NETWORK_ONLY),
+        'session_paths': json.dumps(SESSION_PATHS),
+        'page_paths': json.dumps([reverse('home'), reverse('factory')]),
     }
-
-    return render(request, 'portal/factory.html', context)
+    response = render(request, 'portal/service_worker.js', context, content_type='application/javascript')
+    # Browsers compare the script on every navigation; it must never come from the HTTP cache
+    response['Cache-Control'] = 'no-cache, private'
+    response['Service-Worker-Allowed'] = '/'
+    return response
 
 
 def portal_login_view(request):
@@ -166,11 +168,14 @@ def edit_mode(request):
     factory_data = None
     if factory_id:
         factory_data = FactoryButton.objects.get(pk=factory_id)
-        sections = PortalSection.objects.filter(factory_id=factory_id).prefetch_related('cards')
+        sections = PortalSection.objects.filter(factory_id=factory_id)
     else:
-        sections = PortalSection.objects.filter(factory=None).prefetch_related('cards')
+        sections = PortalSection.objects.filter(factory=None)
 
-    factory_buttons = FactoryButton.objects.all()
+    # Only the section skeleton is rendered; cards are fetched per section
+    # from section_cards as the sections scroll into view
+    sections = list(sections.annotate(card_count=Count('cards')))
+    factory_buttons = list(FactoryButton.objects.all())
     settings = PortalSettings.get_settings()
 
     context = {
@@ -180,11 +185,42 @@ def edit_mode(request):
         'factory_buttons': factory_buttons,
         'factory_id': factory_id,
         'factory_data': factory_data,
+        'card_page_size': CARD_PAGE_SIZE,
+        'edit_store': {
+            'factories': {factory.id: _edit_store_entry(factory, FACTORY_EDIT_FIELDS) for factory in factory_buttons},
+            'sections': {section.id: _edit_store_entry(section, SECTION_EDIT_FIELDS) for section in sections},
+        },
     }
 
     return render(request, 'portal/edit_mode.html', context)
 
 
+@user_passes_test(is_admin)
+@require_http_methods(["GET"])
+def section_cards(request, section_id):
+    """One page of a section's cards for edit mode"""
+    section = get_object_or_404(PortalSection, id=section_id)
+    try:
+        offset = max(int(request.GET.get('offset', 0)), 0)
+        limit = min(max(int(request.GET.get('limit', CARD_PAGE_SIZE)), 1), MAX_CARD_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'offset and limit must be integers'}, status=400)
+
+    cards = section.cards.all()
+    total = cards.count()
+    page = list(cards.values(*CARD_EDIT_FIELDS, 'updated_at')[offset:offset + limit])
+    for card in page:
+        card['version'] = card.pop('updated_at').isoformat()
+    next_offset = offset + len(page)
+    return JsonResponse({
+        'success': True,
+        'section_id': section.id,
+        'total': total,
+        'cards': page,
+        'next_offset': next_offset if next_offset < total else None,
+    })
+
+
 @user_passes_test(is_admin)
 @require_http_methods(["POST"])
 def update_settings(request):
@@ -223,6 +259,70 @@ def update_settings(request):
         return JsonResponse({'success': False, 'error': str(e)})
 
 
+def _version(obj):
+    """Optimistic concurrency token of an editable row"""
+    return obj.updated_at.isoformat()
+
+
+def _invalid(error, field=None):
+    """400 response for a rejected update"""
+    if isinstance(error, ValidationError):
+        errors = error.message_dict if hasattr(error, 'error_dict') else {field or '__all__': error.messages}
+    else:
+        errors = {field or '__all__': [str(error)]}
+    message = '; '.join(f'{name}: {" ".join(messages)}' for name, messages in errors.items())
+    return JsonResponse({'success': False, 'error': message, 'errors': errors}, status=400)
+
+
+def _partial_update(request, model, pk, data, message):
+    """
+    Write only the posted fields whose value changed.
+
+    A posted `version` (as handed out with the row) is a precondition: if
+    the row was saved since, nothing is written and the current values come
+    back with a 409. Without one the update is last-writer-wins, as before.
+    The changed fields are validated (choices, validators, foreign keys)
+    before anything is written; invalid values are a 400.
+    """
+    expected = data.pop('version', None)
+    with transaction.atomic():
+        obj = get_object_or_404(model.objects.select_for_update(), pk=pk)
+        if expected is not None and expected != _version(obj):
+            return JsonResponse({
+                'success': False,
+                'conflict': True,
+                'error': 'Changed by someone else since you opened it, reload to see their changes',
+                'current': {**_edit_fields(obj, EDIT_FIELDS[model]), 'version': _version(obj)},
+            }, status=409)
+
+        changed = []
+        for name, value in data.items():
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if not field.concrete or not field.editable or field.primary_key or field.name in READ_ONLY_FIELDS:
+                continue
+            try:
+                value = field.to_python(value)
+            except ValidationError as e:
+                return _invalid(e, field.name)
+            if getattr(obj, field.attname) != value:
+                setattr(obj, field.attname, value)
+                changed.append(field.attname)
+
+        if changed:
+            try:
+                obj.full_clean(exclude=[field.name for field in model._meta.fields if field.attname not in changed],
+                               validate_unique=False)
+            except (ValidationError, ObjectDoesNotExist) as e:
+                return _invalid(e)
+            obj.updated_by = request.user
+            obj.save(update_fields=changed + ['updated_by', 'updated_at'])
+
+    return JsonResponse({'success': True, 'message': message, 'changed': changed, 'version': _version(obj)})
+
+
 @user_passes_test(is_admin)
 @require_http_methods(["POST"])
 def create_factory(request):
@@ -278,16 +378,7 @@ def update_factory(request, factory_id):
     """Update factory button"""
     try:
         data = json.loads(request.body)
-        factory = get_object_or_404(FactoryButton, id=factory_id)
-
-        for field, value in data.items():
-            if hasattr(factory, field):
-                setattr(factory, field, value)
-
-        factory.updated_by = request.user
-        factory.save()
-
-        return JsonResponse({'success': True, 'message': 'Factory updated successfully'})
+        return _partial_update(request, FactoryButton, factory_id, data, 'Factory updated successfully')
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)})
 
@@ -363,33 +454,17 @@ def update_section(request, section_id):
     """Update portal section"""
     try:
         data = json.loads(request.body)
-        section = get_object_or_404(PortalSection, id=section_id)
-
-        for field, value in data.items():
-            if field == "factory":
-                try:
-                    value = get_object_or_404(FactoryButton, pk=value)
-                except:
-                    value = None
-                setattr(section, field, value)
-
-            elif field == "is_active":
-                try:
-                    if data.get('is_active') == 'on':
-                        value = True
-                    else:
-                        value = False
-                except:
-                    value = False
-                setattr(section, field, value)
 
-            elif hasattr(section, field):
-                setattr(section, field, value)
+        if "factory" in data:
+            try:
+                data["factory"] = FactoryButton.objects.only('pk').get(pk=data["factory"]).pk
+            except (FactoryButton.DoesNotExist, ValueError, TypeError):
+                data["factory"] = None
 
-        section.updated_by = request.user
-        section.save()
+        if "is_active" in data:
+            data["is_active"] = data["is_active"] in ('on', True)
 
-        return JsonResponse({'success': True, 'message': 'Section updated successfully'})
+        return _partial_update(request, PortalSection, section_id, data, 'Section updated successfully')
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)})
 
@@ -461,16 +536,7 @@ def update_card(request, card_id):
     """Update system card"""
     try:
         data = json.loads(request.body)
-        card = get_object_or_404(SystemCard, id=card_id)
-
-        for field, value in data.items():
-            if hasattr(card, field):
-                setattr(card, field, value)
-
-        card.updated_by = request.user
-        card.save()
-
-        return JsonResponse({'success': True, 'message': 'Card updated successfully'})
+        return _partial_update(request, SystemCard, card_id, data, 'Card updated successfully')
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)})
 
@@ -487,27 +553,199 @@ def delete_card(request, card_id):
         return JsonResponse({'success': False, 'error': str(e)})
 
 
-@require_http_methods(["POST"])
-def track_click(request, card_id):
-    """Track card clicks for analytics"""
-    try:
-        card = get_object_or_404(SystemCard, id=card_id)
+def _click_context(request, card_id):
+    """(card view, user id) of a click, resolved on the database pool"""
+    return current_navigation().card(card_id), request.user.pk
 
-        # Get client IP
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip_address = x_forwarded_for.split(',')[0]
-        else:
-            ip_address = request.META.get('REMOTE_ADDR')
-
-        # Create analytics record
-        PortalAnalytics.objects.create(
-            card=card,
-            user=request.user if request.user.is_authenticated else None,
-            ip_address=ip_address,
-            user_agent=request.META.get('HTTP_USER_AGENT', '')
-        )
 
-        return JsonResponse({'success': True})
+async def track_click(request, card_id):
+    """Track card clicks for analytics"""
+    # Native async view: Django 3.2 decorators are sync only, hence the inline method check
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        card, user_id = await run_sync(_click_context, request, int(card_id))
+        if card is None:
+            return JsonResponse({'success': False, 'error': 'Card not found'})
+
+        # Client IP: X-Forwarded-For only counts when sent by a trusted proxy
+        ip_address = client_ip(request.META)
+
+        # Bots, double-clicks and floods are dropped; under overload clicks are sampled (see portal.ingest)
+        user_agent = request.META.get('HTTP_USER_AGENT', '')
+        verdict, weight, retry_after = click_filter.check(card.id, user_id, ip_address, user_agent,
+                                                          request.META, click_batcher.pending())
+        if verdict == 'rate_limited':
+            response = JsonResponse({'success': False, 'error': 'Too many clicks'}, status=429)
+            response['Retry-After'] = str(math.ceil(retry_after))
+            return response
+        if verdict != 'ok':
+            return JsonResponse({'success': True, 'recorded': False, 'reason': verdict})
+
+        # Rows and aggregates are written in batches off the request (see portal.clicks)
+        click_batcher.submit(card.id, card.factory_id, user_id, ip_address, user_agent, weight)
+
+        return JsonResponse({'success': True, 'recorded': True})
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)})
+
+
+@ensure_csrf_cookie
+@require_http_methods(["GET"])
+def csrf_cookie(request):
+    """Set the CSRF cookie for pre-rendered pages, which are served without one"""
+    response = HttpResponse(status=204)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+def _health_checks():
+    databases = {}
+    for alias in connections:
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute('SELECT 1')
+            databases[alias] = 'ok'
+        except Exception as e:
+            databases[alias] = str(e)
+    return databases, content_version()
+
+
+async def health(request):
+    """Liveness and database readiness for load balancers"""
+    databases, version = await run_sync(_health_checks)
+    healthy = all(state == 'ok' for state in databases.values())
+    return JsonResponse({
+        'status': 'ok' if healthy else 'error',
+        'databases': databases,
+        'content_version': version,
+        'pending_clicks': click_batcher.pending(),
+        'click_filter': click_filter.stats(),
+        'section_fragments': fragments.stats(),
+    }, status=200 if healthy else 503)
+
+
+_version_checked = (0.0, None)
+
+
+async def _current_version():
+    """content_version() read at most once a second per process, however many pollers wait"""
+    global _version_checked
+    checked_at, version = _version_checked
+    if time.monotonic() - checked_at >= VERSION_POLL_SECONDS:
+        version = await run_sync(content_version)
+        _version_checked = (time.monotonic(), version)
+    return version
+
+
+async def version_poll(request):
+    """Long-poll: answers once the content version differs from ?since, or on timeout"""
+    since = request.GET.get('since', '')
+    try:
+        timeout = min(float(request.GET.get('timeout', LONG_POLL_SECONDS)), LONG_POLL_SECONDS)
+    except ValueError:
+        timeout = LONG_POLL_SECONDS
+
+    deadline = time.monotonic() + timeout
+    version = await _current_version()
+    while str(version) == since and time.monotonic() < deadline:
+        await asyncio.sleep(VERSION_POLL_SECONDS)
+        version = await _current_version()
+    return JsonResponse({'version': str(version), 'changed': str(version) != since})
+
+
+@require_http_methods(["GET"])
+def trending(request):
+    """Most used cards right now, globally or for one factory"""
+    window = request.GET.get('window', 'hour')
+    if window not in WINDOWS:
+        return JsonResponse({'success': False, 'error': f'Unknown window: {window}'}, status=400)
+    try:
+        limit = min(int(request.GET.get('limit', 10)), 50)
+    except ValueError:
+        limit = 10
+
+    factory_id = request.GET.get('factory')
+    view = current_navigation().view(get_language(), access_tier(request.user), user_group_ids(request.user))
+    try:
+        cards = trending_cards(view, factory_id=int(factory_id) if factory_id else None, window=window,
+                               limit=limit, scope=None if factory_id else 'global')
+    except ValueError:
+        return JsonResponse({'success': False, 'error': f'Invalid factory: {factory_id}'}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'window': window,
+        'cards': [
+            {
+                'id': card.id,
+                'name': card.translated_name,
+                'url': card.url,
+                'icon': card.icon,
+                'icon_color': card.icon_color,
+                'count': count,
+                'error': error,
+            }
+            for card, count, error in cards
+        ]
+    })
+
+
+@user_passes_test(is_admin)
+@require_http_methods(["GET"])
+def change_feed(request):
+    """Catalogue and settings changes after the ?since= cursor (see portal.journal)"""
+    if 'since' not in request.GET:
+        # Take a cursor before downloading the full catalogue, then follow the feed from it
+        return JsonResponse({'cursor': journal.head(), 'changes': [], 'more': False})
+    try:
+        since = int(request.GET['since'])
+        limit = min(max(int(request.GET.get('limit', django_settings.CHANGE_FEED_PAGE_SIZE)), 1),
+                    django_settings.CHANGE_FEED_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'since and limit must be integers'}, status=400)
+
+    try:
+        changes, cursor, more = journal.changes_since(since, limit)
+    except journal.CursorExpired as e:
+        # Deletes after the cursor were compacted away: download the catalogue again
+        return JsonResponse({'success': False, 'reset': True, 'floor': e.floor, 'cursor': journal.head(),
+                             'error': str(e)}, status=410)
+    return JsonResponse({'cursor': cursor, 'changes': changes, 'more': more})
+
+
+@user_passes_test(is_admin)
+@require_http_methods(["GET"])
+def export_analytics(request):
+    """Stream raw click analytics as CSV or XLSX, optionally per factory and period"""
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in ('csv', 'xlsx'):
+        return JsonResponse({'success': False, 'error': f'Unknown format: {export_format}'}, status=400)
+
+    try:
+        start = end = None
+        label = datetime.now().strftime('%Y%m%d')
+        if request.GET.get('quarter'):
+            start, end = parse_quarter(request.GET['quarter'])
+            # Named from the parsed quarter: the raw parameter may hold quotes or line breaks
+            label = f'{start.year}Q{(start.month + 2) // 3}'
+        if request.GET.get('start'):
+            start = datetime.strptime(request.GET['start'], '%Y-%m-%d').date()
+        if request.GET.get('end'):
+            end = datetime.strptime(request.GET['end'], '%Y-%m-%d').date()
+        # Checked here: once streaming starts a bad value could only truncate the file
+        factory_id = int(request.GET['factory']) if request.GET.get('factory') else None
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    rows = export_rows(factory_id=factory_id, start=start, end=end)
+    filename = f'clicks-{label}.{export_format}'
+    if export_format == 'csv':
+        response = StreamingHttpResponse(stream_csv(rows), content_type='text/csv; charset=utf-8')
+    else:
+        response = StreamingHttpResponse(
+            stream_xlsx(rows),
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
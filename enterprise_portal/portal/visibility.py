@@ -0,0 +1,32 @@
+"""
+Group memberships of portal users, for group-restricted factories, sections
+and cards.
+
+The navigation snapshot (portal.navigation) is pre-filtered per set of
+groups, so a request only needs the user's own group ids. They are cached
+here, so page views never join through auth_user_groups. A membership change
+only drops the cache entries of the users involved (see portal.signals); the
+snapshot is recompiled only when the groups of a factory, section or card
+change.
+"""
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+
+CACHE_KEY = 'portal:user-groups:{}'
+
+
+def user_group_ids(user):
+    """frozenset of the user's group ids, empty for anonymous users"""
+    if not user.is_authenticated:
+        return frozenset()
+    key = CACHE_KEY.format(user.pk)
+    groups = cache.get(key)
+    if groups is None:
+        groups = frozenset(User.groups.through.objects.filter(user_id=user.pk).values_list('group_id', flat=True))
+        cache.set(key, groups, None)
+    return groups
+
+
+def forget_user_groups(user_ids):
+    cache.delete_many([CACHE_KEY.format(user_id) for user_id in user_ids])
@@ -0,0 +1,125 @@
+"""
+Worker warm-up.
+
+A fresh worker pays on its first requests for importing the URLconf and the
+views behind it, compiling templates, loading the gettext catalogs of every
+language, reading PortalSettings and compiling the navigation snapshot.
+warm_up() does all of that up front and reports what each step cost.
+
+Under gunicorn (see gunicorn.conf.py) the master runs warm_up() once after
+preloading the application and then freezes the heap, so forked workers
+share the warmed objects copy-on-write; each worker only opens its own
+database connections (connect()).
+
+Compiled templates are only kept with the cached template loader, which
+Django enables whenever DEBUG is off and gunicorn.conf.py configures
+explicitly (PORTAL_CACHED_TEMPLATES). Without it the templates step only
+checks that the templates compile, and says so in its report.
+"""
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.template import engines
+from django.template.loaders.cached import Loader as CachedLoader
+from django.urls import get_resolver, reverse
+from django.utils import translation
+
+
+logger = logging.getLogger(__name__)
+
+
+def _urls():
+    get_resolver().url_patterns  # imports every urls module and the views they reference
+    reverse('home')  # populates the reverse lookup tables
+
+
+def _template_dirs(engine):
+    if hasattr(engine, 'engine'):
+        # Django templates: wherever its loaders look (APP_DIRS is off when loaders are configured)
+        return [directory for loader in engine.engine.template_loaders if hasattr(loader, 'get_dirs')
+                for directory in loader.get_dirs()]
+    return engine.template_dirs
+
+
+def _project_templates():
+    """Template names under the project's own template directories (not site-packages)"""
+    base_dir = os.path.abspath(settings.BASE_DIR)
+    for engine in engines.all():
+        for directory in _template_dirs(engine):
+            directory = os.path.abspath(directory)
+            if not directory.startswith(base_dir) or not os.path.isdir(directory):
+                continue
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    if name.endswith('.html'):
+                        yield engine, os.path.relpath(os.path.join(root, name), directory).replace(os.sep, '/')
+
+
+def _templates():
+    count = 0
+    for engine, name in _project_templates():
+        engine.get_template(name)
+        count += 1
+    if not any(isinstance(loader, CachedLoader) for loader in engines['django'].engine.template_loaders):
+        return f'{count}, not cached'
+    return count
+
+
+def _translations():
+    for lang, _ in settings.LANGUAGES:
+        with translation.override(lang):
+            translation.gettext('Home')
+    return len(settings.LANGUAGES)
+
+
+def _portal_settings():
+    from .models import PortalSettings
+    PortalSettings.get_settings()
+
+
+def _navigation():
+    from .navigation import current
+    snapshot = current()
+    return len(snapshot.views)
+
+
+def connect():
+    """Open a connection to every configured database"""
+    for alias in connections:
+        connections[alias].ensure_connection()
+    return len(connections.databases)
+
+
+STEPS = (
+    ('urls', _urls),
+    ('templates', _templates),
+    ('translations', _translations),
+    ('portal settings', _portal_settings),
+    ('navigation', _navigation),
+)
+
+
+def warm_up(connect_databases=False):
+    """Run every warm-up step; returns [(step, seconds, detail)]"""
+    steps = STEPS + (('databases', connect),) if connect_databases else STEPS
+    report = []
+    for name, step in steps:
+        started = time.perf_counter()
+        try:
+            detail = step()
+        except Exception:
+            # A failed step only means a slower first request, never a dead worker
+            logger.exception('Warm-up step %s failed', name)
+            detail = 'failed'
+        report.append((name, time.perf_counter() - started, detail))
+    return report
+
+
+def format_report(report):
+    lines = [f'{name:<16} {seconds * 1000:8.1f} ms' + (f'  ({detail})' if detail is not None else '')
+             for name, seconds, detail in report]
+    lines.append(f"{'total':<16} {sum(seconds for _, seconds, _ in report) * 1000:8.1f} ms")
+    return lines